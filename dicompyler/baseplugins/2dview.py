@@ -8,13 +8,13 @@
 #    available at https://github.com/bastula/dicompyler/
 #
 
+import time
 import wx
 from wx.xrc import XmlResource, XRCCTRL, XRCID
 from wx.lib.pubsub import pub
-from matplotlib import _cntr as cntr
-from matplotlib import __version__ as mplversion
 import numpy as np
 from dicompyler import guiutil, util
+from dicompyler import contourutil, dosegrid, imageutil, pixelmap
 
 def pluginProperties():
     """Properties of the plugin."""
@@ -62,6 +62,7 @@ class plugin2DView(wx.Panel):
         self.window = 0
         self.level = 0
         self.zoom = 1
+        self.minzoom = 0.25
         self.pan = [0, 0]
         self.bwidth = 0
         self.bheight = 0
@@ -73,7 +74,28 @@ class plugin2DView(wx.Panel):
         self.isodose_fill_opacity = 25
         self.structure_line_style = 'Solid'
         self.structure_fill_opacity = 50
+        self.colorwash = False
+        self.colorwash_opacity = 40
+        self.colorwash_threshold = 10
+        self.colorwashsource = None
         self.plugins = {}
+        self.isodosecache = None
+        self.contourcache = contourutil.ContourCache()
+        self.renderer = imageutil.ImageRenderer()
+        self.cinerenderer = imageutil.ImageRenderer()
+        self.layers = guiutil.LayerCache()
+        self.wldrag = False
+        self.wldragsubsample = 2
+        self.redraw = guiutil.RedrawScheduler(self)
+        self.motion_rate = 60
+        self.motionevent = None
+        self.motion = guiutil.RedrawScheduler(
+            self, self.OnProcessMouseMotion, self.motion_rate)
+        self.cine = False
+        self.cine_fps = 15
+        self.cineframes = None
+        self.cinetimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnCineTimer, self.cinetimer)
 
         # Setup toolbar controls
         if guiutil.IsGtk():
@@ -82,10 +104,13 @@ class plugin2DView(wx.Panel):
             drawingstyles = ['Solid', 'Transparent', 'Dot', 'Dash', 'Dot Dash']
         zoominbmp = wx.Bitmap(util.GetResourcePath('magnifier_zoom_in.png'))
         zoomoutbmp = wx.Bitmap(util.GetResourcePath('magnifier_zoom_out.png'))
+        cinebmp = wx.ArtProvider.GetBitmap(
+            wx.ART_GO_FORWARD, wx.ART_TOOLBAR, (16, 16))
         toolsbmp = wx.Bitmap(util.GetResourcePath('cog.png'))
         self.tools = []
         self.tools.append({'label':"Zoom In", 'bmp':zoominbmp, 'shortHelp':"Zoom In", 'eventhandler':self.OnZoomIn})
         self.tools.append({'label':"Zoom Out", 'bmp':zoomoutbmp, 'shortHelp':"Zoom Out", 'eventhandler':self.OnZoomOut})
+        self.tools.append({'label':"Cine", 'bmp':cinebmp, 'shortHelp':"Start / Stop Cine", 'eventhandler':self.OnCine})
         self.tools.append({'label':"Tools", 'bmp':toolsbmp, 'shortHelp':"Tools", 'eventhandler':self.OnToolsMenu})
 
         # Set up preferences
@@ -112,7 +137,35 @@ class plugin2DView(wx.Panel):
                'values':[0, 100],
               'default':50,
                 'units':'%',
-             'callback':'2dview.drawingprefs.structure_fill_opacity'}]
+             'callback':'2dview.drawingprefs.structure_fill_opacity'},
+                {'name':'Dose Colorwash',
+                 'type':'checkbox',
+              'default':False,
+             'callback':'2dview.drawingprefs.colorwash'},
+                {'name':'Colorwash Opacity',
+                 'type':'range',
+               'values':[0, 100],
+              'default':40,
+                'units':'%',
+             'callback':'2dview.drawingprefs.colorwash_opacity'},
+                {'name':'Colorwash Threshold',
+                 'type':'range',
+               'values':[0, 100],
+              'default':10,
+                'units':'%',
+             'callback':'2dview.drawingprefs.colorwash_threshold'},
+                {'name':'Maximum Mouse Update Rate',
+                 'type':'range',
+               'values':[10, 240],
+              'default':60,
+                'units':'Hz',
+             'callback':'2dview.drawingprefs.motion_rate'},
+                {'name':'Cine Frame Rate',
+                 'type':'range',
+               'values':[1, 60],
+              'default':15,
+                'units':'fps',
+             'callback':'2dview.drawingprefs.cine_fps'}]
             }]
 
         # Set up pubsub
@@ -122,14 +175,26 @@ class plugin2DView(wx.Panel):
         pub.subscribe(self.OnRefresh, '2dview.refresh')
         pub.subscribe(self.OnDrawingPrefsChange, '2dview.drawingprefs')
         pub.subscribe(self.OnPluginLoaded, 'plugin.loaded.2dview')
+        pub.subscribe(self.OnColorwashChange, '2dview.colorwash')
         pub.sendMessage('preferences.requested.values', msg='2dview.drawingprefs')
 
     def OnUpdatePatient(self, msg):
         """Update and load the patient data."""
 
+        self.StopCine()
         self.z = 0
         self.structurepixlut = ([], [])
         self.dosepixlut = ([], [])
+        self.dosepixindex = ([], [])
+        self.slicevalues = None
+        self.imdata = (None, None)
+        self.imagebitmap = (None, None)
+        self.pyramid = util.LRUCache(16)
+        self.contourcache.Clear()
+        self.layers.Invalidate()
+        self.colorwashplanes = util.LRUCache(32)
+        self.colorwashbitmap = (None, None)
+        self.colorwashsource = None
         if 'images' in msg:
             self.images = msg['images']
             self.imagenum = 1
@@ -142,14 +207,22 @@ class plugin2DView(wx.Panel):
             self.window, self.level = image.GetDefaultImageWindowLevel()
             # Dose display depends on whether we have images loaded or not
             self.isodoses = {}
+            if self.isodosecache:
+                self.isodosecache.Stop()
+                self.isodosecache = None
             if ('dose' in msg and \
                 ("PixelData" in msg['dose'].ds)):
                 self.dose = msg['dose']
-                self.dosedata = self.dose.GetDoseData()
                 # First get the dose grid LUT
                 doselut = self.dose.GetPatientToPixelLUT()
                 # Then convert dose grid LUT into an image pixel LUT
                 self.dosepixlut = self.GetDoseGridPixelData(self.structurepixlut, doselut)
+                # Precompute the closest dose grid index for each image pixel
+                self.dosepixindex = self.GetDoseGridPixelIndex(
+                    self.structurepixlut, self.dosepixlut)
+                # Cache the traced isodose lines for each dose plane
+                self.isodosecache = contourutil.IsodoseCache(
+                    self.dose, self.dosepixlut)
             else:
                 self.dose = []
             if 'plan' in msg:
@@ -196,6 +269,7 @@ class plugin2DView(wx.Panel):
             pub.unsubscribe(self.OnKeyDown, 'main.key_down')
             pub.unsubscribe(self.OnMouseWheel, 'main.mousewheel')
         pub.unsubscribe(self.OnRefresh, '2dview.refresh')
+        self.StopCine()
 
     def OnDestroy(self, evt):
         """Unbind to all events before the plugin is destroyed."""
@@ -205,21 +279,29 @@ class plugin2DView(wx.Panel):
         pub.unsubscribe(self.OnIsodoseCheck, 'isodoses.checked')
         pub.unsubscribe(self.OnDrawingPrefsChange, '2dview.drawingprefs')
         pub.unsubscribe(self.OnPluginLoaded, 'plugin.loaded.2dview')
+        pub.unsubscribe(self.OnColorwashChange, '2dview.colorwash')
+        self.redraw.Cancel()
+        self.motion.Cancel()
+        self.StopCine()
+        if self.isodosecache:
+            self.isodosecache.Stop()
         # self.OnUnfocus()
 
     def OnStructureCheck(self, msg):
         """When the structure list changes, update the panel."""
 
         self.structures = msg
+        self.layers.Invalidate('overlay')
         self.SetFocus()
-        self.Refresh()
+        self.redraw.Schedule()
 
     def OnIsodoseCheck(self, msg):
         """When the isodose list changes, update the panel."""
 
         self.isodoses = msg
+        self.layers.Invalidate('overlay')
         self.SetFocus()
-        self.Refresh()
+        self.redraw.Schedule()
 
     def OnDrawingPrefsChange(self, topic, msg):
         """When the drawing preferences change, update the drawing styles."""
@@ -232,7 +314,34 @@ class plugin2DView(wx.Panel):
             self.structure_line_style = msg
         elif (topic[1] == 'structure_fill_opacity'):
             self.structure_fill_opacity = msg
-        self.Refresh()
+        elif (topic[1] == 'colorwash'):
+            self.colorwash = msg
+        elif (topic[1] == 'colorwash_opacity'):
+            self.colorwash_opacity = msg
+        elif (topic[1] == 'colorwash_threshold'):
+            self.colorwash_threshold = msg
+        elif (topic[1] == 'motion_rate'):
+            # The mouse update rate does not affect the drawing
+            self.motion_rate = msg
+            self.motion.rate = msg
+            return
+        elif (topic[1] == 'cine_fps'):
+            self.cine_fps = msg
+            if self.cine:
+                self.StartCine()
+            return
+        self.layers.Invalidate('overlay')
+        self.redraw.Schedule()
+
+    def OnColorwashChange(self, msg):
+        """Show a colorwash of another grid on the dose grid geometry, such
+            as a gamma map, with the given 'min' and 'max' values. The dose
+            colorwash is shown again if the message is None."""
+
+        self.colorwashsource = msg
+        self.colorwashplanes = util.LRUCache(32)
+        self.colorwashbitmap = (None, None)
+        self.redraw.Schedule()
 
     def OnPluginLoaded(self, msg):
         """When a 2D View-dependent plugin is loaded, initialize the plugin."""
@@ -240,8 +349,10 @@ class plugin2DView(wx.Panel):
         name = msg.pluginProperties()['name']
         self.plugins[name] = msg.plugin(self)
 
-    def DrawStructure(self, structure, gc, position, prone, feetfirst):
-        """Draw the given structure on the panel."""
+    def DrawStructure(self, structure, gc, position, prone, feetfirst,
+                      region=None):
+        """Draw the given structure on the panel, skipping the contours
+            outside of the given region."""
 
         # Create an indexing array of z positions of the structure data
         # to compare with the image z position
@@ -273,34 +384,30 @@ class plugin2DView(wx.Panel):
                 style=self.GetLineDrawingStyle(self.structure_line_style)))
             # Create the path for the contour
             path = gc.CreatePath()
-            for contour in structure['planes'][list(structure['zkeys'])[index]]:
-                if (contour['type'] == u"CLOSED_PLANAR"):
-                    # Convert the structure data to pixel data
-                    pixeldata = self.GetContourPixelData(
-                        self.structurepixlut, contour['data'], prone, feetfirst)
-
-                    # Move the origin to the last point of the contour
-                    point = pixeldata[-1]
-                    path.MoveToPoint(point[0], point[1])
-
-                    # Add each contour point to the path
-                    for point in pixeldata:
-                        path.AddLineToPoint(point[0], point[1])
-                    # Close the subpath in preparation for the next contour
-                    path.CloseSubpath()
+            zkey = list(structure['zkeys'])[index]
+
+            def convert():
+                polylines = []
+                for contour in structure['planes'][zkey]:
+                    if (contour['type'] == u"CLOSED_PLANAR"):
+                        # Convert the structure data to pixel data
+                        polylines.append(np.array(self.GetContourPixelData(
+                            self.structurepixlut, contour['data'],
+                            prone, feetfirst)))
+                return polylines
+
+            # Only draw the detail that is visible at the current zoom
+            polylines = self.contourcache.GetPolylines(
+                (structure['id'], zkey), self.zoom, convert)
+            self.AddPolylinesToPath(path, polylines, region)
             # Draw the path
             gc.DrawPath(path)
 
-    def DrawIsodose(self, isodose, gc, isodosegen):
-        """Draw the given structure on the panel."""
+    def DrawIsodose(self, isodose, gc, isodoselines, region=None):
+        """Draw the given isodose on the panel, skipping the lines outside
+            of the given region."""
 
-        # Calculate the isodose level according to rx dose and dose grid scaling
-        level = isodose['data']['level'] * self.rxdose / (self.dosedata['dosegridscaling'] * 10000)
-        contours = isodosegen.trace(level)
-        # matplotlib 1.0.0 and above returns vertices and segments, but we only need vertices
-        if (mplversion >= "1.0.0"):
-            contours = contours[:len(contours)//2]
-        if len(contours):
+        if len(isodoselines):
 
             # Set the color of the isodose line
             color = wx.Colour(isodose['color'][0], isodose['color'][1],
@@ -311,21 +418,47 @@ class plugin2DView(wx.Panel):
 
             # Create the drawing path for the isodose line
             path = gc.CreatePath()
-            # Draw each contour for the isodose line
-            for c in contours:
-                # Move the origin to the last point of the contour
-                path.MoveToPoint(
-                    self.dosepixlut[0][int(c[-1][0])]+1, self.dosepixlut[1][int(c[-1][1])]+1)
-                # Add a line to the rest of the points
-                # Note: draw every other point since there are too many points
-                for p in c[::2]:
-                    path.AddLineToPoint(
-                        self.dosepixlut[0][int(p[0])]+1, self.dosepixlut[1][int(p[1])]+1)
-                # Close the subpath in preparation for the next contour
-                path.CloseSubpath()
+            self.AddPolylinesToPath(path,
+                [contourutil.decimate_polyline(polyline, 1 / self.zoom)
+                 for polyline in isodoselines], region)
             # Draw the final isodose path
             gc.DrawPath(path)
 
+    def AddPolylinesToPath(self, path, polylines, region=None):
+        """Add each polyline (an array of pixel coordinates) to the drawing
+            path as a closed subpath. Polylines outside of the region are
+            skipped."""
+
+        for polyline in polylines:
+            if not contourutil.polyline_in_region(polyline, region):
+                continue
+            # Convert the whole array at once rather than point by point
+            points = polyline.tolist()
+            # Move the origin to the first point of the contour
+            path.MoveToPoint(points[0][0], points[0][1])
+            # Add a line to the rest of the points
+            for x, y in points[1:]:
+                path.AddLineToPoint(x, y)
+            # Close the subpath in preparation for the next contour
+            path.CloseSubpath()
+
+    def GetIsodoseLevel(self, isodose):
+        """Return the absolute dose level (cGy) of the given isodose."""
+
+        return isodose['data']['level'] * self.rxdose / 100
+
+    def GetNeighborPositions(self, count=2):
+        """Return the slice positions of the images neighboring the
+            current image, nearest first."""
+
+        positions = []
+        for n in range(1, count+1):
+            for i in [self.imagenum-1-n, self.imagenum-1+n]:
+                if (0 <= i < len(self.images)):
+                    positions.append(float('%.2f' %
+                        self.images[i].ds.ImagePositionPatient[2]))
+        return positions
+
     def GetLineDrawingStyle(self, style):
         """Convert the stored line drawing style into wxWidgets pen drawing format."""
 
@@ -376,6 +509,167 @@ class plugin2DView(wx.Panel):
         y = (np.array(doselut[1]) - pixlut[1][0]) * prone / spacing[1]
         return (x, y)
 
+    def GetDoseGridPixelIndex(self, pixlut, dosepixlut):
+        """Determine the closest dose grid column and row for each image
+            pixel column and row."""
+
+        x = np.argmin(np.fabs(np.arange(len(pixlut[0]))[:, np.newaxis] -
+            np.asarray(dosepixlut[0])[np.newaxis, :]), axis=1)
+        y = np.argmin(np.fabs(np.arange(len(pixlut[1]))[:, np.newaxis] -
+            np.asarray(dosepixlut[1])[np.newaxis, :]), axis=1)
+        return (x, y)
+
+    def GetSliceValues(self):
+        """Return the rescaled pixel plane and the dose plane (in Gy) of the
+            current image, which are cached until the image changes."""
+
+        if (self.slicevalues is None) or \
+            not (self.slicevalues[0] == self.imagenum):
+            image = self.images[self.imagenum-1]
+            slope, intercept = imageutil.get_rescale(image.ds)
+            pixel_array = pixelmap.get_image_pixels(image.ds)
+            # Rescale the slope and intercept of the image if present
+            if ('RescaleIntercept' in image.ds and
+                'RescaleSlope' in image.ds):
+                pixel_array = pixel_array * slope + intercept
+            doseplane = []
+            if not (self.dose == []):
+                z = image.ds.ImagePositionPatient[2]
+                doseplane = self.dose.GetDosePlane(float('%.2f' % z))
+            self.slicevalues = (self.imagenum, pixel_array, doseplane)
+        return self.slicevalues[1:]
+
+    def GetVisibleRegion(self, width, height, transx, transy, tile=64):
+        """Return the (xmin, ymin, xmax, ymax) region of the current image
+            that is visible in the view, expanded to a multiple of the tile
+            size so that it only changes after panning across a tile."""
+
+        xmin = max(int(np.floor(-transx / tile)) * tile, 0)
+        ymin = max(int(np.floor(-transy / tile)) * tile, 0)
+        xmax = min(int(np.ceil((width / self.zoom - transx) / tile)) * tile,
+                   self.bwidth)
+        ymax = min(int(np.ceil((height / self.zoom - transy) / tile)) * tile,
+                   self.bheight)
+        if (xmax <= xmin) or (ymax <= ymin):
+            return None
+        return (xmin, ymin, xmax, ymax)
+
+    def GetOverlayExtent(self, width, height, transx, transy, padding=0.1,
+                         maxpixels=2**23):
+        """Return the (xmin, ymin, xmax, ymax) extent of the current image
+            that the structure and isodose layer covers. This is the image
+            padded by a fraction of its size, so that panning does not redraw
+            the layer, unless the layer would exceed the maximum number of
+            pixels at the current zoom. Then it is the visible region."""
+
+        padx = int(np.ceil(self.bwidth * padding))
+        pady = int(np.ceil(self.bheight * padding))
+        extent = (-padx, -pady, self.bwidth + padx, self.bheight + pady)
+        if ((extent[2] - extent[0]) * (extent[3] - extent[1]) *
+                self.zoom ** 2 <= maxpixels):
+            return extent
+        return self.GetVisibleRegion(width, height, transx, transy)
+
+    def GetPyramidPixels(self, image, level):
+        """Return the pixel data of the current image at the given
+            resolution pyramid level, which is cached for recent images."""
+
+        if not level:
+            return pixelmap.get_image_pixels(image.ds)
+        key = (self.imagenum, level)
+        pixels = self.pyramid.get(key)
+        if pixels is None:
+            pixels = imageutil.downsample(
+                pixelmap.get_image_pixels(image.ds), 2 ** level)
+            self.pyramid[key] = pixels
+        return pixels
+
+    def GetImageBitmap(self, image, region):
+        """Return the bitmap of the given region of the current image with
+            the current window and level, which is cached until any of them
+            change. The region that the bitmap covers is also returned."""
+
+        # Only monochrome images are rendered at a reduced level of detail,
+        # and the pre-rendered cine frames always cover the whole image
+        if self.cine or not image.ds.PhotometricInterpretation in \
+            ['MONOCHROME1', 'MONOCHROME2']:
+            region = (0, 0, self.bwidth, self.bheight)
+        level = imageutil.get_pyramid_level(
+            self.zoom, (self.bheight, self.bwidth))
+        key = (self.imagenum, self.window, self.level, self.wldrag,
+               level, region)
+        if not (self.imagebitmap[0] == key):
+            frame = None
+            if self.cine:
+                frame = self.cineframes.Get(self.imagenum-1,
+                                            self.GetCineFrameKey())
+            if frame is not None:
+                bmp = guiutil.convert_array_to_wx(frame)
+            else:
+                bmp = self.RenderImageBitmap(image, level, region)
+            self.imagebitmap = (key, bmp)
+        return self.imagebitmap[1], region
+
+    def RenderImageBitmap(self, image, level=0, region=None):
+        """Render the given region of the image at the given resolution
+            pyramid level with the current window and level."""
+
+        # Monochrome images are rendered directly from the pixel data
+        if image.ds.PhotometricInterpretation in ['MONOCHROME1', 'MONOCHROME2']:
+            slope, intercept = imageutil.get_rescale(image.ds)
+            pixels = self.GetPyramidPixels(image, level)
+            # Only render the visible region of the image
+            if region:
+                step = 2 ** level
+                pixels = pixels[region[1]//step:-(-region[3]//step),
+                                region[0]//step:-(-region[2]//step)]
+            # Render at a reduced resolution while the window / level is
+            # being dragged, since the bitmap is scaled to the image size
+            if self.wldrag and (min(pixels.shape) >= 256):
+                step = self.wldragsubsample
+                pixels = pixels[::step, ::step]
+            return guiutil.convert_array_to_wx(self.renderer.Render(
+                pixels, self.window, self.level, slope, intercept))
+        # Otherwise fall back to the PIL based conversion
+        else:
+            return wx.Bitmap(guiutil.convert_pil_to_wx(
+                image.GetImage(self.window, self.level)))
+
+    def GetColorwashBitmap(self, image):
+        """Return the dose colorwash of the current image as a transparent
+            bitmap on the image pixel grid."""
+
+        key = (self.imagenum, self.colorwash_opacity,
+               self.colorwash_threshold, self.rxdose)
+        source = self.colorwashsource
+        if not (self.colorwashbitmap[0] == key):
+            # Resample the dose plane onto the image grid once per slice
+            z = float('%.2f' % image.ds.ImagePositionPatient[2])
+            plane = self.colorwashplanes.get(z)
+            if plane is None:
+                dose = source['dose'] if source else self.dose
+                plane = dose.GetDosePlane(z)
+                if len(plane):
+                    plane = dosegrid.resample_dose_plane(
+                        plane, self.dosepixlut, (image.ds.Rows, image.ds.Columns))
+                self.colorwashplanes[z] = plane
+            bmp = None
+            if len(plane):
+                if source:
+                    vmin, vmax = source['min'], source['max']
+                else:
+                    # Scale the colors from the threshold up to the maximum
+                    maxdose = self.dose.GetMaxDose()
+                    refdose = self.rxdose / 100 if self.rxdose else maxdose
+                    vmin = refdose * self.colorwash_threshold / 100
+                    vmax = maxdose
+                rgba = imageutil.apply_colormap(plane, vmin, vmax,
+                    imageutil.get_colormap_lut(),
+                    self.colorwash_opacity / 100)
+                bmp = guiutil.convert_array_to_wx(rgba)
+            self.colorwashbitmap = (key, bmp)
+        return self.colorwashbitmap[1]
+
     def OnPaint(self, evt):
         """Update the panel when it needs to be refreshed."""
 
@@ -403,10 +697,14 @@ class plugin2DView(wx.Panel):
 
         # If we have images loaded, process and show the image
         if len(self.images):
-            # Save the original drawing state
-            gc.PushState()
-            # Scale the image by the zoom factor
-            gc.Scale(self.zoom, self.zoom)
+            image = self.images[self.imagenum-1]
+            imdata = self.GetCurrentImageData()
+            self.z = '%.2f' % imdata['position'][2]
+            self.bwidth, self.bheight = image.ds.Columns, image.ds.Rows
+
+            # Center the image
+            transx = self.pan[0]+(width-self.bwidth*self.zoom)/(2*self.zoom)
+            transy = self.pan[1]+(height-self.bheight*self.zoom)/(2*self.zoom)
 
             # Redraw the background on Windows
             if guiutil.IsMSWindows():
@@ -414,76 +712,48 @@ class plugin2DView(wx.Panel):
                 gc.SetPen(wx.Pen(wx.Colour(0, 0, 0)))
                 gc.DrawRectangle(0, 0, width, height)
 
-            image = guiutil.convert_pil_to_wx(
-                self.images[self.imagenum-1].GetImage(self.window, self.level))
-            bmp = wx.Bitmap(image)
-            self.bwidth, self.bheight = image.GetSize()
-
-            # Center the image
-            transx = self.pan[0]+(width-self.bwidth*self.zoom)/(2*self.zoom)
-            transy = self.pan[1]+(height-self.bheight*self.zoom)/(2*self.zoom)
+            # Draw the base layer, which consists of the cached image
+            # and dose colorwash bitmaps
+            region = self.GetVisibleRegion(width, height, transx, transy)
+            gc.PushState()
+            gc.Scale(self.zoom, self.zoom)
             gc.Translate(transx, transy)
-            gc.DrawBitmap(bmp, 0, 0, self.bwidth, self.bheight)
-            gc.SetBrush(wx.Brush(wx.Colour(0, 0, 255, 30)))
-            gc.SetPen(wx.Pen(wx.Colour(0, 0, 255, 30)))
-
-            # Draw the structures if present
-            imdata = self.images[self.imagenum-1].GetImageData()
-            self.z = '%.2f' % imdata['position'][2]
-
-            # Determine whether the patient is prone or supine
-            if 'p' in imdata['patientposition'].lower():
-                prone = True
-            else:
-                prone = False
-            # Determine whether the patient is feet first or head first
-            if 'ff' in imdata['patientposition'].lower():
-                feetfirst = True
-            else:
-                feetfirst = False
-            for id, structure in self.structures.items():
-                self.DrawStructure(structure, gc, self.z, prone, feetfirst)
-
-            # Draw the isodoses if present
-            if len(self.isodoses):
-                grid = self.dose.GetDoseGrid(float(self.z))
-                if not (grid == []):
-                    x, y = np.meshgrid(
-                        np.arange(grid.shape[1]), np.arange(grid.shape[0]))
-                    # Instantiate the isodose generator for this slice
-                    isodosegen = cntr.Cntr(x, y, grid)
-                    for id, isodose in iter(sorted(self.isodoses.items())):
-                        self.DrawIsodose(isodose, gc, isodosegen)
-
-            # Restore the translation and scaling
+            if region:
+                bmp, (x0, y0, x1, y1) = self.GetImageBitmap(image, region)
+                gc.DrawBitmap(bmp, x0, y0, x1 - x0, y1 - y0)
+            # Draw the dose colorwash over the image if enabled
+            if (self.colorwash or self.colorwashsource) and \
+                not (self.dose == []):
+                cwbmp = self.GetColorwashBitmap(image)
+                if cwbmp:
+                    gc.DrawBitmap(cwbmp, 0, 0, self.bwidth, self.bheight)
             gc.PopState()
 
-            # Prepare the font for drawing the information text
-            font = wx.SystemSettings.GetFont(wx.SYS_DEFAULT_GUI_FONT)
-            if guiutil.IsMac():
-                font.SetPointSize(10)
-            gc.SetFont(font, wx.WHITE)
-
-            # Draw the information text
-            imtext = "Image: " + str(self.imagenum) + "/" + str(len(self.images))
-            te = gc.GetFullTextExtent(imtext)
-            gc.DrawText(imtext, 10, 7)
-            impos = "Position: " + str(self.z) + " mm"
-            gc.DrawText(impos, 10, 7+te[1]*1.1)
-            if ("%.3f" % self.zoom == "1.000"):
-                zoom = "1"
-            else:
-                zoom = "%.3f" % self.zoom
-            imzoom = "Zoom: " + zoom + ":1"
-            gc.DrawText(imzoom, 10, height-17)
-            imsize = "Image Size: " + str(self.bheight) + "x" + str(self.bwidth) + " px"
-            gc.DrawText(imsize, 10, height-17-te[1]*1.1)
-            imwinlevel = "W/L: " + str(self.window) + ' / ' + str(self.level)
-            te = gc.GetFullTextExtent(imwinlevel)
-            gc.DrawText(imwinlevel, width-te[0]-7, 7)
-            impatpos = "Patient Position: " + imdata['patientposition']
-            te = gc.GetFullTextExtent(impatpos)
-            gc.DrawText(impatpos, width-te[0]-7, height-17)
+            # Draw the structure and isodose layer, which covers the padded
+            # image and is only redrawn if the image, the zoom or the
+            # structures / isodoses have changed. Panning only moves it.
+            extent = self.GetOverlayExtent(width, height, transx, transy)
+            if extent:
+                x0, y0, x1, y1 = extent
+                overlay = self.layers.GetLayer('overlay',
+                    (self.imagenum, self.zoom, extent),
+                    (int(np.ceil((x1 - x0) * self.zoom)),
+                     int(np.ceil((y1 - y0) * self.zoom))),
+                    lambda lgc: self.DrawOverlayLayer(
+                        lgc, -x0, -y0, imdata, extent))
+                if overlay:
+                    gc.DrawBitmap(overlay,
+                        int(round((transx + x0) * self.zoom)),
+                        int(round((transy + y0) * self.zoom)),
+                        overlay.GetWidth(), overlay.GetHeight())
+
+            # Draw the information text layer, which is only redrawn if
+            # the text has changed
+            text = self.GetInformationText(imdata)
+            hud = self.layers.GetLayer('hud', text, (width, height),
+                lambda lgc: self.DrawInformationLayer(lgc, text, width, height))
+            if hud:
+                gc.DrawBitmap(hud, 0, 0, width, height)
 
             # Send message with the current image number and various properties
             pub.sendMessage('2dview.updated.image',
@@ -499,6 +769,90 @@ class plugin2DView(wx.Panel):
                              'patientpixlut':self.structurepixlut})
                                                         # pat to pixel coord LUT
 
+    def GetCurrentImageData(self):
+        """Return the image data of the current image, which is cached
+            until the image changes."""
+
+        if not (self.imdata[0] == self.imagenum):
+            self.imdata = (self.imagenum,
+                           self.images[self.imagenum-1].GetImageData())
+        return self.imdata[1]
+
+    def DrawOverlayLayer(self, gc, transx, transy, imdata, region=None):
+        """Draw the structures and isodoses of the current image within the
+            given region of the image, which starts at the origin of the
+            layer when translated by transx and transy."""
+
+        # Scale the layer in the same way as the image
+        gc.Scale(self.zoom, self.zoom)
+        gc.Translate(transx, transy)
+
+        # Determine whether the patient is prone or supine
+        if 'p' in imdata['patientposition'].lower():
+            prone = True
+        else:
+            prone = False
+        # Determine whether the patient is feet first or head first
+        if 'ff' in imdata['patientposition'].lower():
+            feetfirst = True
+        else:
+            feetfirst = False
+        # Draw the structures if present
+        for id, structure in self.structures.items():
+            self.DrawStructure(structure, gc, self.z, prone, feetfirst,
+                               region)
+
+        # Draw the isodoses if present
+        if len(self.isodoses) and self.isodosecache:
+            levels = [self.GetIsodoseLevel(isodose)
+                      for isodose in self.isodoses.values()]
+            # Only trace isodose lines that have not been cached
+            isodoselines = self.isodosecache.GetIsodoses(
+                float(self.z), levels)
+            for id, isodose in iter(sorted(self.isodoses.items())):
+                self.DrawIsodose(isodose, gc,
+                    isodoselines[self.GetIsodoseLevel(isodose)], region)
+            # Trace the neighboring slices in the background
+            self.isodosecache.Precompute(
+                self.GetNeighborPositions(), levels)
+
+    def GetInformationText(self, imdata):
+        """Return the information text for each corner of the view."""
+
+        imtext = "Image: " + str(self.imagenum) + "/" + str(len(self.images))
+        impos = "Position: " + str(self.z) + " mm"
+        if ("%.3f" % self.zoom == "1.000"):
+            zoom = "1"
+        else:
+            zoom = "%.3f" % self.zoom
+        imzoom = "Zoom: " + zoom + ":1"
+        imsize = "Image Size: " + str(self.bheight) + "x" + str(self.bwidth) + " px"
+        imwinlevel = "W/L: " + str(self.window) + ' / ' + str(self.level)
+        impatpos = "Patient Position: " + imdata['patientposition']
+        return (imtext, impos, imzoom, imsize, imwinlevel, impatpos)
+
+    def DrawInformationLayer(self, gc, text, width, height):
+        """Draw the information text of the current image."""
+
+        imtext, impos, imzoom, imsize, imwinlevel, impatpos = text
+
+        # Prepare the font for drawing the information text
+        font = wx.SystemSettings.GetFont(wx.SYS_DEFAULT_GUI_FONT)
+        if guiutil.IsMac():
+            font.SetPointSize(10)
+        gc.SetFont(font, wx.WHITE)
+
+        # Draw the information text
+        te = gc.GetFullTextExtent(imtext)
+        gc.DrawText(imtext, 10, 7)
+        gc.DrawText(impos, 10, 7+te[1]*1.1)
+        gc.DrawText(imzoom, 10, height-17)
+        gc.DrawText(imsize, 10, height-17-te[1]*1.1)
+        te = gc.GetFullTextExtent(imwinlevel)
+        gc.DrawText(imwinlevel, width-te[0]-7, 7)
+        te = gc.GetFullTextExtent(impatpos)
+        gc.DrawText(impatpos, width-te[0]-7, height-17)
+
     def OnSize(self, evt):
         """Refresh the view when the size of the panel changes."""
 
@@ -508,7 +862,7 @@ class plugin2DView(wx.Panel):
     def OnRefresh(self, msg):
         """Refresh the view when it is requested by a plugin."""
 
-        self.Refresh()
+        self.redraw.Schedule()
 
     def OnUpdatePositionValues(self, evt=None):
         """Update the current position and value(s) of the mouse cursor."""
@@ -547,29 +901,20 @@ class plugin2DView(wx.Panel):
                 " mm / X: " + str(xpos) + \
                 " px Y:" + str(ypos) + " px"
 
-            # Lookup the current image and find the value of the current pixel
-            image = self.images[self.imagenum-1]
-            # Rescale the slope and intercept of the image if present
-            if ('RescaleIntercept' in image.ds and
-                'RescaleSlope' in image.ds):
-                pixel_array = image.ds.pixel_array*image.ds.RescaleSlope + \
-                              image.ds.RescaleIntercept
-            else:
-                pixel_array = image.ds.pixel_array
+            # Lookup the cached planes of the current image
+            pixel_array, doseplane = self.GetSliceValues()
+            # Find the value of the current pixel
             value = "Value: " + str(pixel_array[ypos, xpos])
 
-            # Lookup the current dose plane and find the value of the current
-            # pixel, if the dose has been loaded
-            if not (self.dose == []):
-                xdpos = np.argmin(np.fabs(np.array(self.dosepixlut[0]) - xpos))
-                ydpos = np.argmin(np.fabs(np.array(self.dosepixlut[1]) - ypos))
-                dosegrid = self.dose.GetDoseGrid(float(self.z))
-                if not (dosegrid == []):
-                    dose = dosegrid[ydpos, xdpos] * \
-                           self.dosedata['dosegridscaling']
-                    value = value + " / Dose: " + \
-                            str('%.4g' % dose) + " Gy / " + \
-                            str('%.4g' % float(dose*10000/self.rxdose)) + " %"
+            # Find the dose value of the current pixel via the closest
+            # dose grid index, if the dose has been loaded
+            if len(doseplane):
+                xdpos = self.dosepixindex[0][xpos]
+                ydpos = self.dosepixindex[1][ypos]
+                dose = doseplane[ydpos, xdpos]
+                value = value + " / Dose: " + \
+                        str('%.4g' % dose) + " Gy / " + \
+                        str('%.4g' % float(dose*10000/self.rxdose)) + " %"
         # Send a message with the text to the 2nd and 3rd statusbar sections
         pub.sendMessage('main.update_statusbar', msg={1:text, 2:value})
 
@@ -582,7 +927,7 @@ class plugin2DView(wx.Panel):
     def OnZoomOut(self, evt):
         """Zoom the view out."""
 
-        if (self.zoom > 1):
+        if (self.zoom > self.minzoom):
             self.zoom = self.zoom / 1.1
             self.Refresh()
 
@@ -595,6 +940,10 @@ class plugin2DView(wx.Panel):
             nextkey = [wx.WXK_DOWN, wx.WXK_PAGEDOWN]
             zoominkey = [43, 61, 388] # Keys: +, =, Numpad add
             zoomoutkey = [45, 95, 390] # Keys: -, _, Numpad subtract
+            # Stop the cine playback when the image is changed manually
+            if self.cine and (keyname in
+                prevkey + nextkey + [wx.WXK_HOME, wx.WXK_END]):
+                self.StopCine()
             if (keyname in prevkey):
                 if (self.imagenum > 1):
                     self.imagenum -= 1
@@ -633,6 +982,8 @@ class plugin2DView(wx.Panel):
     def OnMouseDown(self, evt):
         """Get the initial position of the mouse when dragging."""
 
+        # Apply any pending motion before the new drag starts
+        self.OnProcessMouseMotion()
         self.mousepos = evt.GetPosition()
         # Publish the coordinates of the cursor position based
         # on the scaled image size range
@@ -649,7 +1000,13 @@ class plugin2DView(wx.Panel):
     def OnMouseUp(self, evt):
         """Reset the cursor when the mouse is released."""
 
+        # Apply the last motion of the drag before it ends
+        self.OnProcessMouseMotion()
         self.SetCursor(wx.Cursor(wx.CURSOR_DEFAULT))
+        # Render the image at full quality once the window / level is set
+        if self.wldrag:
+            self.wldrag = False
+            self.Refresh()
 
     def OnMouseEnter(self, evt):
         """Set a flag when the cursor enters the window."""
@@ -664,38 +1021,128 @@ class plugin2DView(wx.Panel):
         self.OnUpdatePositionValues(None)
 
     def OnMouseMotion(self, evt):
-        """Process mouse motion events and pass to the appropriate handler."""
+        """Store the latest mouse motion event so that the motion is only
+            processed at the maximum mouse update rate."""
+
+        # The event object is reused by wx, so only keep its state
+        self.motionevent = (
+            evt.GetPosition(), evt.LeftIsDown(), evt.RightIsDown())
+        self.motion.Schedule()
 
-        if evt.LeftIsDown():
-            self.OnLeftIsDown(evt)
+    def OnProcessMouseMotion(self):
+        """Process the latest mouse motion and pass to the appropriate
+            handler."""
+
+        if not self.motionevent:
+            return
+        position, leftdown, rightdown = self.motionevent
+        self.motionevent = None
+        if leftdown:
+            self.OnLeftIsDown(position)
             self.SetCursor(wx.Cursor(wx.CURSOR_SIZING))
-        elif evt.RightIsDown():
-            self.OnRightIsDown(evt)
+        elif rightdown:
+            self.OnRightIsDown(position)
             # Custom cursors with > 2 colors only works on Windows currently
             if guiutil.IsMSWindows():
                 image = wx.Image(util.GetResourcePath('contrast_high.png'))
                 self.SetCursor(wx.CursorFromImage(image))
         # Update the positon and values of the mouse cursor
-        self.mousepos = evt.GetPosition()
-        self.OnUpdatePositionValues(evt)
+        self.mousepos = position
+        self.OnUpdatePositionValues(None)
 
-    def OnLeftIsDown(self, evt):
+    def OnLeftIsDown(self, position):
         """Change the image pan when the left mouse button is dragged."""
 
-        delta = self.mousepos - evt.GetPosition()
-        self.mousepos = evt.GetPosition()
+        delta = self.mousepos - position
+        self.mousepos = position
         self.pan[0] -= (delta[0]/self.zoom)
         self.pan[1] -= (delta[1]/self.zoom)
         self.Refresh()
 
-    def OnRightIsDown(self, evt):
+    def OnRightIsDown(self, position):
         """Change the window/level when the right mouse button is dragged."""
 
-        delta = self.mousepos - evt.GetPosition()
-        self.mousepos = evt.GetPosition()
+        delta = self.mousepos - position
+        self.mousepos = position
         self.window -= delta[0]
         self.level -= delta[1]
-        self.Refresh()
+        self.wldrag = True
+        # Coalesce the motion events to the display refresh rate
+        self.redraw.Schedule()
+
+    def OnCine(self, evt):
+        """Start or stop the cine playback of the images."""
+
+        if self.cine:
+            self.StopCine()
+        elif (len(self.images) > 1):
+            self.StartCine()
+
+    def StartCine(self):
+        """Start the cine playback from the current image at the cine
+            frame rate."""
+
+        self.cine = True
+        if not self.cineframes:
+            self.cineframes = imageutil.FrameRing(self.RenderCineFrame)
+        self.cinestart = time.time()
+        self.cinefirst = self.imagenum - 1
+        self.cinetimer.Start(max(int(1000 / self.cine_fps), 1))
+
+    def StopCine(self):
+        """Stop the cine playback and the cine frame renderer."""
+
+        self.cine = False
+        self.cinetimer.Stop()
+        if self.cineframes:
+            self.cineframes.Stop()
+            self.cineframes = None
+
+    def GetCineFrameKey(self):
+        """Return the render settings of the cine frames."""
+
+        return (self.window, self.level, imageutil.get_pyramid_level(
+            self.zoom, (self.bheight, self.bwidth)))
+
+    def RenderCineFrame(self, index, key):
+        """Render the RGB frame of the given image index with the given
+            settings. This is called from the cine frame render thread."""
+
+        image = self.images[index]
+        window, level, pyramidlevel = key
+        if not image.ds.PhotometricInterpretation in \
+            ['MONOCHROME1', 'MONOCHROME2']:
+            return np.ascontiguousarray(
+                image.GetImage(window, level).convert('RGB'))
+        slope, intercept = imageutil.get_rescale(image.ds)
+        pixels = imageutil.downsample(
+            pixelmap.get_image_pixels(image.ds), 2 ** pyramidlevel)
+        return self.cinerenderer.Render(
+            pixels, window, level, slope, intercept)
+
+    def OnCineTimer(self, evt):
+        """Advance to the image that is due at the cine frame rate. Frames
+            that have not been rendered in time are dropped."""
+
+        if not (self.cine and len(self.images)):
+            return
+        count = len(self.images)
+        elapsed = time.time() - self.cinestart
+        index = (self.cinefirst + int(elapsed * self.cine_fps)) % count
+        key = self.GetCineFrameKey()
+        # Render the upcoming frames and their isodose lines in advance
+        upcoming = [(index + i) % count for i in range(self.cineframes.size)]
+        self.cineframes.Request(upcoming, key)
+        if len(self.isodoses) and self.isodosecache:
+            self.isodosecache.Precompute(
+                [float('%.2f' % self.images[i].ds.ImagePositionPatient[2])
+                 for i in upcoming],
+                [self.GetIsodoseLevel(isodose)
+                 for isodose in self.isodoses.values()])
+        if not (index == self.imagenum - 1) and \
+            (self.cineframes.Get(index, key) is not None):
+            self.imagenum = index + 1
+            self.Refresh()
 
     def OnToolsMenu(self, evt):
         """Show a context menu for the loaded 2D View plugins when the
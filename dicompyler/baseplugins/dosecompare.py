@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# dosecompare.py
+"""dicompyler plugin that compares the loaded RT Dose to another RT Dose
+    for the same structure set."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# It is assumed that the reference (prescription) dose is in cGy.
+
+import logging
+logger = logging.getLogger('dicompyler.dosecompare')
+import threading
+import numpy as np
+import wx
+from wx.lib.pubsub import pub
+from dicompylercore import dicomparser
+from dicompyler import dosegrid, dosestats, guiutil
+
+def pluginProperties():
+    """Properties of the plugin."""
+
+    props = {}
+    props['name'] = 'Compare RT Dose'
+    props['description'] = "Compare the DVHs and dose of another RT Dose"
+    props['author'] = 'Aditya Panchal'
+    props['version'] = "0.5.0"
+    props['plugin_type'] = 'menu'
+    props['plugin_version'] = 1
+    props['min_dicom'] = ['rtss', 'rtdose']
+    props['recommended_dicom'] = ['images', 'rtss', 'rtplan', 'rtdose']
+
+    return props
+
+class plugin:
+
+    def __init__(self, parent):
+
+        self.parent = parent
+        self.path = ""
+
+        # Set up pubsub
+        pub.subscribe(self.OnUpdatePatient, 'patient.updated.raw_data')
+        pub.subscribe(self.OnUpdateParsedPatient, 'patient.updated.parsed_data')
+        pub.subscribe(self.OnImportPrefsChange, 'general.dicom')
+        pub.sendMessage('preferences.requested.values', msg='general.dicom')
+
+    def OnImportPrefsChange(self, topic, msg):
+        """When the import preferences change, update the values."""
+        topic = topic.split('.')
+        if (topic[1] == 'import_location'):
+            self.path = str(msg)
+
+    def OnUpdatePatient(self, msg):
+        """Update and load the patient data."""
+
+        self.data = msg
+
+    def OnUpdateParsedPatient(self, msg):
+        """Update and load the parsed patient data."""
+
+        self.structures = msg.get('structures', {})
+        self.rxdose = msg['plan']['rxdose'] if 'plan' in msg else 0
+        self.masks = msg.get('masks', None)
+
+    def pluginMenu(self, evt):
+        """Compare the loaded RT Dose to another RT Dose."""
+
+        if not ("PixelData" in self.data['rtdose']):
+            self.ShowError("The loaded RT Dose does not contain a dose grid.")
+            return
+        dlg = wx.FileDialog(
+            self.parent, defaultDir = self.path,
+            wildcard="All Files (*.*)|*.*|DICOM File (*.dcm)|*.dcm",
+            message="Choose an RT Dose File to Compare")
+        if not (dlg.ShowModal() == wx.ID_OK):
+            dlg.Destroy()
+            return
+        filename = dlg.GetPath()
+        dlg.Destroy()
+
+        # Make sure that the file is an RT Dose with a dose grid
+        try:
+            dp = dicomparser.DicomParser(filename)
+        except (AttributeError, EOFError, IOError, KeyError):
+            logger.info("%s is not a valid DICOM file.", filename)
+            self.ShowError(filename + " is not a valid DICOM file.")
+            return
+        if not ((dp.GetSOPClassUID() == 'rtdose') and
+                ("PixelData" in dp.ds)):
+            self.ShowError(filename + " is not an RT Dose with a dose grid.")
+            return
+
+        self.comparison = None
+        dlgProgress = guiutil.get_progress_dialog(
+            wx.GetApp().GetTopWindow(), "Comparing RT Dose...")
+        self.t = threading.Thread(target=self.CompareDoseThread,
+            args=(self.data['rtdose'], dp.ds,
+                  dlgProgress.OnUpdateProgress))
+        self.t.start()
+        dlgProgress.ShowModal()
+        dlgProgress.Destroy()
+        if self.comparison:
+            pub.sendMessage('patient.updated.comparison', msg=self.comparison)
+            # Show the dose difference as a colorwash over its entire range
+            pub.sendMessage('2dview.colorwash',
+                msg={'dose':self.comparison['difference'],
+                     'min':self.comparison['mindifference'],
+                     'max':self.comparison['maxdifference']})
+            self.ShowSummary(self.comparison)
+
+    def CompareDoseThread(self, reference, comparison, progressFunc):
+        """Calculate the DVHs of both dose grids along with the voxel-wise
+            dose difference in a separate thread."""
+
+        try:
+            self.comparison = self.CompareDose(
+                reference, comparison, progressFunc)
+        except Exception:
+            logger.exception("The RT Dose could not be compared.")
+        wx.CallAfter(progressFunc, 1, 1, 'Done')
+
+    def CompareDose(self, reference, comparison, progressFunc):
+        """Return the DVHs of both dose grids and the dose difference."""
+
+        keys = [key for key, structure in self.structures.items()
+                if not structure['name'].startswith('Applicator')]
+        # Voxelize each structure within its bounding box on both dose grids
+        masks = [self.masks or dosestats.StructureMasks(
+                     dosegrid.DoseParser(reference), self.structures),
+                 dosestats.StructureMasks(
+                     dosegrid.DoseParser(comparison), self.structures)]
+        tasks = [(m, key) for m in range(2) for key in keys]
+        dvhs = [{}, {}]
+        # The samples are calculated one structure at a time, since the
+        # masks are mostly computed while holding the GIL
+        for n, (m, key) in enumerate(tasks):
+            wx.CallAfter(progressFunc, n, len(tasks) + 1,
+                         'Calculating DVHs...')
+            samples = masks[m].GetSamples(key)
+            if len(samples):
+                # Limit DVH bins to 500 Gy due to high doses in brachy
+                dvh = samples.GetDVH(limit=500,
+                                     name=self.structures[key]['name'])
+                dvh.rx_dose = self.rxdose / 100
+                dvhs[m][key] = dvh
+
+        wx.CallAfter(progressFunc, len(tasks), len(tasks) + 1,
+                     'Calculating dose difference...')
+        compare = dosegrid.DoseComparison(reference, comparison)
+        difference = compare.GetDifferenceGrid()
+        return {'dvhs':dvhs,
+                'prefixes':['Reference', 'Comparison'],
+                'difference':dosegrid.DoseParser(compare.GetDifference()),
+                'mindifference':float(np.amin(difference)),
+                'maxdifference':float(np.amax(difference))}
+
+    def ShowSummary(self, comparison):
+        """Show the range of the dose difference."""
+
+        dlg = wx.MessageDialog(self.parent,
+            "Dose difference (comparison - reference):\n" +
+            "Minimum: " + str('%.4g' % comparison['mindifference']) + " Gy\n" +
+            "Maximum: " + str('%.4g' % comparison['maxdifference']) + " Gy\n\n" +
+            "The DVHs of both dose grids are shown on the DVH tab and " +
+            "the dose difference is shown as a colorwash in the 2D View.",
+            "RT Dose Comparison", wx.OK|wx.ICON_INFORMATION)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def ShowError(self, message):
+        """Show an error message."""
+
+        dlg = wx.MessageDialog(self.parent, message,
+            "Invalid RT Dose", wx.OK|wx.ICON_ERROR)
+        dlg.ShowModal()
+        dlg.Destroy()
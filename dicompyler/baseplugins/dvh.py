@@ -10,6 +10,9 @@
 #
 # It is assumed that the reference (prescription) dose is in cGy.
 
+import logging
+logger = logging.getLogger('dicompyler.dvh')
+import threading
 import wx
 from wx.xrc import XmlResource, XRCCTRL, XRCID
 from wx.lib.pubsub import pub
@@ -53,6 +56,8 @@ class pluginDVH(wx.Panel):
         """Method called after the panel has been initialized."""
 
         self.guiDVH = guidvh.guiDVH(self)
+        self.redraw = guiutil.RedrawScheduler(self, self.OnReplot)
+        self.replotargs = ((), {})
         res.AttachUnknownControl('panelDVH', self.guiDVH.panelDVH, self)
 
         # Initialize the Constraint selector controls
@@ -112,11 +117,30 @@ class pluginDVH(wx.Panel):
         self.dvhscaling = {} # dict of dvh scaling data
         self.plan = {} # used for rx dose
         self.structureid = 1 # used to indicate current constraint structure
+        self.comparison = None # dvhs of a compared dose
+        self.scaling = None # dvhs of the rescaled dose
+        self.masks = None # cached structure masks on the dose grid
+        self.pending = set() # structures whose dvhs are being calculated
+        self.nodvh = set() # structures whose dvhs could not be calculated
+        self.progressive = False # calculate missing dvhs when checked
+        self.generation = 0 # used to ignore dvhs of a previous patient
 
         # Set up pubsub
         pub.subscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
         pub.subscribe(self.OnStructureCheck, 'structures.checked')
         pub.subscribe(self.OnStructureSelect, 'structure.selected')
+        pub.subscribe(self.OnUpdateComparison, 'patient.updated.comparison')
+        pub.subscribe(self.OnUpdateScaling, 'patient.updated.scaling')
+        pub.subscribe(self.OnCalculationPrefsChange, 'general.calculation')
+        pub.sendMessage('preferences.requested.values',
+                        msg='general.calculation')
+
+    def OnCalculationPrefsChange(self, topic, msg):
+        """When the calculation preferences change, update the values."""
+        topic = topic.split('.')
+        if (topic[1] == 'dvh_recalc'):
+            self.progressive = \
+                (msg == 'Progressively Calculate DVH When Checked')
 
     def OnUpdatePatient(self, msg):
         """Update and load the patient data."""
@@ -124,8 +148,14 @@ class pluginDVH(wx.Panel):
         self.structures = msg['structures']
         self.dvhs = msg['dvhs']
         self.plan = msg['plan']
+        self.comparison = None
+        self.scaling = None
+        self.masks = msg.get('masks', None)
+        self.pending = set()
+        self.nodvh = set()
+        self.generation += 1
         # show an empty plot when (re)loading a patient
-        self.guiDVH.Replot()
+        self.Replot()
         self.EnableConstraints(False)
 
     def OnDestroy(self, evt):
@@ -134,6 +164,46 @@ class pluginDVH(wx.Panel):
         pub.unsubscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
         pub.unsubscribe(self.OnStructureCheck, 'structures.checked')
         pub.unsubscribe(self.OnStructureSelect, 'structure.selected')
+        pub.unsubscribe(self.OnUpdateComparison, 'patient.updated.comparison')
+        pub.unsubscribe(self.OnUpdateScaling, 'patient.updated.scaling')
+        pub.unsubscribe(self.OnCalculationPrefsChange, 'general.calculation')
+        self.redraw.Cancel()
+
+    def OnUpdateComparison(self, msg):
+        """Overlay the DVHs of a compared dose on the DVH plot."""
+
+        self.comparison = msg
+        self.Replot(*self.replotargs[0], **self.replotargs[1])
+
+    def OnUpdateScaling(self, msg):
+        """Overlay the DVHs of the rescaled dose on the DVH plot, apart from
+            those of a compared dose."""
+
+        self.scaling = msg
+        self.Replot(*self.replotargs[0], **self.replotargs[1])
+
+    def Replot(self, *args, **kwargs):
+        """Schedule the DVH plot to be redrawn with the given arguments, so
+            that several consecutive updates only redraw the plot once."""
+
+        self.replotargs = (args, kwargs)
+        self.redraw.Schedule()
+
+    def OnReplot(self):
+        """Redraw the DVH plot with the most recent arguments, along with
+            the DVHs of each compared and rescaled dose."""
+
+        args, kwargs = self.replotargs
+        overlays = [o for o in (self.comparison, self.scaling) if o]
+        if len(overlays) and len(args):
+            dvhlist = [dvhs for o in overlays for dvhs in o['dvhs']]
+            args = list(args)
+            args[0] = [{id:dvh.relative_volume.counts
+                        for id, dvh in dvhs.items()} for dvhs in dvhlist]
+            args[1] = [{id:1 for id in dvhs} for dvhs in dvhlist]
+            kwargs = dict(kwargs,
+                prefixes=[p for o in overlays for p in o['prefixes']])
+        self.guiDVH.Replot(*args, **kwargs)
 
     def OnStructureCheck(self, msg):
         """When a structure changes, update the interface and plot."""
@@ -145,6 +215,18 @@ class pluginDVH(wx.Panel):
             if not 'volume' in self.structures[id]:
                 self.structures[id]['volume'] = structure['volume']
 
+            # Progressively calculate the dvh if it has not been calculated
+            # and has not failed to be calculated before
+            if self.progressive and not (
+                    (id in self.dvhs) or (id in self.pending) or
+                    (id in self.nodvh) or (self.masks is None) or
+                    self.structures[id]['name'].startswith('Applicator')):
+                self.pending.add(id)
+                t = threading.Thread(target=self.CalculateDVHThread,
+                    args=(self.masks, id, self.generation))
+                t.daemon = True
+                t.start()
+
             # make sure that the dvh has been calculated for each structure
             # before setting it
             if id in self.dvhs:
@@ -152,12 +234,52 @@ class pluginDVH(wx.Panel):
                 self.dvharray[id] = self.dvhs[id].relative_volume.counts
                 # Create an instance of the dvh scaling data for guidvh
                 self.dvhscaling[id] = 1  # self.dvhs[id]['scaling']
-                # 'Toggle' the choice box to refresh the dose data
-                self.OnToggleConstraints(None)
+        # 'Toggle' the choice box once to refresh the dose data
+        if any(id in self.dvhs for id in self.checkedstructures):
+            self.OnToggleConstraints(None)
         if not len(self.checkedstructures):
             self.EnableConstraints(False)
             # Make an empty plot on the DVH
-            self.guiDVH.Replot()
+            self.Replot()
+
+    def CalculateDVHThread(self, masks, id, generation):
+        """Calculate a preview DVH from a downsampled dose grid, followed by
+            the full resolution DVH that replaces it."""
+
+        name = self.structures[id]['name']
+        try:
+            samples = masks.GetPreviewSamples(id)
+            if len(samples):
+                wx.CallAfter(self.OnDVHCalculated, id,
+                    samples.GetDVH(limit=500, name=name), generation, False)
+            # Limit DVH bins to 500 Gy due to high doses in brachy
+            samples = masks.GetSamples(id)
+            dvh = samples.GetDVH(limit=500, name=name) if len(samples) else None
+        except Exception:
+            logger.exception("The DVH for %s could not be calculated.", name)
+            dvh = None
+        wx.CallAfter(self.OnDVHCalculated, id, dvh, generation, True)
+
+    def OnDVHCalculated(self, id, dvh, generation, final):
+        """Show the preview or full resolution DVH of the structure."""
+
+        if not (generation == self.generation):
+            return
+        if final:
+            self.pending.discard(id)
+        elif not (id in self.pending):
+            return
+        if dvh is None:
+            # Do not calculate the dvh again, i.e. if the structure is outside
+            # of the dose grid or the calculation failed
+            self.nodvh.add(id)
+            self.dvhs.pop(id, None)
+            self.dvharray.pop(id, None)
+        else:
+            dvh.rx_dose = self.plan['rxdose'] / 100
+            self.dvhs[id] = dvh
+        if id in self.checkedstructures:
+            self.OnStructureCheck(self.checkedstructures)
 
     def OnStructureSelect(self, msg):
         """Load the constraints for the currently selected structure."""
@@ -173,7 +295,7 @@ class pluginDVH(wx.Panel):
                 self.OnToggleConstraints(None)
             else:
                 self.EnableConstraints(False)
-                self.guiDVH.Replot([self.dvharray], [self.dvhscaling], self.checkedstructures)
+                self.Replot([self.dvharray], [self.dvhscaling], self.checkedstructures)
 
     def EnableConstraints(self, value):
         """Enable or disable the constraint selector."""
@@ -193,7 +315,7 @@ class pluginDVH(wx.Panel):
         # Replot the remaining structures and disable the constraints
         # if a structure that has no DVH calculated is selected
         if not self.structureid in self.dvhs:
-            self.guiDVH.Replot([self.dvharray], [self.dvhscaling], self.checkedstructures)
+            self.Replot([self.dvharray], [self.dvhscaling], self.checkedstructures)
             self.EnableConstraints(False)
             return
         else:
@@ -262,7 +384,7 @@ class pluginDVH(wx.Panel):
 
             self.lblConstraintUnits.SetLabel(str(cc))
             self.lblConstraintPercent.SetLabel(str(constraint))
-            self.guiDVH.Replot([self.dvharray], [self.dvhscaling],
+            self.Replot([self.dvharray], [self.dvhscaling],
                 self.checkedstructures, ([absDose], [constraint.value]), id)
         # Volume constraint in Gy
         elif (constrainttype == 1):
@@ -273,7 +395,7 @@ class pluginDVH(wx.Panel):
 
             self.lblConstraintUnits.SetLabel(str(cc))
             self.lblConstraintPercent.SetLabel(str(constraint))
-            self.guiDVH.Replot([self.dvharray], [self.dvhscaling],
+            self.Replot([self.dvharray], [self.dvhscaling],
                 self.checkedstructures, ([absDose], [constraint.value]), id)
         # Dose constraint
         elif (constrainttype == 2):
@@ -282,7 +404,7 @@ class pluginDVH(wx.Panel):
 
             self.lblConstraintUnits.SetLabel(str(dose))
             self.lblConstraintPercent.SetLabel(str(relative_dose))
-            self.guiDVH.Replot([self.dvharray], [self.dvhscaling],
+            self.Replot([self.dvharray], [self.dvhscaling],
                 self.checkedstructures,
                 ([dose.value * 100], [slidervalue]), id)
         # Dose constraint in cc
@@ -294,6 +416,6 @@ class pluginDVH(wx.Panel):
 
             self.lblConstraintUnits.SetLabel(str(dose))
             self.lblConstraintPercent.SetLabel(str(relative_dose))
-            self.guiDVH.Replot([self.dvharray], [self.dvhscaling],
+            self.Replot([self.dvharray], [self.dvhscaling],
                 self.checkedstructures,
                 ([dose.value * 100], [volumepercent]), id)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# gammaanalysis.py
+"""dicompyler plugin that calculates the gamma index of another RT Dose
+    against the loaded RT Dose."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import logging
+logger = logging.getLogger('dicompyler.gammaanalysis')
+import threading
+import wx
+from wx.lib.pubsub import pub
+from dicompylercore import dicomparser
+from dicompyler import dosegrid, gamma, guiutil
+
+def pluginProperties():
+    """Properties of the plugin."""
+
+    props = {}
+    props['name'] = 'Gamma Analysis'
+    props['description'] = "Calculate the 3D gamma index of another RT Dose"
+    props['author'] = 'Aditya Panchal'
+    props['version'] = "0.5.0"
+    props['plugin_type'] = 'menu'
+    props['plugin_version'] = 1
+    props['min_dicom'] = ['rtdose']
+    props['recommended_dicom'] = ['images', 'rtss', 'rtplan', 'rtdose']
+
+    return props
+
+class plugin:
+
+    def __init__(self, parent):
+
+        self.parent = parent
+        self.path = ""
+        self.dose_criteria = 3
+        self.distance_criteria = 3
+        self.normalization = 'Global'
+        self.threshold = 10
+
+        # Set up preferences
+        self.preferences = [
+            {'Gamma Criteria':
+                [{'name':'Dose Difference',
+                 'type':'range',
+               'values':[1, 10],
+              'default':3,
+                'units':'%',
+             'callback':'gamma.criteria.dose_criteria'},
+                {'name':'Distance to Agreement',
+                 'type':'range',
+               'values':[1, 10],
+              'default':3,
+                'units':'mm',
+             'callback':'gamma.criteria.distance_criteria'},
+                {'name':'Dose Difference Normalization',
+                 'type':'choice',
+               'values':['Global', 'Local'],
+              'default':'Global',
+             'callback':'gamma.criteria.normalization'},
+                {'name':'Low Dose Threshold',
+                 'type':'range',
+               'values':[0, 100],
+              'default':10,
+                'units':'%',
+             'callback':'gamma.criteria.threshold'}]
+            }]
+
+        # Set up pubsub
+        pub.subscribe(self.OnUpdatePatient, 'patient.updated.raw_data')
+        pub.subscribe(self.OnImportPrefsChange, 'general.dicom')
+        pub.subscribe(self.OnCriteriaChange, 'gamma.criteria')
+        pub.sendMessage('preferences.requested.values', msg='general.dicom')
+        pub.sendMessage('preferences.requested.values', msg='gamma.criteria')
+
+    def OnImportPrefsChange(self, topic, msg):
+        """When the import preferences change, update the values."""
+        topic = topic.split('.')
+        if (topic[1] == 'import_location'):
+            self.path = str(msg)
+
+    def OnCriteriaChange(self, topic, msg):
+        """When the gamma criteria change, update the values."""
+        topic = topic.split('.')
+        if (topic[1] == 'dose_criteria'):
+            self.dose_criteria = msg
+        elif (topic[1] == 'distance_criteria'):
+            self.distance_criteria = msg
+        elif (topic[1] == 'normalization'):
+            self.normalization = msg
+        elif (topic[1] == 'threshold'):
+            self.threshold = msg
+
+    def OnUpdatePatient(self, msg):
+        """Update and load the patient data."""
+
+        self.data = msg
+
+    def pluginMenu(self, evt):
+        """Calculate the gamma index of another RT Dose."""
+
+        if not ("PixelData" in self.data['rtdose']):
+            self.ShowError("The loaded RT Dose does not contain a dose grid.")
+            return
+        dlg = wx.FileDialog(
+            self.parent, defaultDir = self.path,
+            wildcard="All Files (*.*)|*.*|DICOM File (*.dcm)|*.dcm",
+            message="Choose an RT Dose File to Evaluate")
+        if not (dlg.ShowModal() == wx.ID_OK):
+            dlg.Destroy()
+            return
+        filename = dlg.GetPath()
+        dlg.Destroy()
+
+        # Make sure that the file is an RT Dose with a dose grid
+        try:
+            dp = dicomparser.DicomParser(filename)
+        except (AttributeError, EOFError, IOError, KeyError):
+            logger.info("%s is not a valid DICOM file.", filename)
+            self.ShowError(filename + " is not a valid DICOM file.")
+            return
+        if not ((dp.GetSOPClassUID() == 'rtdose') and
+                ("PixelData" in dp.ds)):
+            self.ShowError(filename + " is not an RT Dose with a dose grid.")
+            return
+
+        self.result = None
+        dlgProgress = guiutil.get_progress_dialog(
+            wx.GetApp().GetTopWindow(), "Calculating Gamma Index...")
+        self.t = threading.Thread(target=self.GammaThread,
+            args=(self.data['rtdose'], dp.ds, dlgProgress.OnUpdateProgress))
+        self.t.start()
+        dlgProgress.ShowModal()
+        dlgProgress.Destroy()
+        if self.result:
+            pub.sendMessage('patient.updated.gamma', msg=self.result)
+            # Show the gamma map as a colorwash from 0 up to the search limit
+            pub.sendMessage('2dview.colorwash',
+                msg={'dose':self.result['gamma'], 'min':0, 'max':2})
+            self.ShowSummary(self.result)
+
+    def GammaThread(self, reference, evaluated, progressFunc):
+        """Calculate the gamma index in a separate thread."""
+
+        wx.CallAfter(progressFunc, 0, 1, 'Calculating gamma index...')
+        try:
+            gammagrid, passrate = gamma.calculate_gamma(reference, evaluated,
+                self.dose_criteria, self.distance_criteria,
+                self.normalization == 'Local', self.threshold)
+            self.result = {'gamma':dosegrid.DoseParser(
+                               gamma.create_gamma_dataset(reference, gammagrid)),
+                           'passrate':passrate,
+                           'criteria':(self.dose_criteria,
+                                       self.distance_criteria,
+                                       self.normalization, self.threshold)}
+        except Exception:
+            logger.exception("The gamma index could not be calculated.")
+        wx.CallAfter(progressFunc, 1, 1, 'Done')
+
+    def ShowSummary(self, result):
+        """Show the pass rate of the gamma analysis."""
+
+        dd, dta, normalization, threshold = result['criteria']
+        dlg = wx.MessageDialog(self.parent,
+            "Gamma criteria: " + str(dd) + "% / " + str(dta) + " mm (" +
+            normalization + "), " + str(threshold) + "% threshold\n" +
+            "Pass rate: " + str('%.2f' % result['passrate']) + "%\n\n" +
+            "The gamma map is shown as a colorwash in the 2D View.",
+            "Gamma Analysis", wx.OK|wx.ICON_INFORMATION)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def ShowError(self, message):
+        """Show an error message."""
+
+        dlg = wx.MessageDialog(self.parent, message,
+            "Invalid RT Dose", wx.OK|wx.ICON_ERROR)
+        dlg.ShowModal()
+        dlg.Destroy()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# mprview.py
+"""dicompyler plugin that displays sagittal and coronal reformats of the
+    image volume with structure and dose data."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# It is assumed that the reference (prescription) dose is in cGy.
+
+import wx
+from wx.xrc import XmlResource
+from wx.lib.pubsub import pub
+import numpy as np
+from dicompyler import guiutil, util
+from dicompyler import contourutil, dosegrid, imageutil, pixelmap
+
+def pluginProperties():
+    """Properties of the plugin."""
+
+    props = {}
+    props['name'] = 'MPR View'
+    props['description'] = "Display sagittal and coronal reformats of the " + \
+                           "image, structure and dose data"
+    props['author'] = 'Aditya Panchal'
+    props['version'] = "0.5.0"
+    props['plugin_type'] = 'main'
+    props['plugin_version'] = 1
+    props['min_dicom'] = ['images']
+    props['recommended_dicom'] = ['images', 'rtss', 'rtdose']
+
+    return props
+
+def pluginLoader(parent):
+    """Function to load the plugin."""
+
+    # Load the XRC file for our gui resources
+    res = XmlResource(util.GetBasePluginsPath('mprview.xrc'))
+
+    panelMPRView = res.LoadPanel(parent, 'pluginMPRView')
+    panelMPRView.Init(res)
+
+    return panelMPRView
+
+def get_index_positions(values, lut):
+    """Convert the patient coordinates (mm) into fractional indices of the
+        given LUT, which may be increasing or decreasing."""
+
+    lut = np.asarray(lut, dtype=np.float64)
+    indices = np.arange(len(lut), dtype=np.float64)
+    if (len(lut) > 1) and (lut[-1] < lut[0]):
+        lut = lut[::-1]
+        indices = indices[::-1]
+    return np.interp(values, lut, indices)
+
+class pluginMPRView(wx.Panel):
+    """Plugin to display sagittal and coronal reformats of the image volume."""
+
+    def __init__(self):
+        wx.Panel.__init__(self)
+
+    def Init(self, res):
+        """Method called after the panel has been initialized."""
+
+        # Bind ui events to the proper methods
+        self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
+
+        # Initialize variables
+        self.images = []
+        self.volume = None
+        self.structures = {}
+        self.isodoses = {}
+        self.dose = []
+        self.rxdose = 0
+        self.window = 0
+        self.level = 0
+        self.orientation = 'Sagittal'
+        self.planenum = {'Sagittal':0, 'Coronal':0}
+        self.structure_fill_opacity = 50
+        self.planes = util.LRUCache(32)
+        self.renderer = imageutil.ImageRenderer()
+        self.planebitmap = (None, None)
+
+        # Setup toolbar controls
+        orientationbmp = wx.ArtProvider.GetBitmap(
+            wx.ART_REDO, wx.ART_TOOLBAR, (16, 16))
+        self.tools = []
+        self.tools.append({'label':"Orientation", 'bmp':orientationbmp, 'shortHelp':"Toggle Sagittal / Coronal", 'eventhandler':self.OnToggleOrientation})
+
+        # Set up pubsub
+        pub.subscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
+        pub.subscribe(self.OnStructureCheck, 'structures.checked')
+        pub.subscribe(self.OnIsodoseCheck, 'isodoses.checked')
+        pub.subscribe(self.OnUpdateImage, '2dview.updated.image')
+        pub.subscribe(self.OnDrawingPrefsChange, '2dview.drawingprefs')
+        pub.sendMessage('preferences.requested.values', msg='2dview.drawingprefs')
+
+    def OnUpdatePatient(self, msg):
+        """Update and load the patient data."""
+
+        self.volume = None
+        self.planes = util.LRUCache(32)
+        self.planebitmap = (None, None)
+        self.structures = {}
+        self.isodoses = {}
+        self.dose = []
+        if 'images' in msg:
+            # Sort the images from superior to inferior for display
+            positions = [float(i.ds.ImagePositionPatient[2])
+                         for i in msg['images']]
+            order = np.argsort(-np.array(positions), kind='mergesort')
+            self.images = [msg['images'][n] for n in order]
+            # Use the image volume that was decoded while importing, which
+            # is already sorted in the same or in the reverse order
+            if ('volume' in msg) and (len(msg['volume']) == len(order)):
+                if np.array_equal(order, np.arange(len(order))):
+                    self.volume = msg['volume']
+                elif np.array_equal(order, np.arange(len(order))[::-1]):
+                    self.volume = msg['volume'][::-1]
+                else:
+                    self.volume = msg['volume'][order]
+            image = self.images[0]
+            self.pixlut = image.GetPatientToPixelLUT()
+            self.zpositions = np.array([float(i.ds.ImagePositionPatient[2])
+                                        for i in self.images])
+            self.pixelspacing = [float(s) for s in image.ds.PixelSpacing]
+            if (len(self.images) > 1):
+                self.slicespacing = abs(
+                    self.zpositions[0] - self.zpositions[1])
+            else:
+                self.slicespacing = self.pixelspacing[0]
+            self.slope, self.intercept = imageutil.get_rescale(image.ds)
+            self.window, self.level = image.GetDefaultImageWindowLevel()
+            self.planenum = {'Sagittal':int(image.ds.Columns/2),
+                             'Coronal':int(image.ds.Rows/2)}
+            if ('dose' in msg and ("PixelData" in msg['dose'].ds)):
+                self.dose = msg['dose']
+                self.SetDoseGridPositions()
+            if 'plan' in msg:
+                self.rxdose = msg['plan']['rxdose']
+            else:
+                self.rxdose = 0
+        else:
+            self.images = []
+
+        self.SetBackgroundColour(wx.Colour(0, 0, 0))
+        self.SetFocus()
+        self.OnFocus()
+        self.Refresh()
+
+    def OnFocus(self):
+        """Bind to certain events when the plugin is focused."""
+
+        # Bind keyboard and mouse events
+        self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.OnMouseWheel)
+        if guiutil.IsMSWindows():
+            pub.subscribe(self.OnKeyDown, 'main.key_down')
+            pub.subscribe(self.OnMouseWheel, 'main.mousewheel')
+
+    def OnUnfocus(self):
+        """Unbind to certain events when the plugin is unfocused."""
+
+        # Unbind keyboard and mouse events
+        self.Unbind(wx.EVT_KEY_DOWN)
+        self.Unbind(wx.EVT_MOUSEWHEEL)
+        if guiutil.IsMSWindows():
+            pub.unsubscribe(self.OnKeyDown, 'main.key_down')
+            pub.unsubscribe(self.OnMouseWheel, 'main.mousewheel')
+
+    def OnDestroy(self, evt):
+        """Unbind to all events before the plugin is destroyed."""
+
+        pub.unsubscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
+        pub.unsubscribe(self.OnStructureCheck, 'structures.checked')
+        pub.unsubscribe(self.OnIsodoseCheck, 'isodoses.checked')
+        pub.unsubscribe(self.OnUpdateImage, '2dview.updated.image')
+        pub.unsubscribe(self.OnDrawingPrefsChange, '2dview.drawingprefs')
+
+    def OnStructureCheck(self, msg):
+        """When the structure list changes, update the panel."""
+
+        self.structures = msg
+        self.Refresh()
+
+    def OnIsodoseCheck(self, msg):
+        """When the isodose list changes, update the panel."""
+
+        self.isodoses = msg
+        self.Refresh()
+
+    def OnDrawingPrefsChange(self, topic, msg):
+        """When the drawing preferences change, update the drawing styles."""
+        topic = topic.split('.')
+        if (topic[1] == 'structure_fill_opacity'):
+            self.structure_fill_opacity = msg
+            self.Refresh()
+
+    def OnUpdateImage(self, msg):
+        """Follow the window and level of the 2D View."""
+
+        if not ((msg['window'], msg['level']) == (self.window, self.level)):
+            self.window, self.level = msg['window'], msg['level']
+            self.Refresh()
+
+    def SetDoseGridPositions(self):
+        """Determine the position of each dose grid column, row and frame
+            in image column, row and slice indices."""
+
+        doselut = self.dose.GetPatientToPixelLUT()
+        ds = self.dose.ds
+        self.dosepositions = (
+            get_index_positions(doselut[0], self.pixlut[0]),
+            get_index_positions(doselut[1], self.pixlut[1]),
+            get_index_positions(
+                dosegrid.get_frame_positions(ds), self.zpositions))
+        self.dosescaling = float(ds.DoseGridScaling)
+
+    def GetVolume(self):
+        """Return the (slices, rows, columns) image volume, which is
+            assembled once so that each reformat is a view of it."""
+
+        if self.volume is None:
+            self.volume = np.stack(
+                [pixelmap.get_image_pixels(i.ds) for i in self.images])
+        return self.volume
+
+    def GetPlaneCount(self):
+        """Return the number of planes of the current orientation."""
+
+        image = self.images[0]
+        if (self.orientation == 'Sagittal'):
+            return image.ds.Columns
+        return image.ds.Rows
+
+    def GetPlane(self):
+        """Return the cached data of the current plane, which holds the
+            reformatted pixel data and the position of the plane."""
+
+        index = self.planenum[self.orientation]
+        key = (self.orientation, index)
+        plane = self.planes.get(key)
+        if plane is None:
+            volume = self.GetVolume()
+            # The sagittal plane runs along the image rows and the coronal
+            # plane along the image columns, both without copying the data
+            if (self.orientation == 'Sagittal'):
+                plane = {'pixels':volume[:, :, index], 'axis':0,
+                         'position':self.pixlut[0][index],
+                         'lut':self.pixlut[1]}
+            else:
+                plane = {'pixels':volume[:, index, :], 'axis':1,
+                         'position':self.pixlut[1][index],
+                         'lut':self.pixlut[0]}
+            plane['structures'] = {}
+            plane['isodoses'] = {}
+            self.planes[key] = plane
+        return plane
+
+    def GetStructureIntersections(self, plane, structure):
+        """Return the (start, end, slice) intervals in plane pixel coordinates
+            where the structure intersects the plane, which are cached."""
+
+        if not structure['id'] in plane['structures']:
+            intervals = []
+            for z, contours in structure['planes'].items():
+                zindex = get_index_positions(float(z), self.zpositions)
+                # Skip contour planes that are outside of the image volume
+                if (abs(self.zpositions[int(round(zindex))] - float(z)) >
+                    self.slicespacing):
+                    continue
+                for contour in contours:
+                    if not (contour['type'] == u"CLOSED_PLANAR"):
+                        continue
+                    points = np.array(contour['data'])[:, 0:2]
+                    for start, end in contourutil.get_plane_intersections(
+                        points, plane['position'], plane['axis']):
+                        intervals.append((start, end, zindex))
+            if len(intervals):
+                intervals = np.array(intervals)
+                intervals[:, 0:2] = np.sort(get_index_positions(
+                    intervals[:, 0:2], plane['lut']), axis=1)
+            plane['structures'][structure['id']] = intervals
+        return plane['structures'][structure['id']]
+
+    def GetDosePlane(self, plane):
+        """Return the dose (in Gy) of the plane resampled onto the plane
+            pixel grid, which is cached."""
+
+        if not 'dose' in plane:
+            plane['dose'] = []
+            pos = self.dosepositions
+            # Find the closest dose grid column or row to the plane
+            index = self.planenum[self.orientation]
+            axis = pos[plane['axis']]
+            d = int(np.argmin(np.abs(axis - index)))
+            if (min(axis) - 0.5 <= index <= max(axis) + 0.5):
+                grid = dosegrid.get_dose_frames(self.dose.ds)
+                if (plane['axis'] == 0):
+                    doseplane, lut = grid[:, :, d], (pos[1], pos[2])
+                else:
+                    doseplane, lut = grid[:, d, :], (pos[0], pos[2])
+                plane['dose'] = dosegrid.resample_dose_plane(
+                    doseplane * self.dosescaling, lut,
+                    plane['pixels'].shape)
+        return plane['dose']
+
+    def GetIsodoseLines(self, plane, level):
+        """Return the isodose lines of the plane for the given level (cGy),
+            which are cached."""
+
+        if not level in plane['isodoses']:
+            dose = self.GetDosePlane(plane)
+            if len(dose):
+                plane['isodoses'][level] = contourutil.marching_squares(
+                    np.nan_to_num(dose), [level / 100])[0]
+            else:
+                plane['isodoses'][level] = []
+        return plane['isodoses'][level]
+
+    def GetPlaneBitmap(self, plane):
+        """Return the bitmap of the plane with the current window and level,
+            which is cached until any of them change."""
+
+        key = (self.orientation, self.planenum[self.orientation],
+               self.window, self.level)
+        if not (self.planebitmap[0] == key):
+            self.planebitmap = (key, guiutil.convert_array_to_wx(
+                self.renderer.Render(plane['pixels'], self.window, self.level,
+                                     self.slope, self.intercept)))
+        return self.planebitmap[1]
+
+    def OnPaint(self, evt):
+        """Update the panel when it needs to be refreshed."""
+
+        # Special case for Windows to account for flickering
+        # if and only if images are loaded
+        if (guiutil.IsMSWindows() and len(self.images)):
+            dc = wx.BufferedPaintDC(self)
+            self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+        else:
+            dc = wx.PaintDC(self)
+
+        width, height = self.GetClientSize()
+        try:
+            gc = wx.GraphicsContext.Create(dc)
+        except NotImplementedError:
+            dc.DrawText("This build of wxPython does not support the "
+                        "wx.GraphicsContext family of classes.",
+                        25, 25)
+            return
+
+        if not len(self.images):
+            return
+
+        # Redraw the background on Windows
+        if guiutil.IsMSWindows():
+            gc.SetBrush(wx.Brush(wx.Colour(0, 0, 0)))
+            gc.SetPen(wx.Pen(wx.Colour(0, 0, 0)))
+            gc.DrawRectangle(0, 0, width, height)
+
+        plane = self.GetPlane()
+        rows, columns = plane['pixels'].shape
+        # Fit the plane to the panel while keeping the physical aspect ratio
+        hspacing = self.pixelspacing[1 - plane['axis']]
+        scale = min(width / (columns * hspacing),
+                    height / (rows * self.slicespacing))
+        sx, sy = scale * hspacing, scale * self.slicespacing
+        ox = (width - columns * sx) / 2
+        oy = (height - rows * sy) / 2
+        gc.DrawBitmap(self.GetPlaneBitmap(plane),
+                      ox, oy, columns * sx, rows * sy)
+
+        # Draw the structure intersections as filled slice intervals
+        for id, structure in self.structures.items():
+            intervals = self.GetStructureIntersections(plane, structure)
+            if not len(intervals):
+                continue
+            color = structure['color']
+            gc.SetBrush(wx.Brush(wx.Colour(color[0], color[1], color[2],
+                int(self.structure_fill_opacity*255/100))))
+            gc.SetPen(wx.Pen(tuple(color)))
+            path = gc.CreatePath()
+            for start, end, zindex in intervals.tolist():
+                path.AddRectangle(ox + (start + 0.5) * sx,
+                    oy + zindex * sy, (end - start) * sx, sy)
+            gc.DrawPath(path)
+
+        # Draw the isodose lines
+        if len(self.isodoses) and not (self.dose == []):
+            for id, isodose in iter(sorted(self.isodoses.items())):
+                level = isodose['data']['level'] * self.rxdose / 100
+                lines = self.GetIsodoseLines(plane, level)
+                if not len(lines):
+                    continue
+                gc.SetPen(wx.Pen(tuple(isodose['color'])))
+                path = gc.CreatePath()
+                for line in lines:
+                    points = (line * (sx, sy) + (ox + sx / 2, oy + sy / 2))
+                    points = points.tolist()
+                    path.MoveToPoint(points[0][0], points[0][1])
+                    for x, y in points[1:]:
+                        path.AddLineToPoint(x, y)
+                    path.CloseSubpath()
+                gc.StrokePath(path)
+
+        # Draw the information text
+        font = wx.SystemSettings.GetFont(wx.SYS_DEFAULT_GUI_FONT)
+        if guiutil.IsMac():
+            font.SetPointSize(10)
+        gc.SetFont(font, wx.WHITE)
+        te = gc.GetFullTextExtent(self.orientation)
+        gc.DrawText(self.orientation, 10, 7)
+        gc.DrawText("Plane: " + str(self.planenum[self.orientation] + 1) +
+                    "/" + str(self.GetPlaneCount()), 10, 7+te[1]*1.1)
+        gc.DrawText("Position: " + str('%.2f' % plane['position']) + " mm",
+                    10, 7+te[1]*2.2)
+        imwinlevel = "W/L: " + str(self.window) + ' / ' + str(self.level)
+        te = gc.GetFullTextExtent(imwinlevel)
+        gc.DrawText(imwinlevel, width-te[0]-7, 7)
+
+    def OnSize(self, evt):
+        """Refresh the view when the size of the panel changes."""
+
+        self.Refresh()
+        evt.Skip()
+
+    def OnToggleOrientation(self, evt):
+        """Switch between the sagittal and coronal orientation."""
+
+        if (self.orientation == 'Sagittal'):
+            self.orientation = 'Coronal'
+        else:
+            self.orientation = 'Sagittal'
+        self.Refresh()
+
+    def ChangePlane(self, delta):
+        """Move the current plane by the given number of planes."""
+
+        if len(self.images):
+            index = self.planenum[self.orientation] + delta
+            if (0 <= index < self.GetPlaneCount()):
+                self.planenum[self.orientation] = index
+                self.Refresh()
+
+    def OnKeyDown(self, evt):
+        """Change the plane when the user presses the appropriate keys."""
+
+        keyname = evt.GetKeyCode()
+        if (keyname in [wx.WXK_UP, wx.WXK_PAGEUP]):
+            self.ChangePlane(-1)
+        elif (keyname in [wx.WXK_DOWN, wx.WXK_PAGEDOWN]):
+            self.ChangePlane(1)
+
+    def OnMouseWheel(self, evt):
+        """Change the plane when the user scrolls the mouse wheel."""
+
+        rot = evt.GetWheelRotation() / evt.GetWheelDelta()
+        if (rot >= 1):
+            self.ChangePlane(-1)
+        elif (rot <= -1):
+            self.ChangePlane(1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# structurestats.py
+"""dicompyler plugin that displays a sortable table of the dose statistics
+    of all structures."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# It is assumed that the reference (prescription) dose is in cGy.
+
+import logging
+logger = logging.getLogger('dicompyler.structurestats')
+import threading
+import numpy as np
+import wx
+from wx.xrc import XmlResource
+from wx.lib.mixins.listctrl import ColumnSorterMixin
+from wx.lib.pubsub import pub
+from dicompyler import dosestats, util
+
+def pluginProperties():
+    """Properties of the plugin."""
+
+    props = {}
+    props['name'] = 'Dose Statistics'
+    props['description'] = "Display the dose statistics of all structures"
+    props['author'] = 'Aditya Panchal'
+    props['version'] = "0.5.0"
+    props['plugin_type'] = 'main'
+    props['plugin_version'] = 1
+    props['min_dicom'] = ['rtss', 'rtdose']
+    props['recommended_dicom'] = ['rtss', 'rtplan', 'rtdose']
+
+    return props
+
+def pluginLoader(parent):
+    """Function to load the plugin."""
+
+    # Load the XRC file for our gui resources
+    res = XmlResource(util.GetBasePluginsPath('structurestats.xrc'))
+
+    panelStructureStats = res.LoadPanel(parent, 'pluginStructureStats')
+    panelStructureStats.Init(res)
+
+    return panelStructureStats
+
+# Table columns as (heading, statistic, format)
+columns = [('Structure', 'name', '%s'),
+           ('Volume (cm3)', 'volume', '%.2f'),
+           ('Min (Gy)', 'min', '%.2f'),
+           ('Max (Gy)', 'max', '%.2f'),
+           ('Mean (Gy)', 'mean', '%.2f'),
+           ('Median (Gy)', 'median', '%.2f'),
+           ('D98 (Gy)', 'D98', '%.2f'),
+           ('D2 (Gy)', 'D2', '%.2f'),
+           ('V95 (%)', 'V95', '%.1f'),
+           ('V100 (%)', 'V100', '%.1f'),
+           ('V105 (%)', 'V105', '%.1f'),
+           ('HI', 'HI', '%.3f'),
+           ('CI', 'CI', '%.3f')]
+
+class StatisticsListCtrl(wx.ListCtrl, ColumnSorterMixin):
+    """List control that sorts the rows when a column heading is clicked."""
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(self, parent,
+                             style=wx.LC_REPORT|wx.LC_SINGLE_SEL)
+        for c, column in enumerate(columns):
+            self.InsertColumn(c, column[0],
+                wx.LIST_FORMAT_LEFT if (c == 0) else wx.LIST_FORMAT_RIGHT)
+        self.itemDataMap = {}
+        ColumnSorterMixin.__init__(self, len(columns))
+
+    def GetListCtrl(self):
+        return self
+
+    def SetStatistics(self, structures, stats):
+        """Populate the rows with the statistics of each structure."""
+
+        self.DeleteAllItems()
+        self.itemDataMap = {}
+        for id, s in stats.items():
+            values = dict(s)
+            values['name'] = structures[id]['name']
+            row = self.InsertItem(self.GetItemCount(), values['name'])
+            for c, (heading, key, fmt) in enumerate(columns[1:], 1):
+                if np.isnan(values[key]):
+                    self.SetItem(row, c, '-')
+                else:
+                    self.SetItem(row, c, fmt % values[key])
+            self.SetItemData(row, id)
+            # Sort NaN values (no prescription) before all numbers
+            self.itemDataMap[id] = [values['name']] + \
+                [-np.inf if np.isnan(values[key]) else values[key]
+                 for heading, key, fmt in columns[1:]]
+        for c in range(len(columns)):
+            self.SetColumnWidth(c, wx.LIST_AUTOSIZE_USEHEADER)
+
+class pluginStructureStats(wx.Panel):
+    """Plugin to display the dose statistics of all structures."""
+
+    def __init__(self):
+        wx.Panel.__init__(self)
+
+    def Init(self, res):
+        """Method called after the panel has been initialized."""
+
+        self.lcStatistics = StatisticsListCtrl(self)
+        self.spinScaling = wx.SpinCtrlDouble(self, min=10, max=200,
+                                             initial=100, inc=0.5)
+        self.spinScaling.SetDigits(1)
+        self.spinScaling.Enable(False)
+        scalingsizer = wx.BoxSizer(wx.HORIZONTAL)
+        scalingsizer.Add(wx.StaticText(self, label="Dose Scaling (%):"), 0,
+                         wx.ALIGN_CENTER_VERTICAL|wx.RIGHT, 5)
+        scalingsizer.Add(self.spinScaling, 0, wx.ALIGN_CENTER_VERTICAL)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(scalingsizer, 0, wx.ALL, 5)
+        sizer.Add(self.lcStatistics, 1, wx.ALL|wx.EXPAND, 5)
+        self.SetSizer(sizer)
+
+        self.Bind(wx.EVT_SPINCTRLDOUBLE, self.OnChangeScaling,
+                  self.spinScaling)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
+
+        # Initialize variables
+        self.structures = {}
+        self.masks = None
+        self.samples = {}
+        self.gridsamples = None
+        self.rxdose = 0
+        self.generation = 0
+
+        # Set up pubsub
+        pub.subscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
+
+    def OnDestroy(self, evt):
+        """Unbind to all events before the plugin is destroyed."""
+
+        pub.unsubscribe(self.OnUpdatePatient, 'patient.updated.parsed_data')
+
+    def OnUpdatePatient(self, msg):
+        """Update and load the patient data."""
+
+        self.lcStatistics.DeleteAllItems()
+        # Ignore the results of any calculation for the previous patient
+        self.generation += 1
+        self.masks = None
+        self.samples = {}
+        self.gridsamples = None
+        self.spinScaling.SetValue(100)
+        self.spinScaling.Enable(False)
+        if not (('structures' in msg) and ('dose' in msg) and
+                ("PixelData" in msg['dose'].ds)):
+            return
+        self.structures = msg['structures']
+        # Share the structure masks that were cached for the DVH calculation
+        if 'masks' in msg:
+            self.masks = msg['masks']
+        else:
+            self.masks = dosestats.StructureMasks(msg['dose'], self.structures)
+        self.rxdose = msg['plan']['rxdose'] if 'plan' in msg else 0
+        self.t = threading.Thread(target=self.CalculateStatisticsThread,
+            args=(self.masks, self.rxdose, self.generation))
+        self.t.daemon = True
+        self.t.start()
+
+    def CalculateStatisticsThread(self, masks, rxdose, generation):
+        """Calculate the statistics of all structures in a separate thread."""
+
+        try:
+            samples = {}
+            for id, structure in self.structures.items():
+                # Only calculate statistics for structures, not applicators
+                if structure['name'].startswith('Applicator'):
+                    continue
+                samples[id] = masks.GetSamples(id)
+            # Sort the dose grid once so that the prescription isodose volume
+            # can be determined for any scaling
+            gridsamples = dosestats.GridSamples(masks.dose) \
+                if (rxdose > 0) else None
+            isodosevolume = gridsamples.GetVolumeAtDose(rxdose / 100.0) \
+                if gridsamples else 0
+            stats = dosestats.calculate_statistics(
+                samples, rxdose, isodosevolume=isodosevolume)
+        except Exception:
+            logger.exception("The dose statistics could not be calculated.")
+            return
+        wx.CallAfter(self.OnStatisticsCalculated, samples, gridsamples, stats,
+                     generation)
+
+    def OnStatisticsCalculated(self, samples, gridsamples, stats, generation):
+        """Show the statistics if they belong to the current patient."""
+
+        if not (generation == self.generation):
+            return
+        self.samples = samples
+        self.gridsamples = gridsamples
+        self.spinScaling.Enable()
+        self.lcStatistics.SetStatistics(self.structures, stats)
+        pub.sendMessage('patient.updated.statistics', msg=stats)
+
+    def OnChangeScaling(self, evt):
+        """Rescale the dose from the cached dose samples to show the
+            statistics and DVHs of a different plan normalization."""
+
+        if not len(self.samples):
+            return
+        scale = self.spinScaling.GetValue() / 100.0
+        isodosevolume = self.gridsamples.GetVolumeAtDose(
+            self.rxdose / 100.0, scale) if self.gridsamples else 0
+        stats = dosestats.calculate_statistics(self.samples, self.rxdose,
+            isodosevolume=isodosevolume, scale=scale)
+        self.lcStatistics.SetStatistics(self.structures, stats)
+        pub.sendMessage('patient.updated.statistics', msg=stats)
+        # Overlay the rescaled DVHs on the planned DVHs
+        if (scale == 1):
+            pub.sendMessage('patient.updated.scaling', msg=None)
+            return
+        dvhs = [{}, {}]
+        for id, samples in self.samples.items():
+            if len(samples):
+                dvhs[0][id] = samples.GetDVH()
+                dvhs[1][id] = samples.GetDVH(scale)
+        pub.sendMessage('patient.updated.scaling',
+            msg={'dvhs':dvhs, 'prefixes':['Planned',
+                 'Scaled ' + str('%.1f' % (scale * 100)) + '%']})
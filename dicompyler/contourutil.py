@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# contourutil.py
+"""Classes and functions to trace and cache contours for display."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# It's assumed that the isodose levels are given in absolute dose (cGy).
+
+import logging
+logger = logging.getLogger('dicompyler.contourutil')
+import threading, time
+from collections import OrderedDict
+import numpy as np
+
+# Oriented edge pairs for each marching squares case. The cell edges are
+# numbered 0: top, 1: right, 2: bottom, 3: left and the case is built from
+# the corners that are at or above the level, 1: top left, 2: top right,
+# 4: bottom right, 8: bottom left. Each segment runs from the edge where the
+# clockwise cell boundary leaves the level to the edge where it re-enters,
+# so that every crossing point has exactly one incoming and one outgoing
+# segment. The second entry of each case is used for saddle cells whose
+# center is at or above the level.
+_segments = np.full((16, 2, 2, 2), -1, dtype=np.int8)
+
+def _build_segment_table():
+    """Populate the oriented marching squares segment table."""
+
+    corners = [1, 2, 4, 8]
+    for case in range(1, 15):
+        inside = [bool(case & c) for c in corners]
+        # Clockwise traversal: edge k runs from corner k to corner k+1
+        leaving = [k for k in range(4) if inside[k] and not inside[(k+1)%4]]
+        entering = [k for k in range(4) if not inside[k] and inside[(k+1)%4]]
+        if len(leaving) == 1:
+            for center in range(2):
+                _segments[case, center, 0] = (leaving[0], entering[0])
+        # Saddle cells: pair each leaving edge with the entering edge that
+        # either isolates (center below) or joins (center above) the corners
+        else:
+            for center in range(2):
+                for s, k in enumerate(leaving):
+                    _segments[case, center, s] = \
+                        (k, (k+1)%4 if center else (k+3)%4)
+
+_build_segment_table()
+
+def marching_squares(grid, levels):
+    """Trace the isolines of all the given levels of a 2D grid in a single
+        vectorized pass. Returns a list with an entry for each level that
+        contains the closed polylines as (N, 2) arrays of (column, row)
+        coordinates. The first vertex of each polyline is not repeated and
+        polylines without an area are left out."""
+
+    grid = np.asarray(grid, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64).reshape(-1)
+    isolines = [[] for l in levels]
+    if not (grid.ndim == 2) or not grid.size or not levels.size:
+        return isolines
+
+    # Pad the grid below all levels so that every isoline is closed
+    pad = min(np.nanmin(grid), levels.min()) - 1
+    g = np.pad(np.nan_to_num(grid), 1, mode='constant', constant_values=pad)
+    ny, nx = g.shape
+    nl = len(levels)
+    inside = g[np.newaxis] >= levels[:, np.newaxis, np.newaxis]
+
+    # Determine the case and saddle center state of each cell for each level
+    case = (inside[:, :-1, :-1] * 1 + inside[:, :-1, 1:] * 2 +
+            inside[:, 1:, 1:] * 4 + inside[:, 1:, :-1] * 8).astype(np.uint8)
+    l, i, j = np.nonzero((case > 0) & (case < 15))
+    if not len(l):
+        return isolines
+    c = case[l, i, j]
+    center = ((g[i, j] + g[i, j+1] + g[i+1, j] + g[i+1, j+1]) / 4 >=
+              levels[l]).astype(np.intp)
+
+    # Global ids of the top, right, bottom and left edges of each cell
+    nh = nl * ny * (nx-1)
+    top = (l * ny + i) * (nx-1) + j
+    left = nh + (l * (ny-1) + i) * nx + j
+    edges = np.column_stack((top, left + 1, top + (nx-1), left))
+
+    # Build the oriented segments of every cell
+    starts = []
+    ends = []
+    for s in range(2):
+        seg = _segments[c, center, s]
+        valid = seg[:, 0] >= 0
+        rows = np.flatnonzero(valid)
+        starts.append(edges[rows, seg[valid, 0]])
+        ends.append(edges[rows, seg[valid, 1]])
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+
+    # Link the segments via their shared crossing points
+    ids = np.sort(starts)
+    nxt = np.empty(len(ids), dtype=np.intp)
+    nxt[np.searchsorted(ids, starts)] = np.searchsorted(ids, ends)
+
+    # Label each polyline by its smallest crossing point using pointer jumping
+    label = np.arange(len(ids))
+    p = nxt
+    while True:
+        newlabel = np.minimum(label, label[p])
+        if np.array_equal(newlabel, label):
+            break
+        label = newlabel
+        p = p[p]
+    # Rank each crossing point by its distance from the end of its polyline,
+    # which is the point that links back to the smallest crossing point
+    terminal = nxt == label
+    p = np.where(terminal, np.arange(len(ids)), nxt)
+    dist = (~terminal).astype(np.intp)
+    while not np.array_equal(p[p], p):
+        dist = dist + dist[p]
+        p = p[p]
+    order = np.lexsort((-dist, label))
+
+    # Interpolate the position of each crossing point
+    horizontal = ids < nh
+    e = np.where(horizontal, ids, ids - nh)
+    width = np.where(horizontal, nx-1, nx)
+    rows = e // width
+    el = rows // np.where(horizontal, ny, ny-1)
+    ei = rows % np.where(horizontal, ny, ny-1)
+    ej = e % width
+    ei2 = ei + ~horizontal
+    ej2 = ej + horizontal
+    v1 = g[ei, ej]
+    v2 = g[ei2, ej2]
+    t = (levels[el] - v1) / (v2 - v1)
+    x = np.clip(ej + t * horizontal - 1, 0, grid.shape[1]-1)
+    y = np.clip(ei + t * ~horizontal - 1, 0, grid.shape[0]-1)
+    points = np.column_stack((x, y))[order]
+    label = label[order]
+    el = el[order]
+
+    # Remove consecutive duplicate points created by clipping at the border
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1) | \
+               (label[1:] != label[:-1])
+    points, label, el = points[keep], label[keep], el[keep]
+
+    # Split the ordered crossing points into polylines for each level
+    splits = np.flatnonzero(np.diff(label)) + 1
+    for polyline, lev in zip(np.split(points, splits), el[np.r_[0, splits]]):
+        if (len(polyline) > 1) and np.array_equal(polyline[0], polyline[-1]):
+            polyline = polyline[:-1]
+        # Skip the degenerate polylines without an area of a level that is
+        # only reached at isolated points or along a line, such as a level
+        # equal to the maximum
+        if (len(polyline) >= 3) and (get_polyline_area(polyline) > 1e-9):
+            isolines[lev].append(polyline)
+    return isolines
+
+def get_polyline_area(points):
+    """Return the area enclosed by a closed polyline of (x, y) points."""
+
+    # Measure from the first point to limit the rounding error
+    d = np.asarray(points, dtype=np.float64) - points[0]
+    return abs(np.dot(d[:, 0], np.roll(d[:, 1], -1)) -
+               np.dot(d[:, 1], np.roll(d[:, 0], -1))) / 2
+
+def get_plane_intersections(points, position, axis=0):
+    """Intersect a closed planar contour with the line where the given
+        coordinate axis (0: x, 1: y) equals the position. Returns the
+        (start, end) intervals of the other coordinate that are inside of
+        the contour, using the even-odd rule."""
+
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3:
+        return np.empty((0, 2))
+    other = 1 - axis
+    a = points[:, axis]
+    b = points[:, other]
+    na = np.roll(a, -1)
+    nb = np.roll(b, -1)
+    # Edges that cross the line, counting the lower end point only so that
+    # vertices on the line are not counted twice
+    crossing = (a <= position) != (na <= position)
+    t = (position - a[crossing]) / (na[crossing] - a[crossing])
+    values = np.sort(b[crossing] + t * (nb[crossing] - b[crossing]))
+    return values[0:len(values) // 2 * 2].reshape(-1, 2)
+
+class ContourCache:
+    """Caches the simplified display polylines of each structure plane for
+        a set of zoom buckets, so that the drawing detail follows the screen
+        resolution rather than the density of the contour data. The original
+        contour data is not modified."""
+
+    def __init__(self, maxitems=256, tolerance=0.5, bucketsperoctave=2):
+        self.polylines = OrderedDict()
+        self.maxitems = maxitems
+        self.tolerance = tolerance
+        self.bucketsperoctave = bucketsperoctave
+
+    def GetZoomBucket(self, zoom):
+        """Return the zoom bucket of the given zoom level."""
+
+        return int(np.floor(np.log2(zoom) * self.bucketsperoctave))
+
+    def GetPolylines(self, key, zoom, convertfunc):
+        """Return the simplified polylines for the given (structure, plane)
+            key at the given zoom. The full resolution pixel polylines are
+            obtained via convertfunc when they have not been cached."""
+
+        bucket = self.GetZoomBucket(zoom)
+        simplified = self.Get((key, bucket))
+        if simplified is None:
+            polylines = self.Get((key, None))
+            if polylines is None:
+                polylines = convertfunc()
+                self.Store((key, None), polylines)
+            # Use the lowest zoom of the bucket so that the simplification
+            # error stays within the tolerance in screen pixels
+            tolerance = self.tolerance / \
+                2 ** (float(bucket) / self.bucketsperoctave)
+            simplified = [simplify_polyline(p, tolerance) for p in polylines]
+            self.Store((key, bucket), simplified)
+        return simplified
+
+    def Get(self, key):
+        """Return the cached item and mark it as the most recently used."""
+
+        if not key in self.polylines:
+            return None
+        item = self.polylines.pop(key)
+        self.polylines[key] = item
+        return item
+
+    def Store(self, key, item):
+        """Cache the item, evicting the least recently used items."""
+
+        self.polylines[key] = item
+        while len(self.polylines) > self.maxitems:
+            self.polylines.popitem(last=False)
+
+    def Clear(self):
+        """Remove all cached polylines."""
+
+        self.polylines.clear()
+
+class IsodoseCache:
+    """Stores the traced isodose lines of each dose plane in image pixel space
+        and precomputes the neighboring planes in a background thread."""
+
+    def __init__(self, dose, dosepixlut, maxplanes=64):
+        """Take a DoseParser RT Dose object and the dose to pixel LUT."""
+
+        self.dose = dose
+        self.dosepixlut = (np.asarray(dosepixlut[0]),
+                           np.asarray(dosepixlut[1]))
+        self.maxplanes = maxplanes
+
+        # Isodose lines stored by dose plane position: {z: {level: lines}}
+        self.planes = OrderedDict()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.pending = []
+        self.levels = []
+        self.running = True
+
+        self.thread = threading.Thread(target=self.PrecomputeThread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def GetIsodoses(self, z, levels):
+        """Return a dict of isodose lines for each of the given levels (cGy)
+            on the dose plane at position z, tracing only missing levels."""
+
+        with self.lock:
+            cached = self.planes.get(z, {})
+            if z in self.planes:
+                # Mark the plane as the most recently used
+                self.planes.pop(z)
+                self.planes[z] = cached
+            missing = [l for l in levels if not l in cached]
+        if len(missing):
+            self.StorePlane(z, self.TracePlane(z, missing))
+        with self.lock:
+            cached = self.planes.get(z, {})
+            return dict((l, cached.get(l, [])) for l in levels)
+
+    def Precompute(self, positions, levels):
+        """Queue the given dose plane positions to be traced in the
+            background for the given levels (cGy)."""
+
+        with self.condition:
+            # Only the most recently requested planes are of interest
+            self.pending = list(positions)
+            self.levels = list(levels)
+            self.condition.notify()
+
+    def Stop(self):
+        """Stop the background thread and clear the cache."""
+
+        with self.condition:
+            self.running = False
+            self.pending = []
+            self.planes.clear()
+            self.condition.notify()
+
+    def PrecomputeThread(self):
+        """Thread to trace the isodose lines of the queued dose planes."""
+
+        while True:
+            with self.condition:
+                while self.running and not len(self.pending):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                z = self.pending.pop(0)
+                levels = self.levels
+                cached = self.planes.get(z, {})
+                missing = [l for l in levels if not l in cached]
+            if len(missing):
+                try:
+                    self.StorePlane(z, self.TracePlane(z, missing))
+                except Exception:
+                    logger.exception("Unable to precompute isodoses at %s", z)
+
+    def StorePlane(self, z, isodoses):
+        """Add the traced isodose lines to the cache, evicting the least
+            recently used planes if the cache is full."""
+
+        with self.lock:
+            if not self.running:
+                return
+            plane = self.planes.pop(z, {})
+            plane.update(isodoses)
+            self.planes[z] = plane
+            while len(self.planes) > self.maxplanes:
+                self.planes.popitem(last=False)
+
+    def TracePlane(self, z, levels):
+        """Trace the given levels (cGy) on the dose plane at position z and
+            return the isodose lines in image pixel space."""
+
+        isodoses = dict((l, []) for l in levels)
+        grid = self.dose.GetDosePlane(z)
+        if not len(grid):
+            return isodoses
+        # Convert the absolute dose levels into Gy
+        # and trace all of them in a single pass
+        contours = marching_squares(grid, [l / 100 for l in levels])
+        # Map the contours of all levels into image pixel space at once
+        pixeldata = interpolate_polylines(
+            [p for c in contours for p in c], self.dosepixlut, offset=1)
+        n = 0
+        for l, c in zip(levels, contours):
+            isodoses[l] = pixeldata[n:n+len(c)]
+            n += len(c)
+        return isodoses
+
+def interpolate_polylines(polylines, lut, offset=0):
+    """Convert polylines given in fractional (column, row) grid indices into
+        the coordinates of the given (x, y) LUT in a single vectorized step,
+        linearly interpolating between the LUT entries."""
+
+    if not len(polylines):
+        return []
+    points = np.concatenate(polylines)
+    x = np.interp(points[:, 0], np.arange(len(lut[0])), lut[0])
+    y = np.interp(points[:, 1], np.arange(len(lut[1])), lut[1])
+    splits = np.cumsum([len(p) for p in polylines])[:-1]
+    return np.split(np.column_stack((x, y)) + offset, splits)
+
+def decimate_polyline(points, tolerance):
+    """Reduce the level of detail of a polyline by dropping each point that
+        falls within the same cell of a grid of the given spacing as the
+        previous point. Closed polylines keep at least three points."""
+
+    points = np.asarray(points)
+    if (tolerance <= 0) or (len(points) <= 3):
+        return points
+    cells = np.floor(points / tolerance)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(cells[1:] != cells[:-1], axis=1)
+    if np.count_nonzero(keep) < 3:
+        return points
+    return points[keep]
+
+def simplify_polyline(points, tolerance):
+    """Simplify a closed polyline with the Douglas-Peucker algorithm so that
+        no point is further than the tolerance from the simplified polyline.
+        All segments are refined together at each step in a vectorized way."""
+
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if (tolerance <= 0) or (n <= 4):
+        return points
+    # Split the closed polyline at the first point and the point furthest
+    # from it, so that the two halves can be simplified as open polylines
+    far = int(np.argmax(np.sum((points - points[0]) ** 2, axis=1)))
+    if far == 0:
+        return points[0:1]
+    closed = np.concatenate((points, points[0:1]))
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[[0, far, n]] = True
+    index = np.arange(n + 1)
+    while True:
+        # Assign every point to the segment between the kept points around it
+        kept = np.flatnonzero(keep)
+        segment = np.searchsorted(kept, index, side='right') - 1
+        segment = np.minimum(segment, len(kept) - 2)
+        start = closed[kept[segment]]
+        end = closed[kept[segment + 1]]
+        # Perpendicular distance of each point to its segment
+        d = end - start
+        length = np.hypot(d[:, 0], d[:, 1])
+        cross = np.abs(d[:, 0] * (closed[:, 1] - start[:, 1]) -
+                       d[:, 1] * (closed[:, 0] - start[:, 0]))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.where(length > 0, cross / length,
+                np.hypot(closed[:, 0] - start[:, 0],
+                         closed[:, 1] - start[:, 1]))
+        dist[keep] = 0
+        # Keep the furthest point of each segment that is out of tolerance
+        maxdist = np.maximum.reduceat(dist, kept[:-1])
+        refine = np.flatnonzero(maxdist > tolerance)
+        if not len(refine):
+            break
+        order = np.lexsort((-dist, segment))
+        first = np.searchsorted(segment[order], refine)
+        keep[order[first]] = True
+    return points[keep[:-1]]
+
+def polyline_in_region(points, region):
+    """Determine whether the bounding box of the polyline intersects the
+        given (xmin, ymin, xmax, ymax) region."""
+
+    if region is None:
+        return True
+    pmin = points.min(axis=0)
+    pmax = points.max(axis=0)
+    return ((pmax[0] >= region[0]) and (pmin[0] <= region[2]) and
+            (pmax[1] >= region[1]) and (pmin[1] <= region[3]))
+
+def benchmark(grid=None, levels=None, repeat=10):
+    """Compare the time (in seconds) to trace the given levels on a dose plane
+        with the built-in marching squares engine and matplotlib's _cntr
+        tracer, if it is available."""
+
+    if grid is None:
+        y, x = np.mgrid[0:256, 0:256]
+        grid = 1000 * np.exp(-((x - 128)**2 + (y - 110)**2) / (2 * 50.0**2))
+        grid += 25 * np.sin(x / 7.0) * np.cos(y / 11.0)
+    if levels is None:
+        levels = np.array([30, 50, 70, 80, 90, 95, 98, 100, 102]) * 10
+    results = {}
+
+    start = time.time()
+    for r in range(repeat):
+        marching_squares(grid, levels)
+    results['marching_squares'] = (time.time() - start) / repeat
+
+    try:
+        from matplotlib import _cntr as cntr
+    except ImportError:
+        logger.info("matplotlib._cntr is not available for comparison.")
+    else:
+        x, y = np.meshgrid(np.arange(grid.shape[1]), np.arange(grid.shape[0]))
+        start = time.time()
+        for r in range(repeat):
+            isodosegen = cntr.Cntr(x, y, grid)
+            for level in levels:
+                isodosegen.trace(level)
+        results['cntr'] = (time.time() - start) / repeat
+    return results
+
+if __name__ == '__main__':
+    for engine, seconds in sorted(benchmark().items()):
+        print("%s: %.2f ms per dose plane" % (engine, seconds * 1000))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# decodepool.py
+"""Class and functions to decode compressed DICOM pixel data in parallel
+    worker processes."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import logging
+logger = logging.getLogger('dicompyler.decodepool')
+import multiprocessing
+import numpy as np
+try:
+    import pydicom
+except ImportError:
+    import dicom as pydicom
+from dicompyler import pixelmap
+
+def is_compressed(ds):
+    """Return whether the pixel data of the dataset is compressed."""
+
+    syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    return ('PixelData' in ds) and (syntax is not None) and \
+        getattr(syntax, 'is_compressed', False)
+
+def decode_file(filename):
+    """Return the decoded pixel array of the DICOM file. This is called in a
+        worker process."""
+
+    read = getattr(pydicom, 'dcmread', None) or pydicom.read_file
+    return read(filename, force=True).pixel_array
+
+class DecodePool:
+    """Decodes the compressed pixel data of a series of images in parallel
+        worker processes."""
+
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = max(multiprocessing.cpu_count() - 1, 1)
+        self.processes = processes
+
+    def DecodeSeries(self, datasets, progressfunc=None, terminate=None):
+        """Decode the compressed images of the series in parallel and stream
+            the decoded slices into a (slices, rows, columns) volume buffer in
+            the order of the datasets. Uncompressed slices are copied from
+            their pixel data. Each decoded slice of the volume is stored as
+            the decoded pixels of its dataset, so that it is not decoded
+            again when it is displayed. Returns the volume, or None if the
+            images do not share the same size or the decoding was
+            terminated."""
+
+        compressed = [n for n, ds in enumerate(datasets) if is_compressed(ds)
+                      and (pixelmap.get_pixel_offset(ds) is not None)]
+        decodedslices = set(compressed)
+        if not len(compressed):
+            return None
+        shapes = set((ds.Rows, ds.Columns) for ds in datasets)
+        if not (len(shapes) == 1):
+            return None
+        volume = None
+
+        # Spawn the workers instead of forking the running GUI process from
+        # the importer thread, which can deadlock
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(min(self.processes, len(compressed)))
+        try:
+            # The results are returned in order as soon as each is decoded
+            results = pool.imap(decode_file,
+                [datasets[n].filename for n in compressed])
+            for i, (n, pixels) in enumerate(zip(compressed, results)):
+                if terminate and terminate():
+                    return None
+                if volume is None:
+                    volume = np.zeros((len(datasets),) + pixels.shape,
+                                      dtype=pixels.dtype)
+                volume[n] = pixels
+                pixelmap.set_decoded_pixels(datasets[n], volume[n])
+                if progressfunc:
+                    progressfunc(i + 1, len(compressed))
+        except Exception:
+            logger.exception("The images could not be decoded in parallel.")
+            return None
+        finally:
+            pool.terminate()
+
+        # Uncompressed slices are still accessed through their memory map
+        for n, ds in enumerate(datasets):
+            if not (n in decodedslices):
+                volume[n] = pixelmap.get_image_pixels(ds)
+        return volume
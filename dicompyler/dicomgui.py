@@ -18,7 +18,7 @@ from wx.xrc import *
 from wx.lib.pubsub import pub
 import numpy as np
 from dicompylercore import dicomparser
-from dicompyler import guiutil, util
+from dicompyler import decodepool, dosegrid, guiutil, pixelmap, util
 
 def ImportDicom(parent):
     """Prepare to show the dialog that will Import DICOM and DICOM RT files."""
@@ -581,6 +581,10 @@ class DicomImporterDialog(wx.Dialog):
                             self.tcPatients.SetItemTextColour(badplan, wx.RED)
                             filearray = [dose['filename']]
                             self.EnableItemSelection(patient, dose, filearray)
+                # Allow the dose grids of each plan to be summed
+                if 'plans' in patient:
+                    for planid, plan in patient['plans'].items():
+                        self.AddPlanSumTree(patient, planid, plan)
             # No RT Dose files were found
             else:
                 if 'structures' in patient:
@@ -604,6 +608,35 @@ class DicomImporterDialog(wx.Dialog):
             self.lblProgress.SetLabel(
                 str(self.lblProgress.GetLabel()).replace(' Reading DICOM data...', ''))
 
+    def AddPlanSumTree(self, patient, planid, plan):
+        """Add an item to sum the beam (or otherwise fraction) dose grids of
+            the plan, if the plan has more than one of them. Plan dose grids
+            already contain the dose of the beams and are never summed."""
+
+        if not 'treeid' in plan:
+            return
+        for summationtype in ['BEAM', 'FRACTION']:
+            doses = [dose for doseid, dose in sorted(patient['doses'].items())
+                     if ((dose['rtplan'] == planid) and dose['hasgrid'] and
+                         (dose['summationtype'] == summationtype))]
+            if (len(doses) > 1):
+                break
+        else:
+            return
+        filearray = [dose['filename'] for dose in doses]
+        plansum = {'rtplan':planid,
+                   'rtss':plan['rtss'],
+                   'referenceframe':plan['referenceframe']}
+        name = 'RT Dose Plan Sum (' + str(len(doses)) + ' ' + \
+            summationtype.lower() + ' dose grids'
+        if (summationtype == 'BEAM'):
+            name += ': Beams ' + ', '.join(
+                str(dose['beam']) for dose in doses)
+        name += ')'
+        plansum['treeid'] = self.tcPatients.AppendItem(plan['treeid'], name, 6)
+        rxdose = plan['rxdose'] if plan['rxdose'] > 0 else None
+        self.EnableItemSelection(patient, plansum, filearray, rxdose)
+
     def EnableItemSelection(self, patient, item, filearray = [], rxdose = None):
         """Enable an item to be selected in the tree control."""
 
@@ -700,6 +733,7 @@ class DicomImporterDialog(wx.Dialog):
         """Get the data of the selected patient from the DICOM importer dialog."""
 
         wx.CallAfter(progressFunc, -1, 100, 'Importing patient. Please wait...')
+        pixelmap.clear_decoded_pixels()
         for n in range(0, len(filearray)):
             if terminate():
                 wx.CallAfter(progressFunc, 98, 100, 'Importing patient cancelled.')
@@ -719,8 +753,18 @@ class DicomImporterDialog(wx.Dialog):
             elif (dp.ds.Modality in ['RTPLAN']):
                 self.patient['rtplan'] = dp.ds
             elif (dp.ds.Modality in ['RTDOSE']):
+                if not 'rtdoses' in self.patient:
+                    self.patient['rtdoses'] = []
+                self.patient['rtdoses'].append(dp.ds)
                 self.patient['rtdose'] = dp.ds
             wx.CallAfter(progressFunc, n, len(filearray), 'Importing patient. Please wait...')
+        # Sum the dose grids if more than one RT Dose was selected
+        if (len(self.patient.get('rtdoses', [])) > 1):
+            self.patient['rtdose'] = dosegrid.sum_dose_grids(
+                self.patient['rtdoses'],
+                progressfunc=lambda num, length: wx.CallAfter(progressFunc,
+                    num, length, 'Summing RT Dose grids. Please wait...'))
+        self.patient.pop('rtdoses', None)
         # Sort the images based on a sort descriptor:
         # (ImagePositionPatient, InstanceNumber or AcquisitionNumber)
         if 'images' in self.patient:
@@ -786,6 +830,21 @@ class DicomImporterDialog(wx.Dialog):
 
             # Save the images back to the patient dictionary
             self.patient['images'] = sortedimages
+
+            # Decode compressed images in parallel instead of one at a time
+            # when each image is first displayed
+            if any(decodepool.is_compressed(image) for image in sortedimages):
+                volume = decodepool.DecodePool().DecodeSeries(sortedimages,
+                    progressfunc=lambda num, length: wx.CallAfter(progressFunc,
+                        num, length, 'Decoding images. Please wait...'),
+                    terminate=terminate)
+                if terminate():
+                    wx.CallAfter(progressFunc, 98, 100,
+                                 'Importing patient cancelled.')
+                    return
+                # Share the decoded volume in the order of the images
+                if volume is not None:
+                    self.patient['volume'] = volume
         wx.CallAfter(progressFunc, 98, 100, 'Importing patient complete.')
 
     def GetPatient(self):
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# dosegrid.py
+"""Classes and functions to access and process RT Dose grids."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import copy, threading
+from collections import OrderedDict
+import numpy as np
+from dicompylercore.dicomparser import DicomParser
+from dicompyler import pixelmap
+
+class DoseParser(DicomParser):
+    """Parses an RT Dose and caches the dose planes that have been accessed
+        as scaled float32 arrays (in Gy), evicting the least recently used
+        planes."""
+
+    def __init__(self, dataset, maxplanes=64):
+        DicomParser.__init__(self, dataset)
+        self.maxplanes = maxplanes
+        self.planes = OrderedDict()
+        self.planelock = threading.Lock()
+        self.maxdose = None
+
+    def GetDosePlane(self, z=0, threshold=0.5):
+        """Return the dose plane (in Gy) for the given slice position (mm),
+            or an empty array if the position is outside of the dose grid.
+            The returned array is shared and should not be modified."""
+
+        key = (round(float(z), 2), threshold)
+        with self.planelock:
+            if key in self.planes:
+                # Mark the plane as the most recently used
+                plane = self.planes.pop(key)
+                self.planes[key] = plane
+                return plane
+        grid = self.GetDoseGrid(key[0], threshold)
+        if len(grid):
+            plane = np.multiply(grid, float(self.ds.DoseGridScaling),
+                                dtype=np.float32)
+        else:
+            plane = np.array([], dtype=np.float32)
+        with self.planelock:
+            self.planes[key] = plane
+            while len(self.planes) > self.maxplanes:
+                self.planes.popitem(last=False)
+        return plane
+
+    def GetDoseGrid(self, z=0, threshold=0.5):
+        """Return the stored dose grid values for the given slice position
+            (mm) as DicomParser.GetDoseGrid does, but only read the one or
+            two frames that are needed instead of the entire pixel array."""
+
+        if not ('GridFrameOffsetVector' in self.ds):
+            return np.array([])
+        weights = get_plane_weights(
+            get_frame_positions(self.ds), float(z), threshold)
+        if not len(weights):
+            return np.array([])
+        frames = [get_dose_frames(self.ds, frame, frame + 1)[0]
+                  for frame, weight in weights]
+        if (weights[0][1] is None):
+            return frames[0]
+        return weights[0][1] * frames[0] + weights[1][1] * frames[1]
+
+    def GetMaxDose(self, chunksize=16):
+        """Return the maximum dose (in Gy) of the dose grid, which is
+            determined in chunks of frames so that the entire grid is never
+            decoded at once, and cached."""
+
+        if self.maxdose is None:
+            maxvalue = max(
+                float(np.amax(get_dose_frames(self.ds, start, start+chunksize)))
+                for start in range(0, get_frame_count(self.ds), chunksize))
+            self.maxdose = maxvalue * float(self.ds.DoseGridScaling)
+        return self.maxdose
+
+    def ClearDosePlanes(self):
+        """Remove all cached dose planes."""
+
+        with self.planelock:
+            self.planes.clear()
+
+def get_interpolation_weights(positions, size):
+    """Determine the lower grid index and interpolation weight for each of
+        the given number of pixels, based on the pixel position of each grid
+        index along the axis. Also returns which pixels are within the grid."""
+
+    return get_axis_weights(positions, np.arange(size))
+
+def get_axis_weights(positions, targets):
+    """Determine the lower grid index and interpolation weight for each of
+        the target positions, based on the position of each grid index along
+        the axis. Also returns which targets are within the grid."""
+
+    positions = np.asarray(positions, dtype=np.float64)
+    indices = np.arange(len(positions), dtype=np.float64)
+    # np.interp requires increasing positions (i.e. prone or feet first)
+    if (len(positions) > 1) and (positions[-1] < positions[0]):
+        positions = positions[::-1]
+        indices = indices[::-1]
+    u = np.interp(targets, positions, indices, left=np.nan, right=np.nan)
+    valid = ~np.isnan(u)
+    u = np.where(valid, u, 0)
+    lower = np.clip(np.floor(u).astype(np.intp), 0, max(len(positions)-2, 0))
+    weight = np.clip(u - lower, 0, 1)
+    return lower, weight, valid
+
+def resample_dose_plane(plane, dosepixlut, shape):
+    """Resample the dose plane onto an image pixel grid of the given shape
+        (rows, columns) by bilinear interpolation, using the image pixel
+        position of each dose grid column and row. Pixels outside of the
+        dose grid are set to NaN."""
+
+    plane = np.asarray(plane, dtype=np.float32)
+    x0, wx, xvalid = get_interpolation_weights(dosepixlut[0], shape[1])
+    y0, wy, yvalid = get_interpolation_weights(dosepixlut[1], shape[0])
+    x1 = np.minimum(x0 + 1, plane.shape[1] - 1)
+    y1 = np.minimum(y0 + 1, plane.shape[0] - 1)
+    # Interpolate along the columns first and then along the rows
+    wx = wx.astype(np.float32)
+    wy = wy.astype(np.float32)[:, np.newaxis]
+    columns = plane[:, x0] * (1 - wx) + plane[:, x1] * wx
+    resampled = columns[y0] * (1 - wy) + columns[y1] * wy
+    resampled[~yvalid, :] = np.nan
+    resampled[:, ~xvalid] = np.nan
+    return resampled
+
+def get_grid_positions(ds):
+    """Return the patient coordinates (mm) of the columns, rows and frames
+        of the given RT Dose dataset in a head first or feet first, supine
+        or prone orientation. The positions decrease along an axis that
+        runs against the patient axis."""
+
+    orientation = [float(v) for v in ds.ImageOrientationPatient]
+    x = float(ds.ImagePositionPatient[0]) + \
+        np.arange(ds.Columns) * orientation[0] * float(ds.PixelSpacing[1])
+    y = float(ds.ImagePositionPatient[1]) + \
+        np.arange(ds.Rows) * orientation[4] * float(ds.PixelSpacing[0])
+    return x, y, get_frame_positions(ds)
+
+def get_frame_direction(ds):
+    """Return the direction (1 or -1) of the frame offsets along the slice
+        axis of the RT Dose dataset, as determined by
+        DicomParser.GetDoseGrid."""
+
+    return -1.0 if (float(ds.ImageOrientationPatient[0]) < 0) else 1.0
+
+def get_frame_positions(ds):
+    """Return the slice position (mm) of each frame of the RT Dose dataset,
+        as determined by DicomParser.GetDoseGrid."""
+
+    offsets = np.array(ds.GridFrameOffsetVector, dtype=np.float64)
+    # Relative frame offsets start at zero, otherwise they are absolute
+    if (offsets[0] != 0):
+        return offsets
+    return get_frame_direction(ds) * offsets + \
+        float(ds.ImagePositionPatient[2])
+
+def get_plane_weights(planes, z, threshold=0.5):
+    """Return a list of (frame, weight) that make up the dose plane at the
+        given slice position (mm), interpolating between the two closest
+        frames as DicomParser.GetDoseGrid does. The weight is None if a
+        frame is within the threshold (mm) and the list is empty if the
+        position is outside of the grid."""
+
+    distance = np.fabs(planes - z)
+    if (np.amin(distance) < threshold):
+        return [(int(np.argmin(distance)), None)]
+    elif ((z < np.amin(planes)) or (z > np.amax(planes))):
+        return []
+    ub = np.argmin(distance)
+    lower = distance.copy()
+    lower[ub] = np.amax(distance)
+    lb = np.argmin(lower)
+    fz = (z - planes[lb]) / (planes[ub] - planes[lb])
+    return [(int(ub), fz), (int(lb), 1.0 - fz)]
+
+def get_frame_count(ds):
+    """Return the number of frames of the RT Dose dataset."""
+
+    return int(getattr(ds, 'NumberOfFrames', 1) or 1)
+
+def get_pixel_data_size(ds):
+    """Return the size (bytes) of the stored pixel values of the dataset as
+        given by its header, without reading the (deferred) pixel data."""
+
+    return ds.Rows * ds.Columns * get_frame_count(ds) * \
+        int(getattr(ds, 'SamplesPerPixel', 1)) * ds.BitsAllocated // 8
+
+def get_dose_frames(ds, start=0, stop=None):
+    """Return the stored pixel values of the given range of frames of the
+        RT Dose dataset. Uncompressed frames are a zero-copy view of the file
+        or are read directly from the pixel data, so that the entire grid is
+        never decoded at once."""
+
+    nframes = get_frame_count(ds)
+    start = max(start, 0)
+    stop = nframes if (stop is None) else min(stop, nframes)
+    shape = (stop - start, ds.Rows, ds.Columns)
+    frames = pixelmap.get_pixel_map(ds)
+    if frames is not None:
+        return frames[start:stop]
+    syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    dtype = pixelmap.get_pixel_dtype(ds)
+    if (syntax is None) or getattr(syntax, 'is_compressed', True) or \
+            (dtype is None):
+        return ds.pixel_array.reshape((nframes, ds.Rows, ds.Columns))[start:stop]
+    framesize = ds.Rows * ds.Columns
+    return np.frombuffer(ds.PixelData, dtype, count=shape[0] * framesize,
+        offset=start * framesize * dtype.itemsize).reshape(shape)
+
+def get_common_grid(datasets):
+    """Return the column, row and frame positions (mm) of a grid that
+        covers all of the given RT Dose datasets, with the resolution of the
+        first dataset."""
+
+    grids = [get_grid_positions(ds) for ds in datasets]
+    positions = []
+    for axis in range(3):
+        reference = grids[0][axis]
+        spacing = (reference[1] - reference[0]) if (len(reference) > 1) else 1
+        lower = min(np.amin(g[axis]) for g in grids)
+        upper = max(np.amax(g[axis]) for g in grids)
+        first, last = (lower, upper) if (spacing > 0) else (upper, lower)
+        # Extend the reference grid in whole steps to cover the other grids
+        start = reference[0] - np.ceil(
+            abs(reference[0] - first) / abs(spacing) - 1e-6) * spacing
+        count = int(np.floor(abs(last - start) / abs(spacing) + 1e-6)) + 1
+        positions.append(start + np.arange(count) * spacing)
+    return positions
+
+def resample_dose_grid(grid, source, target):
+    """Resample the (frames, rows, columns) dose grid given at the source
+        (x, y, z) positions onto the target (x, y, z) positions by
+        separable trilinear interpolation. Target positions outside of the
+        source grid have a dose of zero."""
+
+    weights = [get_axis_weights(s, t) for s, t in zip(source, target)]
+    (x0, wx, xv), (y0, wy, yv), (z0, wz, zv) = weights
+    x1 = np.minimum(x0 + 1, grid.shape[2] - 1)
+    y1 = np.minimum(y0 + 1, grid.shape[1] - 1)
+    z1 = np.minimum(z0 + 1, grid.shape[0] - 1)
+    wz = wz.astype(np.float32)[:, np.newaxis, np.newaxis]
+    wy = wy.astype(np.float32)[np.newaxis, :, np.newaxis]
+    wx = wx.astype(np.float32)
+    # Interpolate along the frames, then the rows and then the columns
+    frames = grid[z0].astype(np.float32) * (1 - wz) + \
+        grid[z1].astype(np.float32) * wz
+    rows = frames[:, y0] * (1 - wy) + frames[:, y1] * wy
+    resampled = rows[:, :, x0] * (1 - wx) + rows[:, :, x1] * wx
+    resampled[~zv] = 0
+    resampled[:, ~yv] = 0
+    resampled[:, :, ~xv] = 0
+    return resampled
+
+def get_dose_chunk(ds, source, target):
+    """Return the dose (in Gy) of the RT Dose dataset with the source
+        (x, y, z) grid positions at the target (x, y, z) grid positions. The
+        grid is only resampled if the positions differ."""
+
+    scaling = np.float32(ds.DoseGridScaling)
+    grid = get_dose_frames(ds)
+    # Take the frames directly if the target is a part of the source grid
+    if all((len(s) == len(t)) and np.allclose(s, t)
+           for s, t in zip(source[0:2], target[0:2])):
+        frames = np.flatnonzero(np.isclose(
+            source[2][:, np.newaxis], target[2][np.newaxis, :]).any(axis=1))
+        if (len(frames) == len(target[2])):
+            return grid[frames].astype(np.float32) * scaling
+    return resample_dose_grid(grid, source, target) * scaling
+
+def get_dose_range(ds, chunksize=16):
+    """Return the minimum and maximum dose (in Gy) of the RT Dose dataset,
+        which are determined in chunks of frames."""
+
+    ranges = [(float(np.amin(chunk)), float(np.amax(chunk)))
+              for chunk in (get_dose_frames(ds, start, start + chunksize)
+              for start in range(0, get_frame_count(ds), chunksize))]
+    scaling = float(ds.DoseGridScaling)
+    return min(r[0] for r in ranges) * scaling, \
+        max(r[1] for r in ranges) * scaling
+
+def sum_dose_grids(datasets, chunksize=16, progressfunc=None):
+    """Sum the dose grids of the given RT Dose datasets and return the plan
+        sum as a new RT Dose dataset. Grids that do not share the geometry of
+        the first grid are resampled onto a common grid. The sum is computed
+        in chunks of frames that are stored directly as the 32-bit values
+        of the plan sum, so that only the chunk is held in floating point."""
+
+    datasets = [ds for ds in datasets if "PixelData" in ds]
+    target = get_common_grid(datasets)
+    sources = [get_grid_positions(ds) for ds in datasets]
+    nframes, nrows, ncols = len(target[2]), len(target[1]), len(target[0])
+    # Interpolated doses are within the range of each grid, so the sum of
+    # the ranges bounds the plan sum before it is computed
+    ranges = [get_dose_range(ds, chunksize) for ds in datasets]
+    signed = any(r[0] < 0 for r in ranges)
+    scaling = get_dose_scaling(
+        sum(max(abs(r[0]), abs(r[1])) for r in ranges), signed)
+    pixels = np.empty((nframes, nrows, ncols),
+                      dtype=np.int32 if signed else np.uint32)
+    chunks = range(0, nframes, chunksize)
+    for c, start in enumerate(chunks):
+        end = min(start + chunksize, nframes)
+        chunktarget = (target[0], target[1], target[2][start:end])
+        total = np.zeros((end - start, nrows, ncols), dtype=np.float32)
+        for ds, source in zip(datasets, sources):
+            total += get_dose_chunk(ds, source, chunktarget)
+        pixels[start:end] = np.round(total / scaling)
+        if progressfunc:
+            progressfunc(c + 1, len(chunks))
+
+    ds = create_pixel_dataset(datasets[0], pixels, scaling, target)
+    ds.DoseSummationType = 'PLAN'
+    return ds
+
+def get_dose_scaling(maxdose, signed=False):
+    """Return the dose grid scaling that stores doses (in Gy) of up to the
+        given absolute maximum as signed or unsigned 32-bit integers."""
+
+    # Leave headroom for rounding the scaling to a decimal string
+    headroom = 2 ** 30 if signed else 2 ** 31
+    return float('%.8e' % (maxdose / headroom)) if (maxdose > 0) else 1.0
+
+def create_dose_dataset(template, grid, positions, chunksize=16):
+    """Return a copy of the template RT Dose dataset that holds the given
+        (frames, rows, columns) dose grid (in Gy) at the given column, row
+        and frame positions (mm). The dose is stored as 32-bit integers with
+        a new scaling, which is signed if the grid has negative values."""
+
+    signed = bool(grid.size) and (float(np.amin(grid)) < 0)
+    maxdose = float(np.amax(np.abs(grid))) if grid.size else 0
+    scaling = get_dose_scaling(maxdose, signed)
+    pixels = np.empty(grid.shape, dtype=np.int32 if signed else np.uint32)
+    for start in range(0, len(grid), chunksize):
+        pixels[start:start+chunksize] = np.round(
+            grid[start:start+chunksize] / scaling)
+    return create_pixel_dataset(template, pixels, scaling, positions)
+
+def create_pixel_dataset(template, pixels, scaling, positions):
+    """Return a copy of the template RT Dose dataset that holds the given
+        (frames, rows, columns) signed or unsigned 32-bit stored values with
+        the given dose grid scaling at the column, row and frame positions
+        (mm)."""
+
+    # Share the template pixel data with the copy instead of copying it,
+    # since it is replaced
+    pixeldata = template.get_item('PixelData')
+    ds = copy.deepcopy(template, {id(pixeldata):pixeldata})
+    if 'DVHSequence' in ds:
+        del ds.DVHSequence
+    ds.ImagePositionPatient = [round(float(positions[a][0]), 4)
+                               for a in range(3)]
+    ds.GridFrameOffsetVector = [round(float(z), 4) for z in
+        (positions[2] - positions[2][0]) * get_frame_direction(template)]
+    ds.NumberOfFrames = pixels.shape[0]
+    ds.Rows = pixels.shape[1]
+    ds.Columns = pixels.shape[2]
+    ds.BitsAllocated = 32
+    ds.BitsStored = 32
+    ds.HighBit = 31
+    ds.PixelRepresentation = 1 if (pixels.dtype.kind == 'i') else 0
+    ds.DoseGridScaling = scaling
+    # The new pixel data is not backed by the file of the template
+    ds.filename = None
+    del ds.PixelData
+    ds.PixelData = pixels.tobytes()
+    return ds
+
+class DoseComparison:
+    """Compares an RT Dose dataset to a reference RT Dose dataset on the
+        reference grid. The resampled comparison grid is cached so that the
+        difference and further analyses only resample it once."""
+
+    def __init__(self, reference, comparison, chunksize=16):
+        self.reference = reference
+        self.comparison = comparison
+        self.chunksize = chunksize
+        self.positions = get_grid_positions(reference)
+        self.resampled = None
+        self.difference = None
+
+    def GetReferenceGrid(self):
+        """Return the reference dose grid (in Gy)."""
+
+        return get_dose_frames(self.reference) * np.float32(
+            self.reference.DoseGridScaling)
+
+    def GetResampledGrid(self):
+        """Return the comparison dose grid (in Gy) resampled onto the
+            reference grid in chunks of frames, which is cached."""
+
+        if self.resampled is None:
+            x, y, z = self.positions
+            source = get_grid_positions(self.comparison)
+            resampled = np.empty((len(z), len(y), len(x)), dtype=np.float32)
+            for start in range(0, len(z), self.chunksize):
+                end = start + self.chunksize
+                resampled[start:end] = get_dose_chunk(
+                    self.comparison, source, (x, y, z[start:end]))
+            self.resampled = resampled
+        return self.resampled
+
+    def GetDifferenceGrid(self):
+        """Return the voxel-wise comparison minus reference dose grid
+            (in Gy), which is cached."""
+
+        if self.difference is None:
+            self.difference = self.GetResampledGrid() - self.GetReferenceGrid()
+        return self.difference
+
+    def GetDifference(self):
+        """Return the dose difference as a new RT Dose dataset."""
+
+        ds = create_dose_dataset(
+            self.reference, self.GetDifferenceGrid(), self.positions,
+            self.chunksize)
+        ds.DoseType = 'ERROR'
+        return ds
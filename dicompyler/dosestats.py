@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# dosestats.py
+"""Classes and functions to calculate dose statistics for structures."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# It's assumed that the reference (prescription) dose is in cGy.
+
+import threading
+import numpy as np
+from matplotlib.path import Path
+from dicompylercore import dvh
+from dicompyler import dosegrid
+
+def get_contour_mask(plane, x, y):
+    """Return the boolean (rows, columns) mask of the dose grid positions
+        that are inside the contours of the structure plane. Contours inside
+        of other contours are treated as holes (even-odd rule)."""
+
+    points = np.column_stack([np.tile(x, len(y)), np.repeat(y, len(x))])
+    mask = np.zeros(len(points), dtype=bool)
+    for contour in plane:
+        vertices = np.array(contour['data'], dtype=np.float64)[:, 0:2]
+        mask ^= Path(vertices).contains_points(points)
+    return mask.reshape((len(y), len(x)))
+
+def get_bounding_box(structure):
+    """Return the minimum and maximum (x, y, z) coordinates (mm) of the
+        contours of the structure, or None if it has no contours."""
+
+    points = [np.array(contour['data'], dtype=np.float64).reshape(-1, 3)
+              for plane in structure['planes'].values() for contour in plane]
+    if not len(points):
+        return None
+    points = np.concatenate(points)
+    return np.amin(points, axis=0), np.amax(points, axis=0)
+
+def get_crop_range(positions, lower, upper, padding):
+    """Return the (start, stop) index range of the grid positions (mm) that
+        lie within the padded extent, which may be empty."""
+
+    inside = np.flatnonzero((positions >= lower - padding) &
+                            (positions <= upper + padding))
+    if not len(inside):
+        return 0, 0
+    return inside[0], inside[-1] + 1
+
+class DoseSamples:
+    """Sorted, volume-weighted dose samples of a structure, from which DVHs
+        and dose or volume constraints can be derived for any scaling of the
+        dose without recalculating the DVH.
+
+        The volume (cm3) of the contours outside of the dose grid is counted
+        in the volume of the structure as dvhcalc does, by scaling the volume
+        of the samples inside of the dose grid up to the full volume."""
+
+    def __init__(self, doses, volumes, outside=0.0):
+        order = np.argsort(doses, kind='mergesort')
+        self.doses = np.asarray(doses, dtype=np.float64)[order]
+        volumes = np.asarray(volumes, dtype=np.float64)[order]
+        self.outside = float(outside)
+        inside = float(np.sum(volumes))
+        self.factor = (inside + self.outside) / inside if inside else 1.0
+        self.volumes = volumes * self.factor
+        # Volume (cm3) that receives at least the dose of each sample
+        self.cumulative = np.cumsum(self.volumes[::-1])[::-1]
+        self.volume = float(self.cumulative[0]) if len(self.doses) else 0.0
+        self.integral = float(np.dot(self.doses, self.volumes))
+
+    def __len__(self):
+        return len(self.doses)
+
+    def GetMean(self, scale=1.0):
+        """Return the mean dose (Gy) with the dose scaled by the factor."""
+
+        return self.integral * scale / self.volume if self.volume else 0.0
+
+    def GetVolumeAtDose(self, dose, scale=1.0):
+        """Return the volume (cm3) that receives at least the given dose (Gy)
+            with the dose scaled by the factor, i.e. V20Gy."""
+
+        i = np.searchsorted(self.doses, dose / float(scale), side='left')
+        return float(self.cumulative[i]) if (i < len(self.doses)) else 0.0
+
+    def GetDoseAtVolume(self, volume, scale=1.0):
+        """Return the minimum dose (Gy) received by the given hottest volume
+            (cm3) with the dose scaled by the factor, i.e. D2cc."""
+
+        if not len(self.doses):
+            return 0.0
+        i = np.searchsorted(-self.cumulative, -volume, side='right') - 1
+        return float(self.doses[max(i, 0)] * scale)
+
+    def GetDVH(self, scale=1.0, binwidth=0.01, limit=None, name=None):
+        """Return the cumulative DVH with the dose scaled by the factor and
+            the given bin width (Gy). As in dvhcalc, the voxels with doses
+            above the limit (Gy) are excluded from the volume, while the
+            volume outside of the dose grid is included."""
+
+        doses = np.maximum(self.doses, 0) * scale
+        volumes = self.volumes
+        if limit is not None:
+            below = doses < limit
+            doses, volumes = doses[below], volumes[below]
+        bins = np.floor(doses / binwidth).astype(np.intp)
+        counts = np.bincount(bins, volumes) if len(bins) else np.zeros(1)
+        if len(bins) and (len(bins) < len(self.doses)):
+            # Scale the remaining volume inside of the dose grid up by the
+            # volume outside of the dose grid
+            inside = np.sum(counts) / self.factor
+            counts *= (inside + self.outside) / np.sum(counts)
+        return dvh.DVH(counts=counts,
+                       bins=np.arange(len(counts) + 1) * binwidth,
+                       dvh_type='differential', dose_units='Gy',
+                       volume_units='cm3', name=name).cumulative
+
+class StructureMasks:
+    """Caches the masks of the structures on the dose grid as the flat
+        indices of each dose plane that are inside of the structure, along
+        with the sorted dose samples of each structure."""
+
+    def __init__(self, dose, structures):
+        self.dose = dose
+        self.structures = structures
+        self.masks = {}
+        self.samples = {}
+        self.boxes = {}
+        self.masklock = threading.Lock()
+        doselut = dose.GetPatientToPixelLUT()
+        self.x = np.array(doselut[0], dtype=np.float64)
+        self.y = np.array(doselut[1], dtype=np.float64)
+        spacing = [float(s) for s in dose.ds.PixelSpacing]
+        self.pixelarea = spacing[0] * spacing[1]
+        # Pad the bounding boxes by a pixel so that no edge voxel is lost
+        self.padding = max(spacing)
+
+    def GetBoundingBox(self, id):
+        """Return the cached bounding box of the structure (mm)."""
+
+        if not id in self.boxes:
+            self.boxes[id] = get_bounding_box(self.structures[id])
+        return self.boxes[id]
+
+    def GetMask(self, id):
+        """Return a list of (slice position, flat indices) for each plane of
+            the structure that intersects the dose grid. Only the dose grid
+            within the padded bounding box of the structure is voxelized."""
+
+        with self.masklock:
+            if id in self.masks:
+                return self.masks[id]
+        mask = [(z, rows * len(self.x) + cols)
+                for z, rows, cols in self.CalculateMask(id)]
+        with self.masklock:
+            self.masks[id] = mask
+        return mask
+
+    def CalculateMask(self, id, step=1):
+        """Return a list of (slice position, row indices, column indices) of
+            the dose grid voxels inside the structure, sampling every step-th
+            row and column of the dose grid within the bounding box. Planes
+            outside of the dose grid are included, since their volume is
+            counted in the volume of the structure."""
+
+        mask = []
+        box = self.GetBoundingBox(id)
+        if box is None:
+            return mask
+        c0, c1 = get_crop_range(self.x, box[0][0], box[1][0], self.padding)
+        r0, r1 = get_crop_range(self.y, box[0][1], box[1][1], self.padding)
+        if (c0 == c1) or (r0 == r1):
+            return mask
+        for z, plane in self.structures[id]['planes'].items():
+            rows, cols = np.nonzero(get_contour_mask(plane,
+                self.x[c0:c1:step], self.y[r0:r1:step]))
+            if len(rows):
+                mask.append((float(z), rows * step + r0, cols * step + c0))
+        return mask
+
+    def GetPreviewSamples(self, id, step=4):
+        """Return approximate dose samples of the structure from every
+            step-th row and column of the dose grid, with each sample
+            representing the volume of step x step voxels. The samples are
+            not cached."""
+
+        doses = []
+        outside = 0
+        for z, rows, cols in self.CalculateMask(id, step):
+            plane = self.dose.GetDosePlane(z)
+            if len(plane):
+                doses.append(plane[rows, cols])
+            else:
+                outside += len(rows)
+        doses = np.concatenate(doses) if len(doses) else \
+            np.array([], dtype=np.float32)
+        voxelvolume = self.pixelarea * step * step * \
+            float(self.structures[id]['thickness']) / 1000
+        return DoseSamples(doses, np.full(len(doses), voxelvolume),
+                           outside * voxelvolume)
+
+    def GetSamples(self, id):
+        """Return the sorted dose samples of the voxels inside the structure,
+            along with the volume (cm3) that each voxel represents."""
+
+        with self.masklock:
+            if id in self.samples:
+                return self.samples[id]
+        mask = self.GetMask(id)
+        planes = [(self.dose.GetDosePlane(z), indices) for z, indices in mask]
+        doses = [plane.ravel()[indices] for plane, indices in planes
+                 if len(plane)]
+        doses = np.concatenate(doses) if len(doses) else \
+            np.array([], dtype=np.float32)
+        # Contours outside of the dose grid still add to the volume
+        outside = sum(len(indices) for plane, indices in planes
+                      if not len(plane))
+        # Each voxel represents the full plane thickness, as in the DVH
+        voxelvolume = self.pixelarea * \
+            float(self.structures[id]['thickness']) / 1000
+        samples = DoseSamples(doses, np.full(len(doses), voxelvolume),
+                              outside * voxelvolume)
+        with self.masklock:
+            self.samples[id] = samples
+        return samples
+
+    def Clear(self):
+        """Remove all cached structure masks and dose samples."""
+
+        with self.masklock:
+            self.masks.clear()
+            self.samples.clear()
+
+def calculate_dvh(dose, structure, limit=500, binwidth=0.01,
+                  memory=512 * 2 ** 20):
+    """Calculate the cumulative DVH of the structure by streaming the dose
+        grid in chunks of frames, so that no more than about the given
+        memory (bytes) is used for the dose grid. The histogram is
+        accumulated for each plane and matches DoseSamples.GetDVH for the
+        same limit (Gy) and bin width (Gy), which follows the volume rules of
+        dvhcalc. Returns None if the structure does not intersect the dose
+        grid."""
+
+    ds = dose.ds
+    doselut = dose.GetPatientToPixelLUT()
+    x = np.array(doselut[0], dtype=np.float64)
+    y = np.array(doselut[1], dtype=np.float64)
+    planes = dosegrid.get_frame_positions(ds)
+    scaling = float(ds.DoseGridScaling)
+    spacing = [float(s) for s in ds.PixelSpacing]
+    box = get_bounding_box(structure)
+    if box is None:
+        return None
+    c0, c1 = get_crop_range(x, box[0][0], box[1][0], max(spacing))
+    r0, r1 = get_crop_range(y, box[0][1], box[1][1], max(spacing))
+    if (c0 == c1) or (r0 == r1):
+        return None
+
+    # Each frame needs its stored values along with the interpolated plane
+    framebytes = ds.Rows * ds.Columns * (ds.BitsAllocated // 8 + 12)
+    chunksize = max(2, int(memory // framebytes))
+    chunk, start = None, 0
+    nbins = int(np.ceil(limit / binwidth))
+    counts = np.zeros(nbins, dtype=np.int64)
+    voxels, binned, outside = 0, 0, 0
+    for z in sorted(structure['planes'], key=float):
+        rows, cols = np.nonzero(get_contour_mask(
+            structure['planes'][z], x[c0:c1], y[r0:r1]))
+        if not len(rows):
+            continue
+        weights = dosegrid.get_plane_weights(planes, float(z))
+        # Contours outside of the dose grid still add to the volume
+        if not len(weights):
+            outside += len(rows)
+            continue
+        frames = [frame for frame, weight in weights]
+        # Read the next chunk of frames if the plane is not in the chunk
+        if (chunk is None) or (min(frames) < start) or \
+                (max(frames) >= start + len(chunk)):
+            start = min(frames)
+            chunk = dosegrid.get_dose_frames(ds, start, start + chunksize)
+        # Only the cropped part of the plane is interpolated and scaled
+        if (weights[0][1] is None):
+            grid = chunk[frames[0] - start, r0:r1, c0:c1]
+        else:
+            (ub, fz), (lb, fl) = weights
+            grid = fz * chunk[ub - start, r0:r1, c0:c1] + \
+                fl * chunk[lb - start, r0:r1, c0:c1]
+        doseplane = np.multiply(grid, scaling, dtype=np.float32)
+        doses = np.maximum(doseplane[rows, cols].astype(np.float64), 0)
+        doses = doses[doses < limit]
+        counts += np.bincount(np.floor(doses / binwidth).astype(np.intp),
+                              minlength=nbins)
+        voxels += len(rows)
+        binned += len(doses)
+    if not voxels:
+        return None
+
+    # Each voxel represents the full plane thickness, as in the DVH
+    voxelvolume = spacing[0] * spacing[1] * \
+        float(structure['thickness']) / 1000
+    counts = np.trim_zeros(counts, trim='b') * voxelvolume
+    if not len(counts):
+        counts = np.zeros(1)
+    elif outside:
+        # Doses above the limit are excluded from the volume, as in dvhcalc,
+        # while the volume outside of the dose grid is included
+        counts *= float(binned + outside) / binned
+    return dvh.DVH(counts=counts,
+                   bins=np.arange(len(counts) + 1) * binwidth,
+                   dvh_type='differential', dose_units='Gy',
+                   volume_units='cm3', name=structure.get('name')).cumulative
+
+class GridSamples:
+    """Sorted stored values of the entire dose grid, from which the volume of
+        any isodose level can be determined for any scaling of the dose
+        without scanning the dose grid again."""
+
+    def __init__(self, dose, chunksize=16):
+        ds = dose.ds
+        nframes = dosegrid.get_frame_count(ds)
+        framesize = ds.Rows * ds.Columns
+        values = None
+        # Copy the grid in chunks of frames and sort the copy in place
+        for start in range(0, nframes, chunksize):
+            chunk = dosegrid.get_dose_frames(ds, start, start + chunksize)
+            if values is None:
+                values = np.empty(nframes * framesize, dtype=chunk.dtype)
+            values[start * framesize:(start + len(chunk)) * framesize] = \
+                chunk.ravel()
+        values.sort()
+        self.values = values
+        self.scaling = float(ds.DoseGridScaling)
+        spacing = [float(s) for s in ds.PixelSpacing]
+        offsets = np.array(ds.GridFrameOffsetVector, dtype=np.float64)
+        thickness = abs(offsets[1] - offsets[0]) if (len(offsets) > 1) else \
+            float(getattr(ds, 'SliceThickness', 1) or 1)
+        self.voxelvolume = spacing[0] * spacing[1] * thickness / 1000
+
+    def GetVolumeAtDose(self, dose, scale=1.0):
+        """Return the volume (cm3) of the dose grid that receives at least the
+            given dose (Gy) with the dose scaled by the factor."""
+
+        threshold = dose / float(scale) / self.scaling
+        i = np.searchsorted(self.values, threshold, side='left')
+        return (len(self.values) - i) * self.voxelvolume
+
+def calculate_statistics(samples, rxdose=0, vlevels=(95, 100, 105),
+                         isodosevolume=0, scale=1.0):
+    """Calculate the dose statistics for all of the given structures at once.
+
+        samples is a dict of structure id: DoseSamples and rxdose is the
+        prescription dose (cGy). The dose is scaled by the given factor. The
+        V-levels (% of the structure volume) are given in % of the
+        prescription dose and the conformity index (Paddick) uses the volume
+        (cm3) of the prescription isodose. Returns a dict of structure id:
+        dict of statistics."""
+
+    keys = [key for key in samples if len(samples[key])]
+    stats = {}
+    if not len(keys):
+        return stats
+    lengths = np.array([len(samples[key]) for key in keys])
+    labels = np.repeat(np.arange(len(keys)), lengths)
+    # The samples of each structure are already sorted by dose
+    doses = np.concatenate([samples[key].doses for key in keys]) * scale
+    volumes = np.concatenate([samples[key].volumes for key in keys])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    totals = np.bincount(labels, volumes)
+    cumulative = np.cumsum(volumes)
+    before = cumulative[starts] - volumes[starts]
+
+    def percentile(fraction):
+        """Return the dose below which the fraction of each volume lies."""
+        index = np.searchsorted(cumulative, before + fraction * totals)
+        return doses[np.clip(index, starts, ends - 1)]
+
+    results = {'volume':totals,
+               'min':doses[starts],
+               'max':doses[ends - 1],
+               'mean':np.bincount(labels, volumes * doses) / totals,
+               'median':percentile(0.5),
+               'D2':percentile(0.98),
+               'D98':percentile(0.02)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['HI'] = (results['D2'] - results['D98']) / results['median']
+    rx = rxdose / 100.0
+    for level in vlevels:
+        if rx > 0:
+            results['V' + str(level)] = 100 * np.bincount(labels,
+                volumes * (doses >= rx * level / 100.0)) / totals
+        else:
+            results['V' + str(level)] = np.full(len(keys), np.nan)
+    if (rx > 0) and (isodosevolume > 0):
+        covered = np.bincount(labels, volumes * (doses >= rx))
+        results['CI'] = covered ** 2 / (totals * isodosevolume)
+    else:
+        results['CI'] = np.full(len(keys), np.nan)
+
+    for n, key in enumerate(keys):
+        stats[key] = dict((name, float(values[n]))
+                          for name, values in results.items())
+    return stats
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# gamma.py
+"""Functions to calculate the gamma index between two RT Dose grids."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from dicompyler import dosegrid
+
+def get_distance_kernel(distance, maxgamma=2.0, steps=3):
+    """Return the (dx, dy, dz) offsets (mm) within the search radius of
+        distance * maxgamma, on a grid with the given number of steps per
+        distance criterion, sorted by increasing distance. The squared
+        distance of each offset relative to the distance criterion is also
+        returned."""
+
+    step = float(distance) / steps
+    n = int(np.ceil(maxgamma * steps))
+    r = np.arange(-n, n + 1) * step
+    offsets = np.stack(np.meshgrid(r, r, r, indexing='ij'), -1).reshape(-1, 3)
+    r2 = np.sum(offsets ** 2, axis=1) / float(distance) ** 2
+    inside = r2 <= maxgamma ** 2
+    order = np.argsort(r2[inside], kind='mergesort')
+    return offsets[inside][order], r2[inside][order]
+
+def get_refinement_kernel(step, subdivisions=3):
+    """Return the (dx, dy, dz) offsets (mm) of a grid that is the given number
+        of times finer than the step (mm) and extends one step around a
+        point, to refine the search around the best point of a kernel."""
+
+    r = np.arange(-subdivisions, subdivisions + 1) * \
+        (float(step) / subdivisions)
+    return np.stack(np.meshgrid(r, r, r, indexing='ij'), -1).reshape(-1, 3)
+
+def interpolate_points(grid, z, y, x):
+    """Trilinearly interpolate the (frames, rows, columns) grid at the given
+        fractional indices. Points outside of the grid are NaN."""
+
+    shape = grid.shape
+    outside = ((z < 0) | (z > shape[0] - 1) | (y < 0) | (y > shape[1] - 1) |
+               (x < 0) | (x > shape[2] - 1))
+    z = np.clip(z, 0, shape[0] - 1)
+    y = np.clip(y, 0, shape[1] - 1)
+    x = np.clip(x, 0, shape[2] - 1)
+    z0 = np.minimum(z.astype(np.intp), max(shape[0] - 2, 0))
+    y0 = np.minimum(y.astype(np.intp), max(shape[1] - 2, 0))
+    x0 = np.minimum(x.astype(np.intp), max(shape[2] - 2, 0))
+    z1 = np.minimum(z0 + 1, shape[0] - 1)
+    y1 = np.minimum(y0 + 1, shape[1] - 1)
+    x1 = np.minimum(x0 + 1, shape[2] - 1)
+    wz, wy, wx = z - z0, y - y0, x - x0
+    values = (
+        (grid[z0, y0, x0] * (1 - wx) + grid[z0, y0, x1] * wx) * (1 - wy) +
+        (grid[z0, y1, x0] * (1 - wx) + grid[z0, y1, x1] * wx) * wy) * (1 - wz) + \
+        ((grid[z1, y0, x0] * (1 - wx) + grid[z1, y0, x1] * wx) * (1 - wy) +
+        (grid[z1, y1, x0] * (1 - wx) + grid[z1, y1, x1] * wx) * wy) * wz
+    values[outside] = np.nan
+    return values
+
+def calculate_gamma(reference, evaluated, dosecriteria=3.0, distance=3.0,
+                    local=False, threshold=10.0, maxgamma=2.0, steps=3,
+                    refinements=3, chunksize=8, threads=4):
+    """Calculate the gamma index of the evaluated RT Dose dataset against
+        the reference RT Dose dataset on the reference grid, with the dose
+        difference criterion (%) of the maximum (global) or of the local
+        reference dose, and the distance to agreement criterion (mm). Voxels
+        below the threshold (% of the reference maximum) are not evaluated.
+
+        The evaluated dose is searched over a precomputed distance kernel
+        sorted by distance, so that each voxel stops searching once the
+        remaining distances can not lower its gamma. The search is then
+        refined around the best kernel point of each voxel on successively
+        three times finer grids, i.e. to a step of distance / 81 with the
+        default steps and refinements. The frames are processed in parallel
+        chunks, which only decode the reference frames of the chunk and the
+        evaluated frames within the search radius of them. Returns the gamma
+        grid (NaN where not evaluated, capped at maxgamma) and the pass
+        rate (%)."""
+
+    x, y, z = dosegrid.get_grid_positions(reference)
+    refscaling = np.float32(reference.DoseGridScaling)
+    evalpositions = dosegrid.get_grid_positions(evaluated)
+    ex, ey, ez = evalpositions
+    evalscaling = np.float32(evaluated.DoseGridScaling)
+
+    maxdose = dosegrid.get_dose_range(reference, chunksize)[1]
+    kernel, offsetr2 = get_distance_kernel(distance, maxgamma, steps)
+    # Convert the kernel offsets to fractional indices of the evaluated grid
+    spacing = [(p[1] - p[0]) if (len(p) > 1) else 1.0
+               for p in evalpositions]
+    offsets = kernel / np.array(spacing)
+    finekernels = [get_refinement_kernel(float(distance) / steps / 3 ** r)
+                   for r in range(refinements)]
+    # Number of evaluated frames that the search extends beyond a position
+    margin = int(np.ceil(distance * maxgamma / abs(spacing[2]))) + 1
+    gamma = np.full((len(z), len(y), len(x)), np.nan, dtype=np.float32)
+
+    def calculate_chunk(start):
+        chunk = dosegrid.get_dose_frames(
+            reference, start, start + chunksize) * refscaling
+        zz, yy, xx = np.nonzero(chunk >= maxdose * threshold / 100)
+        dose = chunk[zz, yy, xx]
+        # Decode the evaluated frames within the search radius of the chunk
+        frames = (z[start:start+len(chunk)] - ez[0]) / spacing[2]
+        first = min(max(int(np.floor(np.amin(frames))) - margin, 0),
+                    len(ez) - 1)
+        last = max(min(int(np.ceil(np.amax(frames))) + margin + 1, len(ez)),
+                   first + 1)
+        evalgrid = dosegrid.get_dose_frames(evaluated, first, last) * \
+            evalscaling
+        # Fractional indices of the reference voxels in the evaluated frames
+        zi = (z[start + zz] - ez[first]) / spacing[2]
+        yi = (y[yy] - ey[0]) / spacing[1]
+        xi = (x[xx] - ex[0]) / spacing[0]
+        if local:
+            dd = np.maximum(dose, maxdose * threshold / 100) * dosecriteria / 100
+        else:
+            dd = np.full(len(dose), maxdose * dosecriteria / 100)
+        dd2 = dd.astype(np.float64) ** 2
+        best = np.full(len(dose), np.inf)
+        bestoffset = np.zeros((len(dose), 3))
+        active = np.arange(len(dose))
+        for offset, point, r2 in zip(offsets, kernel, offsetr2):
+            # Only keep searching for voxels whose gamma may still decrease
+            active = active[best[active] > r2]
+            if not len(active):
+                break
+            values = interpolate_points(evalgrid, zi[active] + offset[2],
+                yi[active] + offset[1], xi[active] + offset[0])
+            with np.errstate(invalid='ignore'):
+                g2 = (values - dose[active]) ** 2 / dd2[active] + r2
+            improved = g2 < best[active]
+            best[active[improved]] = g2[improved]
+            bestoffset[active[improved]] = point
+        # Refine the search around the best point of each voxel, as the
+        # minimum usually lies in between the points of the kernel
+        found = np.flatnonzero(np.isfinite(best))
+        for finekernel in finekernels:
+            centers = bestoffset[found]
+            for delta in finekernel:
+                points = centers + delta
+                r2 = np.sum(points ** 2, axis=1) / float(distance) ** 2
+                values = interpolate_points(evalgrid,
+                    zi[found] + points[:, 2] / spacing[2],
+                    yi[found] + points[:, 1] / spacing[1],
+                    xi[found] + points[:, 0] / spacing[0])
+                with np.errstate(invalid='ignore'):
+                    g2 = (values - dose[found]) ** 2 / dd2[found] + r2
+                improved = (g2 < best[found]) & (r2 <= maxgamma ** 2)
+                best[found[improved]] = g2[improved]
+                bestoffset[found[improved]] = points[improved]
+        gamma[start + zz, yy, xx] = np.minimum(np.sqrt(best), maxgamma)
+
+    pool = ThreadPool(threads)
+    try:
+        pool.map(calculate_chunk, range(0, len(z), chunksize))
+    finally:
+        pool.close()
+    evaluatedvoxels = ~np.isnan(gamma)
+    passrate = 100 * float(np.count_nonzero(gamma[evaluatedvoxels] <= 1)) / \
+        max(np.count_nonzero(evaluatedvoxels), 1)
+    return gamma, passrate
+
+def create_gamma_dataset(reference, gamma):
+    """Return the gamma grid as a new RT Dose dataset on the reference grid,
+        so that it can be displayed like a dose grid. Voxels that were not
+        evaluated are stored as -1."""
+
+    return dosegrid.create_dose_dataset(reference,
+        np.where(np.isnan(gamma), -1, gamma).astype(np.float32),
+        dosegrid.get_grid_positions(reference))
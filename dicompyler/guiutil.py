@@ -8,6 +8,7 @@
 #    available at https://github.com/bastula/dicompyler/
 
 from dicompyler import util
+import numpy as np
 import wx
 from wx.xrc import XmlResource, XRCCTRL, XRCID
 from wx.lib.pubsub import pub
@@ -87,6 +88,86 @@ def convert_pil_to_wx(pil, alpha=True):
         image.SetData(data)
     return image
 
+def convert_array_to_wx(array):
+    """Convert a (rows, columns, 3) uint8 RGB numpy array into a wx.Bitmap
+        by passing the buffer directly, without an alpha channel.
+        A (rows, columns, 4) RGBA array is converted with its alpha channel."""
+
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    height, width = array.shape[0:2]
+    if (array.shape[2] == 4):
+        return wx.Bitmap.FromBufferRGBA(width, height, array)
+    return wx.Bitmap.FromBuffer(width, height, array)
+
+class LayerCache:
+    """Caches transparent bitmap layers that are only redrawn when the
+        inputs of the layer (given as a key) change or when the layer has been
+        invalidated."""
+
+    def __init__(self):
+        self.layers = {}
+
+    def GetLayer(self, name, key, size, drawfunc):
+        """Return the bitmap for the named layer of the given size, calling
+            drawfunc with a wx.GraphicsContext to redraw it if needed."""
+
+        width, height = size
+        if (width < 1) or (height < 1):
+            return None
+        key = (key, (width, height))
+        if not (name in self.layers) or not (self.layers[name][0] == key):
+            image = wx.Bitmap.FromRGBA(width, height, 0, 0, 0, 0).ConvertToImage()
+            gc = wx.GraphicsContext.Create(image)
+            drawfunc(gc)
+            # The image is updated once the graphics context is destroyed
+            del gc
+            self.layers[name] = (key, wx.Bitmap(image))
+        return self.layers[name][1]
+
+    def Invalidate(self, name=None):
+        """Invalidate the named layer or all layers if no name is given."""
+
+        if name is None:
+            self.layers = {}
+        elif name in self.layers:
+            del self.layers[name]
+
+class RedrawScheduler:
+    """Coalesces redraw requests for a window so that it is redrawn at most
+        once per frame, after the pending events have been processed."""
+
+    def __init__(self, window, redrawfunc=None, rate=60):
+        self.window = window
+        self.redrawfunc = redrawfunc if redrawfunc else window.Refresh
+        self.rate = rate
+        self.dirty = False
+        self.pending = None
+
+    def Schedule(self):
+        """Mark the window as dirty and schedule a redraw."""
+
+        self.dirty = True
+        if not self.pending:
+            self.pending = wx.CallLater(max(int(1000/self.rate), 1),
+                                        self.OnRedraw)
+
+    def OnRedraw(self):
+        """Redraw the window if it is still dirty."""
+
+        self.pending = None
+        # Skip the redraw if the window has been destroyed in the meantime
+        if self.dirty and self.window:
+            self.dirty = False
+            self.redrawfunc()
+
+    def Cancel(self):
+        """Cancel a scheduled redraw."""
+
+        self.dirty = False
+        if self.pending:
+            self.pending.Stop()
+            self.pending = None
+
 def get_progress_dialog(parent, title="Loading..."):
     """Function to load the progress dialog."""
 
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# imageutil.py
+"""Classes and functions to render image pixel data for display."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import matplotlib
+from matplotlib import cm
+
+# Colormap lookup tables that have been generated: {(name, size): lut}
+_colormaps = {}
+
+def get_rescale(ds):
+    """Return the rescale slope and intercept of the given dataset."""
+
+    if ('RescaleSlope' in ds) and ('RescaleIntercept' in ds):
+        return float(ds.RescaleSlope), float(ds.RescaleIntercept)
+    return 1.0, 0.0
+
+def window_level(data, window, level):
+    """Apply the window and level to the given (rescaled) data and return
+        the 8-bit display values."""
+
+    # Avoid dividing by zero for a window width of 1
+    width = max(window - 1, 1)
+    with np.errstate(invalid='ignore'):
+        values = ((np.asarray(data, dtype=np.float64) - (level - 0.5)) /
+                  width + 0.5) * 255
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+def get_window_level_lut(window, level, dtype, slope=1.0, intercept=0.0):
+    """Return a RGB lookup table with an entry for every stored value of the
+        given 8 or 16-bit integer dtype. The table is indexed by the stored
+        values viewed as unsigned integers."""
+
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype('u' + str(dtype.itemsize))
+    stored = np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+    gray = window_level(stored * slope + intercept, window, level)
+    return np.repeat(gray[:, np.newaxis], 3, axis=1)
+
+def get_pyramid_level(zoom, shape, maxlevel=3, minsize=64):
+    """Return the resolution pyramid level to display an image of the given
+        shape at the given zoom. Each level halves the resolution, and the
+        chosen level is never coarser than the displayed resolution."""
+
+    level = 0
+    while ((level < maxlevel) and (zoom * 2 ** (level + 1) <= 1) and
+           (min(shape) / 2 ** (level + 1) >= minsize)):
+        level += 1
+    return level
+
+def downsample(pixels, factor):
+    """Reduce the resolution of the pixel data by averaging each block of
+        factor x factor pixels, keeping the original data type."""
+
+    pixels = np.asarray(pixels)
+    if factor <= 1:
+        return pixels
+    rows, columns = pixels.shape[0:2]
+    # Extend the edges so that the shape is a multiple of the factor
+    pad = [(0, -rows % factor), (0, -columns % factor)] + \
+          [(0, 0)] * (pixels.ndim - 2)
+    padded = np.pad(pixels, pad, mode='edge')
+    blocks = padded.reshape((padded.shape[0] // factor, factor,
+                             padded.shape[1] // factor, factor) +
+                            padded.shape[2:])
+    mean = blocks.mean(axis=(1, 3))
+    if pixels.dtype.kind in 'iu':
+        mean = np.round(mean)
+    return np.ascontiguousarray(mean.astype(pixels.dtype))
+
+class ImageRenderer:
+    """Renders monochrome image pixel data to RGB using a cached window and
+        level lookup table."""
+
+    def __init__(self):
+        self.lutkey = None
+        self.lut = None
+
+    def GetLUT(self, window, level, dtype, slope=1.0, intercept=0.0):
+        """Return the lookup table for the given parameters, only rebuilding
+            it if the parameters have changed."""
+
+        key = (window, level, np.dtype(dtype).str, slope, intercept)
+        if not (key == self.lutkey):
+            self.lut = get_window_level_lut(
+                window, level, dtype, slope, intercept)
+            self.lutkey = key
+        return self.lut
+
+    def Render(self, pixels, window, level, slope=1.0, intercept=0.0):
+        """Return a contiguous (rows, columns, 3) uint8 RGB array of the
+            pixel data with the given window and level applied."""
+
+        pixels = np.asarray(pixels)
+        # Integer data up to 16 bits is converted with a single table lookup
+        if (pixels.dtype.kind in 'iu') and (pixels.dtype.itemsize <= 2):
+            lut = self.GetLUT(window, level, pixels.dtype, slope, intercept)
+            unsigned = np.dtype('u' + str(pixels.dtype.itemsize))
+            return lut[pixels.view(unsigned)]
+        gray = window_level(pixels * slope + intercept, window, level)
+        return np.repeat(gray[..., np.newaxis], 3, axis=-1)
+
+class FrameRing:
+    """Renders the upcoming frames of an image series in a background thread
+        and keeps them in a ring of a fixed number of frames. Frames that are
+        no longer wanted or were rendered with other settings are dropped."""
+
+    def __init__(self, renderfunc, size=8):
+        self.renderfunc = renderfunc
+        self.size = size
+        self.frames = OrderedDict()
+        self.wanted = []
+        self.key = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.RenderThread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Request(self, indices, key):
+        """Set the frame indices to render in order of priority, along with
+            the key of the render settings that is passed to renderfunc."""
+
+        with self.condition:
+            self.wanted = list(indices)[0:self.size]
+            self.key = key
+            for index in list(self.frames.keys()):
+                if not ((index in self.wanted) and
+                        (self.frames[index][0] == key)):
+                    del self.frames[index]
+            self.condition.notify()
+
+    def Get(self, index, key):
+        """Return the rendered frame for the index and key, or None if it has
+            not been rendered yet."""
+
+        with self.condition:
+            frame = self.frames.get(index)
+        if frame and (frame[0] == key):
+            return frame[1]
+        return None
+
+    def Stop(self):
+        """Stop the render thread and remove all frames."""
+
+        with self.condition:
+            self.running = False
+            self.frames.clear()
+            self.condition.notify()
+
+    def GetNextIndex(self):
+        """Return the first wanted frame index that has not been rendered."""
+
+        for index in self.wanted:
+            if not index in self.frames:
+                return index
+        return None
+
+    def RenderThread(self):
+        """Render the wanted frames until the ring is stopped."""
+
+        while True:
+            with self.condition:
+                while self.running and (self.GetNextIndex() is None):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                index = self.GetNextIndex()
+                key = self.key
+            frame = self.renderfunc(index, key)
+            with self.condition:
+                # Drop the frame if the request changed while rendering
+                if (key == self.key) and (index in self.wanted):
+                    self.frames[index] = (key, frame)
+
+def get_colormap_lut(name='jet', size=256):
+    """Return a (size, 3) uint8 RGB lookup table for the given matplotlib
+        colormap, which is only generated once."""
+
+    key = (name, size)
+    if not key in _colormaps:
+        # matplotlib 3.5 and above provides a colormap registry
+        try:
+            cmap = matplotlib.colormaps[name]
+        except AttributeError:
+            cmap = cm.get_cmap(name)
+        _colormaps[key] = np.array(
+            cmap(np.linspace(0, 1, size))[:, 0:3] * 255, dtype=np.uint8)
+    return _colormaps[key]
+
+def apply_colormap(values, vmin, vmax, lut, opacity=1.0):
+    """Map the values onto a (rows, columns, 4) uint8 RGBA array via the
+        colormap lookup table. Values below vmin or NaN are transparent."""
+
+    values = np.asarray(values)
+    size = len(lut)
+    with np.errstate(invalid='ignore'):
+        index = (values - vmin) * ((size - 1) / max(vmax - vmin, 1e-6))
+        visible = values >= vmin
+    index = np.clip(np.nan_to_num(index), 0, size - 1).astype(np.intp)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[..., 0:3] = lut[index]
+    rgba[..., 3] = np.where(visible, int(opacity * 255), 0)
+    return rgba
@@ -13,7 +13,7 @@ import logging, logging.handlers
 logger = logging.getLogger('dicompyler')
 logger.setLevel(logging.DEBUG)
 
-import os, threading
+import os, threading, multiprocessing
 import sys, traceback
 import wx
 from wx.xrc import *
@@ -21,10 +21,9 @@ import wx.adv
 import wx.lib.dialogs, webbrowser
 import pydicom
 from wx.lib.pubsub import pub
-from dicompylercore import dvhcalc
 from dicompyler import __version__
 from dicompyler import guiutil, util
-from dicompyler import dicomgui, dvhdata
+from dicompyler import dicomgui, dosegrid, dosestats, dvhdata
 from dicompylercore.dicomparser import DicomParser as dp
 from dicompyler import plugin, preferences
 
@@ -254,9 +253,16 @@ class MainFrame(wx.Frame):
             {'Calculation Settings':
                 [{'name':'DVH Calculation',
                  'type':'choice',
-               'values':['Use RT Dose DVH if Present', 'Always Recalculate DVH'],
+               'values':['Use RT Dose DVH if Present', 'Always Recalculate DVH',
+                         'Progressively Calculate DVH When Checked'],
               'default':'Use RT Dose DVH if Present',
-             'callback':'general.calculation.dvh_recalc'}]
+             'callback':'general.calculation.dvh_recalc'},
+                {'name':'DVH Calculation Memory Limit',
+                 'type':'range',
+               'values':[64, 4096],
+              'default':512,
+                'units':'MB',
+             'callback':'general.calculation.dvh_memory'}]
             },
             {'Advanced Settings':
                 [{'name':'Enable Detailed Logging',
@@ -297,6 +303,8 @@ class MainFrame(wx.Frame):
                         msg='general.plugins.user_plugins_location')
         pub.sendMessage('preferences.requested.value',
                         msg='general.calculation.dvh_recalc')
+        pub.sendMessage('preferences.requested.value',
+                        msg='general.calculation.dvh_memory')
         pub.sendMessage('preferences.requested.value',
                         msg='general.plugins.disabled_list')
         pub.sendMessage('preferences.requested.values',
@@ -445,7 +453,10 @@ class MainFrame(wx.Frame):
         if 'rtdose' in ptdata:
             wx.CallAfter(progressFunc, 60, 100, 'Processing RT Dose...')
             patient['dvhs'] = dp(ptdata['rtdose']).GetDVHs()
-            patient['dose'] = dp(ptdata['rtdose'])
+            patient['dose'] = dosegrid.DoseParser(ptdata['rtdose'])
+            # Determine the maximum dose in chunks while still loading
+            if ("PixelData" in patient['dose'].ds):
+                patient['dose'].GetMaxDose()
         if 'images' in ptdata:
             wx.CallAfter(progressFunc, 80, 100, 'Processing Images...')
             if not 'id' in patient:
@@ -453,6 +464,9 @@ class MainFrame(wx.Frame):
             patient['images'] = []
             for image in ptdata['images']:
                 patient['images'].append(dp(image))
+            # The image volume that was decoded while importing, if any
+            if 'volume' in ptdata:
+                patient['volume'] = ptdata['volume']
         if 'rxdose' in ptdata:
             if not 'plan' in patient:
                 patient['plan'] = {}
@@ -460,12 +474,26 @@ class MainFrame(wx.Frame):
         # if the min/max/mean dose was not present, calculate it and save it for each structure
         wx.CallAfter(progressFunc, 90, 100, 'Processing DVH data...')
         if ('dvhs' in patient) and ('structures' in patient):
-            # If the DVHs are not present, calculate them
+            # Cache the structure masks on the dose grid for the plugins
+            if ("PixelData" in patient['dose'].ds):
+                patient['masks'] = dosestats.StructureMasks(
+                    patient['dose'], patient['structures'])
+            # If the DVHs are not present, calculate them, unless the DVH
+            # plugin should calculate them progressively when checked
             i = 0
+            progressive = (self.dvhRecalc ==
+                           'Progressively Calculate DVH When Checked') and \
+                          ('masks' in patient)
+            # Stream dose grids that exceed the memory limit in chunks
+            memory = self.dvhMemory * 2 ** 20
+            ds = patient['dose'].ds
+            streaming = ("PixelData" in ds) and \
+                (dosegrid.get_pixel_data_size(ds) > memory)
             for key, structure in patient['structures'].items():
                 # Only calculate DVHs if they are not present for the structure
                 # or recalc all DVHs if the preference is set
-                if ((not (key in patient['dvhs'].keys())) or
+                if (((not (key in patient['dvhs'].keys())) and
+                     (not progressive)) or
                     (self.dvhRecalc == 'Always Recalculate DVH')):
                     # Only calculate DVHs for structures, not applicators
                     # and only if the dose grid is present
@@ -477,8 +505,14 @@ class MainFrame(wx.Frame):
                                  'Calculating DVH for ' + structure['name'] +
                                  '...')
                     # Limit DVH bins to 500 Gy due to high doses in brachy
-                    dvh = dvhcalc.get_dvh(ptdata['rtss'], patient['dose'].ds, key, 50000)
-                    if len(dvh.counts):
+                    if streaming:
+                        dvh = dosestats.calculate_dvh(patient['dose'],
+                            structure, limit=500, memory=memory)
+                    else:
+                        samples = patient['masks'].GetSamples(key)
+                        dvh = samples.GetDVH(limit=500,
+                            name=structure['name']) if len(samples) else None
+                    if dvh is not None:
                         patient['dvhs'][key] = dvh
                     i += 1
             for key, dvh in patient['dvhs'].items():
@@ -541,8 +575,7 @@ class MainFrame(wx.Frame):
 
         self.isodoseList={}
         if (has_images and len(plan) and "PixelData" in dose.ds):
-            dosedata = dose.GetDoseData()
-            dosemax = int(dosedata['dosemax'] * dosedata['dosegridscaling'] * 10000 / plan['rxdose'])
+            dosemax = int(dose.GetMaxDose() * 10000 / plan['rxdose'])
             self.isodoses = [{'level':dosemax, 'color':wx.Colour(120, 0, 0), 'name':'Max'},
                 {'level':102, 'color':wx.Colour(170, 0, 0)},
                 {'level':100, 'color':wx.Colour(238, 69, 0)}, {'level':98, 'color':wx.Colour(255, 165, 0)},
@@ -730,6 +763,8 @@ class MainFrame(wx.Frame):
         topic = topic.split('.')
         if (topic[1] == 'calculation') and (topic[2] == 'dvh_recalc'):
             self.dvhRecalc = msg
+        elif (topic[1] == 'calculation') and (topic[2] == 'dvh_memory'):
+            self.dvhMemory = msg
         elif (topic[1] == 'advanced') and \
                 (topic[2] == 'detailed_logging'):
                     # Enable logging at the debug level if the value is set
@@ -939,6 +974,8 @@ class dicompyler(wx.App):
 # end of class dicompyler
 
 def start():
+    # Let frozen builds run the spawned image decoding workers
+    multiprocessing.freeze_support()
     app = dicompyler(0)
     app.MainLoop()
 
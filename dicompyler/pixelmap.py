@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pixelmap.py
+"""Functions to access uncompressed DICOM pixel data as memory-mapped views
+    of the file that the dataset was read from."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import os, threading
+import numpy as np
+from dicompyler import util
+
+# Recently used memory maps, keyed by the file and layout of the pixel data
+maps = util.LRUCache(64)
+maplock = threading.Lock()
+# Pixel arrays that were decoded ahead of time, keyed by the pixel data
+# location in the file
+decoded = {}
+
+def get_pixel_offset(ds):
+    """Return the file name and the offset (bytes) of the pixel data value in
+        the file that the dataset was read from, or None if the pixel data
+        was not read from a file."""
+
+    filename = getattr(ds, 'filename', None)
+    if not (isinstance(filename, str) and os.path.isfile(filename)):
+        return None
+    if not ('PixelData' in ds):
+        return None
+    # Only the raw element that was read from the file (and has not been
+    # converted or replaced since) records where its value is in the file.
+    # A converted element keeps the position even if a new value is assigned,
+    # i.e. when a dataset read from a file is copied to hold a new grid.
+    element = ds.get_item(0x7fe00010)
+    offset = getattr(element, 'value_tell', None)
+    if offset is None:
+        return None
+    return filename, offset
+
+def get_pixel_dtype(ds):
+    """Return the numpy dtype of the stored pixel values of the dataset, or
+        None if they can not be mapped directly."""
+
+    if not (int(getattr(ds, 'SamplesPerPixel', 1)) == 1):
+        return None
+    if not (ds.BitsAllocated in [8, 16, 32]):
+        return None
+    dtype = np.dtype(('u' if (ds.PixelRepresentation == 0) else 'i') +
+                     str(ds.BitsAllocated // 8))
+    return dtype.newbyteorder('<' if ds.is_little_endian else '>')
+
+def get_pixel_map(ds):
+    """Return the pixel data of the dataset as a read-only (frames, rows,
+        columns) memory map of the file, or None if the pixel data is
+        compressed or was not read from a file. No pixel data is read until
+        the frames of the map are accessed."""
+
+    syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    if (syntax is None) or getattr(syntax, 'is_compressed', True) or \
+            getattr(syntax, 'is_deflated', False):
+        return None
+    location = get_pixel_offset(ds)
+    dtype = get_pixel_dtype(ds)
+    if (location is None) or (dtype is None):
+        return None
+    filename, offset = location
+    shape = (int(getattr(ds, 'NumberOfFrames', 1) or 1), ds.Rows, ds.Columns)
+    if (offset + int(np.prod(shape)) * dtype.itemsize >
+            os.path.getsize(filename)):
+        return None
+    key = (filename, offset, shape, dtype.str)
+    with maplock:
+        pixelmap = maps.get(key)
+        if pixelmap is None:
+            pixelmap = np.memmap(filename, dtype=dtype, mode='r',
+                                 offset=offset, shape=shape)
+            maps[key] = pixelmap
+    return pixelmap
+
+def set_decoded_pixels(ds, pixels):
+    """Store the decoded pixel array of the dataset, so that it is not
+        decoded again when the image is accessed."""
+
+    location = get_pixel_offset(ds)
+    if location is not None:
+        with maplock:
+            decoded[location] = pixels
+
+def clear_decoded_pixels():
+    """Remove all pixel arrays that were decoded ahead of time."""
+
+    with maplock:
+        decoded.clear()
+
+def get_image_pixels(ds):
+    """Return the (rows, columns) pixel array of a single frame image, as a
+        zero-copy view of the file if the pixel data is uncompressed, or the
+        pixel array that was decoded ahead of time if it is compressed."""
+
+    location = get_pixel_offset(ds)
+    if location in decoded:
+        return decoded[location]
+    pixelmap = get_pixel_map(ds)
+    if (pixelmap is None) or not (len(pixelmap) == 1):
+        return ds.pixel_array
+    return pixelmap[0]
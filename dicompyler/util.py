@@ -10,6 +10,7 @@
 from __future__ import with_statement
 import imp, os, sys
 import subprocess
+from collections import OrderedDict
 
 def platform():
     if sys.platform.startswith('win'):
@@ -67,6 +68,31 @@ def open_path(path):
     elif sys.platform == 'win32':
         subprocess.Popen("explorer " + path)
 
+class LRUCache(OrderedDict):
+    """Dictionary that holds a maximum number of items and evicts the least
+        recently used item when it is full."""
+
+    def __init__(self, maxsize=32):
+        OrderedDict.__init__(self)
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        """Return the item for the key and mark it as the most recently
+            used, or the default if the key is not present."""
+
+        if not key in self:
+            return default
+        value = OrderedDict.pop(self, key)
+        OrderedDict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            OrderedDict.__delitem__(self, key)
+        OrderedDict.__setitem__(self, key, value)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
 def get_credits():
     """Read the credits file and return the data from it."""
     
@@ -7,6 +7,11 @@
 #    See the file license.txt included with this distribution, also
 #    available at https://github.com/bastula/dicompyler/
 
+import multiprocessing
 import dicompyler.main
 
-dicompyler.main.start()
+# Guard the start so that the image decoding worker processes, which import
+# this script when they are spawned, do not start the application
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    dicompyler.main.start()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_contourutil.py
+"""Tests for the isodose tracing of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import unittest
+import numpy as np
+from dicompyler import contourutil
+
+class TestMarchingSquares(unittest.TestCase):
+    """Tests the isolines traced by marching squares."""
+
+    def setUp(self):
+        # A cone that falls off linearly from its apex at (32, 30)
+        y, x = np.mgrid[0:61, 0:71]
+        self.cone = 40 - np.hypot(x - 32, y - 30)
+
+    def test_closed_contour_area(self):
+        """Each isoline of the cone is a single circle of the right area."""
+        levels = [15, 25, 35]
+        isolines = contourutil.marching_squares(self.cone, levels)
+        for level, polylines in zip(levels, isolines):
+            self.assertEqual(len(polylines), 1)
+            radius = 40 - level
+            area = np.pi * radius ** 2
+            self.assertAlmostEqual(contourutil.get_polyline_area(polylines[0]),
+                                   area, delta=0.02 * area)
+            # The vertices lie on the circle
+            np.testing.assert_allclose(np.hypot(polylines[0][:, 0] - 32,
+                polylines[0][:, 1] - 30), radius, atol=0.1)
+
+    def test_levels_are_traced_independently(self):
+        """Tracing several levels at once gives the isolines of each level."""
+        levels = [5, 20, 35]
+        isolines = contourutil.marching_squares(self.cone, levels)
+        for level, polylines in zip(levels, isolines):
+            single = contourutil.marching_squares(self.cone, [level])[0]
+            self.assertEqual(len(single), len(polylines))
+            for a, b in zip(single, polylines):
+                np.testing.assert_array_equal(a, b)
+
+    def test_contour_closed_along_grid_edge(self):
+        """An isoline that leaves the grid is closed along the grid edge."""
+        y, x = np.mgrid[0:20, 0:30]
+        polylines = contourutil.marching_squares(x * 1.0, [10.5])[0]
+        self.assertEqual(len(polylines), 1)
+        polyline = polylines[0]
+        self.assertTrue(np.all(polyline >= 0))
+        self.assertTrue(np.all(polyline[:, 0] <= 29))
+        self.assertTrue(np.all(polyline[:, 1] <= 19))
+        self.assertAlmostEqual(contourutil.get_polyline_area(polyline), (29 - 10.5) * 19)
+        # The first vertex is not repeated
+        self.assertEqual(len(np.unique(polyline, axis=0)), len(polyline))
+
+    def test_level_equal_to_maximum(self):
+        """A level that is only reached at the maximum has no isoline."""
+        isolines = contourutil.marching_squares(self.cone, [40, 39.9, 41])
+        self.assertEqual(isolines[0], [])
+        self.assertEqual(len(isolines[1]), 1)
+        self.assertEqual(isolines[2], [])
+        # A ridge that only reaches the level along a line
+        ridge = np.zeros((5, 6))
+        ridge[2, 1:4] = 1
+        self.assertEqual(contourutil.marching_squares(ridge, [1]), [[]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_decodepool.py
+"""Tests for the parallel decoding of compressed images of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+#
+# The worker processes are spawned, so this module must only start the
+# tests from its main guard.
+
+import os, shutil, tempfile, unittest
+import numpy as np
+from dicompyler import decodepool, pixelmap
+from .test_pixelmap import create_image, dicom, Dataset, RLELossless
+
+@unittest.skipIf(not hasattr(Dataset, 'compress'),
+                 "Compressing pixel data requires pydicom 2.2 or later")
+class TestDecodePool(unittest.TestCase):
+    """Tests the series decoded by the spawned worker processes."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.datasets = []
+        self.pixels = []
+        # A series of compressed images with one uncompressed image
+        for n in range(5):
+            ds, pixels = create_image(seed=n)
+            if not (n == 2):
+                ds.compress(RLELossless, pixels)
+            filename = os.path.join(self.path, 'ct%d.dcm' % n)
+            ds.save_as(filename, write_like_original=False)
+            self.datasets.append(dicom.dcmread(filename))
+            self.pixels.append(pixels)
+
+    def tearDown(self):
+        pixelmap.maps.clear()
+        pixelmap.clear_decoded_pixels()
+        shutil.rmtree(self.path)
+
+    def test_pool_matches_serial_decode(self):
+        """The decoded volume matches the images decoded one at a time."""
+        progress = []
+        volume = decodepool.DecodePool(processes=2).DecodeSeries(
+            self.datasets, progressfunc=lambda n, length:
+                progress.append((n, length)))
+        serial = np.stack([dicom.dcmread(ds.filename).pixel_array
+                           for ds in self.datasets])
+        np.testing.assert_array_equal(volume, serial)
+        np.testing.assert_array_equal(volume, self.pixels)
+        self.assertEqual(progress, [(n, 4) for n in range(1, 5)])
+
+    def test_decoded_pixels_share_the_volume(self):
+        """Each image is displayed from its slice of the decoded volume."""
+        volume = decodepool.DecodePool(processes=2).DecodeSeries(
+            self.datasets)
+        for n, ds in enumerate(self.datasets):
+            pixels = pixelmap.get_image_pixels(ds)
+            np.testing.assert_array_equal(pixels, self.pixels[n])
+            # Only the compressed images are decoded into the volume
+            self.assertEqual(np.shares_memory(pixels, volume), not (n == 2))
+
+    def test_terminate(self):
+        """No volume is returned when the decoding is terminated."""
+        self.assertIsNone(decodepool.DecodePool(processes=2).DecodeSeries(
+            self.datasets, terminate=lambda: True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_dosegrid.py
+"""Tests for the RT Dose grid processing of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import unittest
+import numpy as np
+from dicompyler import dosegrid
+from .test_dosestats import create_rtdose
+
+def get_linear_dose(x, y, z):
+    """Return a dose (Gy) that varies linearly along each of the axes, so
+        that it is reproduced exactly by trilinear interpolation."""
+
+    return 20 + 0.1 * x[np.newaxis, np.newaxis, :] + \
+        0.05 * y[np.newaxis, :, np.newaxis] + 0.2 * z[:, np.newaxis, np.newaxis]
+
+def create_oriented_rtdose(orientation, frames=6, rows=10, columns=12):
+    """Return an RT Dose dataset with the linear dose that covers the same
+        patient coordinates for any head first or feet first, supine or
+        prone orientation."""
+
+    ds = create_rtdose(frames, rows, columns)
+    # The first voxel is at the corner where the axes of the orientation start
+    extent = [(columns - 1) * 2.5, (rows - 1) * 2.5, (frames - 1) * 2.5]
+    direction = [orientation[0], orientation[4], orientation[0]]
+    ds.ImagePositionPatient = [p + (e if (d < 0) else 0)
+        for p, e, d in zip([-10, -15, -20], extent, direction)]
+    ds.ImageOrientationPatient = orientation
+    dose = get_linear_dose(*dosegrid.get_grid_positions(ds))
+    ds.PixelData = np.round(dose / 1e-4).astype('<u4').tobytes()
+    return ds
+
+class TestGridPositions(unittest.TestCase):
+    """Tests the patient coordinates of the dose grid for each orientation."""
+
+    orientations = {'HFS':[1, 0, 0, 0, 1, 0], 'FFS':[-1, 0, 0, 0, 1, 0],
+                    'HFP':[-1, 0, 0, 0, -1, 0]}
+
+    def test_positions_follow_orientation(self):
+        """The positions cover the same coordinates in any orientation."""
+        for name, orientation in self.orientations.items():
+            x, y, z = dosegrid.get_grid_positions(
+                create_oriented_rtdose(orientation))
+            for positions, direction, first in [
+                    (x, orientation[0], -10), (y, orientation[4], -15),
+                    (z, orientation[0], -20)]:
+                np.testing.assert_allclose(np.sort(positions),
+                    first + np.arange(len(positions)) * 2.5, err_msg=name)
+                self.assertEqual(np.sign(positions[1] - positions[0]),
+                                 direction, name)
+
+    def test_frame_positions_match_dose_planes(self):
+        """Each frame position selects the dose plane of that frame."""
+        for name, orientation in self.orientations.items():
+            ds = create_oriented_rtdose(orientation)
+            dose = dosegrid.DoseParser(ds)
+            x, y, z = dosegrid.get_grid_positions(ds)
+            expected = get_linear_dose(x, y, z)
+            for frame, position in enumerate(z):
+                np.testing.assert_allclose(dose.GetDosePlane(position),
+                    expected[frame], atol=1e-3, err_msg=name)
+
+    def test_sum_of_oriented_grids(self):
+        """Grids of other orientations are resampled onto the same
+            coordinates of the first grid."""
+        reference = create_oriented_rtdose(self.orientations['HFS'])
+        expected = get_linear_dose(*dosegrid.get_grid_positions(reference))
+        for name in ['FFS', 'HFP']:
+            ds = dosegrid.sum_dose_grids([reference,
+                create_oriented_rtdose(self.orientations[name])], chunksize=4)
+            for positions, expectedpositions in zip(
+                    dosegrid.get_grid_positions(ds),
+                    dosegrid.get_grid_positions(reference)):
+                np.testing.assert_allclose(
+                    positions, expectedpositions, err_msg=name)
+            np.testing.assert_allclose(
+                dosegrid.get_dose_frames(ds) * ds.DoseGridScaling,
+                2 * expected, atol=1e-3, err_msg=name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_dosestats.py
+"""Tests for the dose statistics and DVH calculations of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import unittest
+import numpy as np
+try:
+    from pydicom.dataset import Dataset
+    from pydicom.uid import ExplicitVRLittleEndian
+except ImportError:
+    from dicom.dataset import Dataset
+    from dicom.UID import ExplicitVRLittleEndian
+from dicompylercore import dicomparser, dvhcalc
+from dicompyler import dosegrid, dosestats
+
+def create_rtdose(frames=16, rows=60, columns=80, seed=1):
+    """Return an uncompressed in-memory RT Dose dataset with random doses
+        (up to 70 Gy) and a 3000 Gy hot spot."""
+
+    ds = Dataset()
+    ds.file_meta = Dataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.481.2'
+    ds.file_meta.MediaStorageSOPInstanceUID = '1.2.3.4'
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = '1.2.840.10008.5.1.4.1.1.481.2'
+    ds.SOPInstanceUID = '1.2.3.4'
+    ds.Modality = 'RTDOSE'
+    ds.ImagePositionPatient = [-100, -75, -20]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [2.5, 2.5]
+    ds.GridFrameOffsetVector = list(np.arange(frames) * 2.5)
+    ds.NumberOfFrames = frames
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 32
+    ds.BitsStored = 32
+    ds.HighBit = 31
+    ds.PixelRepresentation = 0
+    ds.DoseGridScaling = 1e-4
+    pixels = (np.random.RandomState(seed).random_sample(
+        (frames, rows, columns)) * 7e5).astype(np.uint32)
+    pixels[3, 20:30, 30:50] = 3e7
+    ds.PixelData = pixels.astype('<u4').tobytes()
+    return ds
+
+def create_structure(cx=10, cy=5, radius=15, hole=5, zrange=(-19, 17),
+                     spacing=1.3):
+    """Return a cylindrical structure with a hole along the dose grid."""
+
+    def circle(r, z):
+        angles = np.linspace(0, 2 * np.pi, 40, endpoint=False)
+        return {'data':[[cx + r * np.cos(a), cy + r * np.sin(a), z]
+                        for a in angles]}
+
+    planes = {}
+    for z in np.round(np.arange(zrange[0], zrange[1], spacing), 1):
+        planes['%.1f' % z] = [circle(radius, z), circle(hole, z)]
+    return {'name':'Cylinder', 'planes':planes, 'thickness':spacing}
+
+def create_rtstruct(structure):
+    """Return an in-memory RT Structure Set dataset with the structure as
+        ROI number 1."""
+
+    ds = Dataset()
+    ds.file_meta = Dataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.481.3'
+    ds.file_meta.MediaStorageSOPInstanceUID = '1.2.3.5'
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = '1.2.840.10008.5.1.4.1.1.481.3'
+    ds.SOPInstanceUID = '1.2.3.5'
+    ds.Modality = 'RTSTRUCT'
+    roi = Dataset()
+    roi.ROINumber = 1
+    roi.ROIName = structure['name']
+    ds.StructureSetROISequence = [roi]
+    roicontour = Dataset()
+    roicontour.ReferencedROINumber = 1
+    roicontour.ContourSequence = []
+    for z, plane in sorted(structure['planes'].items()):
+        for contour in plane:
+            c = Dataset()
+            c.ContourGeometricType = 'CLOSED_PLANAR'
+            c.NumberOfContourPoints = len(contour['data'])
+            c.ContourData = [round(float(v), 4)
+                             for point in contour['data'] for v in point]
+            roicontour.ContourSequence.append(c)
+    ds.ROIContourSequence = [roicontour]
+    return ds
+
+class TestDVHCalc(unittest.TestCase):
+    """Tests that the DVHs have the same volume as those of dvhcalc."""
+
+    def setUp(self):
+        self.rtdose = create_rtdose()
+        # Extend the structure 10 mm past the first frame of the dose grid
+        # and through the hot spot that exceeds the binning limit
+        self.rtss = create_rtstruct(create_structure(zrange=(-30, 10)))
+        rtss = dicomparser.DicomParser(self.rtss)
+        self.structure = rtss.GetStructures()[1]
+        self.structure['planes'] = rtss.GetStructureCoordinates(1)
+        self.structure['thickness'] = rtss.CalculatePlaneThickness(
+            self.structure['planes'])
+        self.reference = dvhcalc.get_dvh(self.rtss, self.rtdose, 1, 50000)
+
+    def assertDVHEqual(self, dvh):
+        """Compare the volume and the cumulative DVH to that of dvhcalc."""
+        reference = self.reference
+        self.assertAlmostEqual(dvh.volume, reference.volume, places=6)
+        n = min(len(dvh.counts), len(reference.counts))
+        # Doses on a bin edge may fall in the neighboring bin
+        voxelvolume = 2.5 * 2.5 * self.structure['thickness'] / 1000
+        np.testing.assert_allclose(dvh.counts[:n], reference.counts[:n],
+            atol=2 * voxelvolume * dvh.volume / reference.volume)
+
+    def test_structure_masks(self):
+        """The DVH from the structure masks matches dvhcalc."""
+        masks = dosestats.StructureMasks(
+            dosegrid.DoseParser(self.rtdose), {1:self.structure})
+        self.assertDVHEqual(masks.GetSamples(1).GetDVH(limit=500))
+
+    def test_streaming_dvh(self):
+        """The DVH streamed in chunks of frames matches dvhcalc."""
+        self.assertDVHEqual(dosestats.calculate_dvh(
+            dosegrid.DoseParser(self.rtdose), self.structure, limit=500,
+            memory=1))
+
+class TestStreamingDVH(unittest.TestCase):
+    """Tests the chunked, bounded-memory DVH calculation."""
+
+    def setUp(self):
+        self.dose = dosegrid.DoseParser(create_rtdose())
+        self.structure = create_structure()
+
+    def test_chunked_dvh_matches_monolithic_dvh(self):
+        """The DVH must not depend on the number of frames per chunk."""
+        masks = dosestats.StructureMasks(self.dose, {1:self.structure})
+        reference = masks.GetSamples(1).GetDVH(limit=50)
+        # From a chunk of two frames up to the entire grid at once
+        for memory in [1, 200000, 2 ** 30]:
+            dvh = dosestats.calculate_dvh(
+                self.dose, self.structure, limit=50, memory=memory)
+            self.assertEqual(len(dvh.counts), len(reference.counts))
+            np.testing.assert_allclose(
+                dvh.counts, reference.counts, rtol=1e-9, atol=1e-9)
+
+    def test_structure_outside_of_grid(self):
+        """A structure outside of the dose grid has no DVH."""
+        structure = create_structure(cx=500)
+        self.assertIsNone(dosestats.calculate_dvh(self.dose, structure))
+
+class TestGridSamples(unittest.TestCase):
+    """Tests the isodose volumes of the sorted dose grid."""
+
+    def test_isodose_volume(self):
+        """The volume matches a scan of the dose grid for any scaling."""
+        ds = create_rtdose()
+        samples = dosestats.GridSamples(dosegrid.DoseParser(ds), chunksize=5)
+        doses = np.frombuffer(ds.PixelData, '<u4') * 1e-4
+        voxelvolume = 2.5 * 2.5 * 2.5 / 1000
+        for level, scale in [(0, 1), (35, 1), (35, 1.2), (50, 0.8), (4000, 1)]:
+            self.assertAlmostEqual(samples.GetVolumeAtDose(level, scale),
+                np.count_nonzero(doses * scale >= level) * voxelvolume)
+
+class TestDoseParser(unittest.TestCase):
+    """Tests the dose grid values that are read in chunks of frames."""
+
+    def setUp(self):
+        self.ds = create_rtdose()
+        self.pixels = np.frombuffer(self.ds.PixelData, '<u4').reshape(
+            (self.ds.NumberOfFrames, self.ds.Rows, self.ds.Columns))
+
+    def test_pixel_data_size(self):
+        """The size is determined from the header."""
+        self.assertEqual(dosegrid.get_pixel_data_size(self.ds),
+                         len(self.ds.PixelData))
+
+    def test_max_dose(self):
+        """The maximum dose is determined in chunks of frames."""
+        dose = dosegrid.DoseParser(self.ds)
+        self.assertAlmostEqual(dose.GetMaxDose(chunksize=3),
+                               float(np.amax(self.pixels)) * 1e-4)
+
+    def test_dose_frames(self):
+        """A range of frames is read without decoding the entire grid."""
+        np.testing.assert_array_equal(
+            dosegrid.get_dose_frames(self.ds, 3, 7), self.pixels[3:7])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_gamma.py
+"""Tests for the gamma analysis of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import copy, unittest
+import numpy as np
+from dicompyler import dosegrid, gamma
+from .test_dosestats import create_rtdose
+
+def create_blob(shift=0.0, scale=1.0, frames=8, size=14):
+    """Return an RT Dose dataset with a Gaussian dose distribution (Gy) on a
+        2.5 mm grid, shifted along the columns (mm) and scaled."""
+
+    ds = create_rtdose(frames, size, size)
+    x, y, z = dosegrid.get_grid_positions(ds)
+    x = x - x[size // 2] - shift
+    y = y - y[size // 2]
+    z = z - z[frames // 2]
+    dose = 60 * scale * np.exp(-(x[np.newaxis, np.newaxis, :] ** 2 +
+        y[np.newaxis, :, np.newaxis] ** 2 +
+        z[:, np.newaxis, np.newaxis] ** 2) / (2 * 10.0 ** 2))
+    ds.DoseGridScaling = 1e-5
+    ds.PixelData = np.round(dose / 1e-5).astype('<u4').tobytes()
+    return ds
+
+def reorient_rtdose(ds, orientation):
+    """Return a copy of the RT Dose dataset with the same dose at the same
+        patient coordinates in the given head first or feet first, supine or
+        prone orientation."""
+
+    x, y, z = dosegrid.get_grid_positions(ds)
+    pixels = dosegrid.get_dose_frames(ds)
+    ds = copy.deepcopy(ds)
+    # Start each reversed axis from its last position
+    direction = [orientation[0], orientation[4], orientation[0]]
+    for axis, positions in enumerate([x, y, z]):
+        if (direction[axis] < 0):
+            pixels = np.flip(pixels, 2 - axis)
+            ds.ImagePositionPatient[axis] = float(positions[-1])
+    ds.ImageOrientationPatient = orientation
+    ds.PixelData = np.ascontiguousarray(pixels).astype('<u4').tobytes()
+    return ds
+
+def brute_force_gamma(reference, evaluated, voxels, distance=3.0,
+                      dosecriteria=3.0, maxgamma=0.6, steps=60):
+    """Return the global gamma of the given (frame, row, column) voxels from
+        an exhaustive search of the interpolated evaluated grid, on a grid of
+        distance / 60 within the distance of maxgamma."""
+
+    refgrid = dosegrid.get_dose_frames(reference) * reference.DoseGridScaling
+    evalgrid = dosegrid.get_dose_frames(evaluated) * evaluated.DoseGridScaling
+    x, y, z = dosegrid.get_grid_positions(reference)
+    ex, ey, ez = dosegrid.get_grid_positions(evaluated)
+    dd = np.amax(refgrid) * dosecriteria / 100
+    r = np.arange(-maxgamma * steps, maxgamma * steps + 1) * distance / steps
+    dz, dy, dx = [d.ravel() for d in np.meshgrid(r, r, r, indexing='ij')]
+    results = []
+    for k, j, i in voxels:
+        values = gamma.interpolate_points(evalgrid,
+            (z[k] + dz - ez[0]) / (ez[1] - ez[0]),
+            (y[j] + dy - ey[0]) / (ey[1] - ey[0]),
+            (x[i] + dx - ex[0]) / (ex[1] - ex[0]))
+        g2 = (values - refgrid[k, j, i]) ** 2 / dd ** 2 + \
+            (dx ** 2 + dy ** 2 + dz ** 2) / distance ** 2
+        results.append(min(np.sqrt(np.nanmin(g2)), maxgamma))
+    return np.array(results)
+
+class TestGamma(unittest.TestCase):
+    """Tests the gamma index against an exhaustive search."""
+
+    def setUp(self):
+        self.reference = create_blob()
+        self.evaluated = create_blob(shift=1.3, scale=1.06)
+
+    def test_gamma_matches_brute_force(self):
+        """The gamma index is not overestimated by the search kernel."""
+        gammagrid, passrate = gamma.calculate_gamma(
+            self.reference, self.evaluated, maxgamma=1.5, threads=1)
+        voxels = [(4, 7, 7), (4, 7, 4), (3, 5, 9), (2, 7, 7), (5, 9, 5),
+                  (4, 2, 7), (6, 7, 10), (1, 4, 4)]
+        # The exhaustive search must cover the gamma of each of the voxels
+        expected = brute_force_gamma(self.reference, self.evaluated, voxels)
+        self.assertTrue(np.all(expected < 0.6))
+        np.testing.assert_allclose(
+            [gammagrid[v] for v in voxels], expected, atol=0.005)
+
+    def test_gamma_follows_orientation(self):
+        """Feet first and prone grids give the gamma of the same patient
+            coordinates, in chunks of any number of frames."""
+        expected, expectedrate = gamma.calculate_gamma(
+            self.reference, self.evaluated, maxgamma=1.5, threads=1)
+        for orientation in [[-1, 0, 0, 0, 1, 0], [-1, 0, 0, 0, -1, 0]]:
+            evaluated = reorient_rtdose(self.evaluated, orientation)
+            gammagrid, passrate = gamma.calculate_gamma(self.reference,
+                evaluated, maxgamma=1.5, chunksize=3, threads=2)
+            np.testing.assert_allclose(gammagrid, expected, atol=1e-4)
+            self.assertEqual(passrate, expectedrate)
+            # The gamma grid follows the orientation of the reference grid
+            reference = reorient_rtdose(self.reference, orientation)
+            gammagrid, passrate = gamma.calculate_gamma(reference,
+                self.evaluated, maxgamma=1.5, chunksize=3, threads=2)
+            np.testing.assert_allclose(
+                gammagrid, np.flip(expected, (0, 2) if
+                    (orientation[4] > 0) else (0, 1, 2)), atol=1e-4)
+            self.assertEqual(passrate, expectedrate)
+
+    def test_identical_doses_pass(self):
+        """Identical dose grids have a gamma of zero everywhere."""
+        gammagrid, passrate = gamma.calculate_gamma(
+            self.reference, self.reference, threads=1)
+        self.assertEqual(passrate, 100)
+        self.assertEqual(np.nanmax(gammagrid), 0)
+
+if __name__ == '__main__':
+    unittest.main()
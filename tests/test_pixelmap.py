@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_pixelmap.py
+"""Tests for the memory-mapped pixel data access of dicompyler."""
+# Copyright (c) 2017 Aditya Panchal
+# This file is part of dicompyler, released under a BSD license.
+#    See the file license.txt included with this distribution, also
+#    available at https://github.com/bastula/dicompyler/
+
+import os, shutil, tempfile, unittest
+import numpy as np
+try:
+    import pydicom as dicom
+    from pydicom.dataset import Dataset
+    from pydicom.uid import ExplicitVRLittleEndian, ExplicitVRBigEndian, \
+        RLELossless
+except ImportError:
+    import dicom
+    from dicom.dataset import Dataset
+    from dicom.UID import ExplicitVRLittleEndian, ExplicitVRBigEndian
+    RLELossless = None
+from dicompyler import pixelmap
+from .test_dosestats import create_rtdose
+
+def create_image(rows=24, columns=32, seed=2):
+    """Return an uncompressed in-memory CT image dataset with random signed
+        16-bit pixel values."""
+
+    ds = Dataset()
+    ds.file_meta = Dataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+    ds.file_meta.MediaStorageSOPInstanceUID = '1.2.3.6'
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+    ds.SOPInstanceUID = '1.2.3.6'
+    ds.Modality = 'CT'
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    pixels = np.random.RandomState(seed).randint(
+        -1024, 3000, (rows, columns)).astype(np.int16)
+    ds.PixelData = pixels.astype('<i2').tobytes()
+    return ds, pixels
+
+class TestPixelMap(unittest.TestCase):
+    """Tests the pixel data that is mapped from the file of a dataset."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Release the mapped files before they are removed
+        pixelmap.maps.clear()
+        pixelmap.clear_decoded_pixels()
+        shutil.rmtree(self.path)
+
+    def write(self, ds, name):
+        """Write the dataset to a file and return the dataset read from it."""
+
+        filename = os.path.join(self.path, name)
+        ds.save_as(filename, write_like_original=False)
+        return dicom.dcmread(filename)
+
+    def test_pixel_offset(self):
+        """The offset is where the pixel data value is in the file."""
+        ds, pixels = create_image()
+        ds = self.write(ds, 'ct.dcm')
+        filename, offset = pixelmap.get_pixel_offset(ds)
+        self.assertEqual(filename, ds.filename)
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            self.assertEqual(f.read(pixels.nbytes), pixels.tobytes())
+
+    def test_map_matches_pixel_array(self):
+        """The mapped image and dose frames match the pixel arrays."""
+        ds, pixels = create_image()
+        ds = self.write(ds, 'ct.dcm')
+        np.testing.assert_array_equal(pixelmap.get_pixel_map(ds)[0], pixels)
+        np.testing.assert_array_equal(pixelmap.get_image_pixels(ds), pixels)
+        np.testing.assert_array_equal(
+            pixelmap.get_image_pixels(ds), ds.pixel_array)
+        ds = self.write(create_rtdose(4, 6, 8), 'rtdose.dcm')
+        frames = pixelmap.get_pixel_map(ds)
+        self.assertEqual(frames.shape, (4, 6, 8))
+        np.testing.assert_array_equal(frames, ds.pixel_array)
+
+    def test_big_endian(self):
+        """Big endian pixel data is mapped with its byte order."""
+        ds, pixels = create_image()
+        ds.file_meta.TransferSyntaxUID = ExplicitVRBigEndian
+        ds.is_little_endian = False
+        ds.PixelData = pixels.astype('>i2').tobytes()
+        ds = self.write(ds, 'ct.dcm')
+        self.assertEqual(pixelmap.get_pixel_dtype(ds), np.dtype('>i2'))
+        np.testing.assert_array_equal(pixelmap.get_image_pixels(ds), pixels)
+
+    @unittest.skipIf(not hasattr(Dataset, 'compress'),
+                     "Compressing pixel data requires pydicom 2.2 or later")
+    def test_compressed_fallback(self):
+        """Compressed pixel data falls back to the decoded pixel array."""
+        ds, pixels = create_image()
+        ds.compress(RLELossless, pixels)
+        ds = self.write(ds, 'ct.dcm')
+        self.assertIsNone(pixelmap.get_pixel_map(ds))
+        np.testing.assert_array_equal(pixelmap.get_image_pixels(ds), pixels)
+
+    def test_replaced_pixel_data(self):
+        """Pixel data that replaces the data of the file is not mapped."""
+        ds, pixels = create_image()
+        ds = self.write(ds, 'ct.dcm')
+        ds.PixelData = (pixels + 1).astype('<i2').tobytes()
+        self.assertIsNone(pixelmap.get_pixel_offset(ds))
+        self.assertIsNone(pixelmap.get_pixel_map(ds))
+        np.testing.assert_array_equal(
+            pixelmap.get_image_pixels(ds), pixels + 1)
+
+    def test_decoded_pixels(self):
+        """Pixels that were decoded ahead of time are used until cleared."""
+        ds, pixels = create_image()
+        ds = self.write(ds, 'ct.dcm')
+        decoded = pixels * 2
+        pixelmap.set_decoded_pixels(ds, decoded)
+        self.assertIs(pixelmap.get_image_pixels(ds), decoded)
+        pixelmap.clear_decoded_pixels()
+        np.testing.assert_array_equal(pixelmap.get_image_pixels(ds), pixels)
+
+if __name__ == '__main__':
+    unittest.main()